@@ -1,12 +1,35 @@
+from django import forms
 from django.contrib import admin
+from . import counters
+from .autocomplete import AutocompleteSelect
 from .models import Book, Tag, BookTags, Favorite, Author, Editor, Theme, Type, Cover, Format, Seria, Place
+from .tagging import parse_tags, set_book_tags
 from django.contrib.admin import SimpleListFilter
 from mptt.admin import MPTTModelAdmin
 from django_mptt_admin.admin import DjangoMpttAdmin
 
 
+class BookAdminForm(forms.ModelForm):
+    tag_names = forms.CharField(label='Теги', required=False, help_text='Через запятую')
+
+    class Meta:
+        model = Book
+        fields = '__all__'
+        # Справочники с тысячами записей: варианты подгружаются по мере ввода
+        widgets = {name: AutocompleteSelect(name) for name in ('author', 'editor', 'theme', 'seria')}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial['tag_names'] = ', '.join(self.instance.tags.order_by('name').values_list('name', flat=True))
+
+    def clean_tag_names(self):
+        return parse_tags(self.cleaned_data['tag_names'])
+
+
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
+    form = BookAdminForm
     list_display = ('pk', 'title', 'author','year', 'pages', 'theme', 'status', 'controler')
     list_display_links = ('pk', 'title',)
     search_fields = ('title',)
@@ -17,23 +40,43 @@ class BookAdmin(admin.ModelAdmin):
 
     actions = ['set_checked', 'set_unchecked']
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        set_book_tags(form.instance, form.cleaned_data['tag_names'])
+
     @admin.action(description='Пометить как прочитанные')
     def set_checked(self, request, queryset):
-        updated_count = queryset.update(status=Book.Status.CHECKED)
+        updated_count = counters.set_status(queryset, Book.Status.CHECKED)
         self.message_user(request, f'{updated_count} книг было помечено как прочитанные')
 
     @admin.action(description='Пометить как непрочитанные')
     def set_unchecked(self, request, queryset):
-        updated_count = queryset.update(status=Book.Status.UNCHECKED)
+        updated_count = counters.set_status(queryset, Book.Status.UNCHECKED)
         self.message_user(request, f'{updated_count} книг было помечено как непрочитанные', 'warning')
 
 @admin.register(Author)
 class AuthorAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'sirname', 'name', 'fathername')
+    list_display = ('pk', 'sirname', 'name', 'fathername', 'books_count', 'read_count')
+
+class TagAdminForm(forms.ModelForm):
+
+    class Meta:
+        model = Tag
+        fields = '__all__'
+
+    def clean_name(self):
+        # Уникально нормализованное имя, а не введённое: "Фэнтези" и " фэнтези " - один тег
+        name = self.cleaned_data['name']
+        if Tag.objects.filter(normalized=Tag.normalize(name)).exclude(pk=self.instance.pk).exists():
+            raise forms.ValidationError('Такой тег уже есть')
+        return name
+
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'name')
+    form = TagAdminForm
+    list_display = ('pk', 'name', 'normalized', 'books_count', 'read_count')
+    search_fields = ('normalized',)
 
 @admin.register(BookTags)
 class BookTagsAdmin(admin.ModelAdmin):
@@ -49,7 +92,7 @@ class EditorAdmin(admin.ModelAdmin):
 
 @admin.register(Theme)
 class ThemeAdmin(MPTTModelAdmin):
-    list_display = ('pk', 'title')
+    list_display = ('pk', 'title', 'books_count', 'read_count')
 
 @admin.register(Type)
 class Type(admin.ModelAdmin):
@@ -64,8 +107,8 @@ class Format(admin.ModelAdmin):
 
 @admin.register(Seria)
 class Seria(admin.ModelAdmin):
-    list_display = ('pk', 'seria')
+    list_display = ('pk', 'seria', 'books_count', 'read_count')
 
 @admin.register(Place)
 class Place(admin.ModelAdmin):
-    list_display = ('pk', 'place')
\ No newline at end of file
+    list_display = ('pk', 'place', 'books_count', 'read_count')
\ No newline at end of file
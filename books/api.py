@@ -0,0 +1,309 @@
+"""
+JSON API каталога только для чтения (мобильное приложение, синхронизация).
+
+    books/api/books/?fields=id,title,author&limit=100&cursor=...&updated_since=2026-01-01T00:00:00
+    books/api/books/batch/?ids=1,2,3&fields=...
+    books/api/authors/, books/api/series/, books/api/tags/ - справочники с теми же fields, limit, cursor
+    books/api/themes/?root=<slug> - дерево тематик
+    books/api/favorites/ - избранное текущего пользователя (книги с теми же параметрами)
+
+fields - нужные поля (id выводится всегда); запрашиваются только колонки этих полей,
+справочники присоединяются тем же запросом, теги - одним запросом на страницу.
+Строки берутся через .values() и сразу переводятся в словари ответа, объекты моделей не создаются.
+
+Навигация - курсорная: next - непрозрачный подписанный курсор следующей страницы.
+С updated_since книги выводятся в порядке (updated_at, id): клиент запоминает updated_at
+последней полученной книги и в следующий раз запрашивает изменения после неё.
+Удалённые книги так не видны - их id возвращает в missing пакетный запрос.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET
+
+from .models import Author, Book, BookTags, Seria, Tag, Theme
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+MAX_BATCH = 500
+CURSOR_SALT = 'books.api.cursor'
+
+
+class ApiError(Exception):
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def api_view(view):
+    """GET-представление API: ошибки ApiError отдаются JSON-ответом с кодом ошибки."""
+    @require_GET
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            data = view(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({'error': str(error)}, status=error.status)
+        return JsonResponse(data, encoder=DjangoJSONEncoder, json_dumps_params={'ensure_ascii': False})
+    return wrapper
+
+
+def _value(path):
+    return (path,), lambda row: row[path]
+
+
+def _author_name(row):
+    parts = [row['author__sirname'], row['author__name'], row['author__fathername']]
+    return ' '.join(part for part in parts if part and part != '.') or None
+
+
+def _media_url(row):
+    return settings.MEDIA_URL + row['images_path'] if row['images_path'] else None
+
+
+def _book_tags(book_ids):
+    tags = {}
+    for book_id, name in (
+        BookTags.objects.filter(book_id__in=book_ids).order_by('tag__name').values_list('book_id', 'tag__name')
+    ):
+        tags.setdefault(book_id, []).append(name)
+    return tags
+
+
+# Хранимые счётчики книг справочника (books/counters.py)
+COUNTERS = {'books_count': _value('books_count'), 'read_count': _value('read_count')}
+
+
+class Resource:
+    """
+    Описание выводимых полей модели: имя поля ответа -> (пути для .values(), функция от строки).
+    related - поля, которые загружаются отдельным запросом на всю страницу: имя -> функция(ids) -> {id: значение}.
+    """
+
+    def __init__(self, model, fields, default, related=None):
+        self.model = model
+        self.fields = fields
+        self.related = related or {}
+        self.default = default
+
+    def parse_fields(self, request):
+        value = request.GET.get('fields')
+        if not value:
+            return list(self.default)
+        names = ['id'] + [name.strip() for name in value.split(',') if name.strip() and name.strip() != 'id']
+        unknown = [name for name in names if name not in self.fields and name not in self.related]
+        if unknown:
+            raise ApiError(f'Неизвестные поля: {", ".join(unknown)}')
+        return list(dict.fromkeys(names))
+
+    def paths(self, names):
+        paths = ['id']
+        for name in names:
+            if name in self.fields:
+                paths += [path for path in self.fields[name][0] if path not in paths]
+        return paths
+
+    def serialize(self, rows, names):
+        columns = [(name, self.fields[name][1]) for name in names if name in self.fields]
+        results = [{name: convert(row) for name, convert in columns} for row in rows]
+        for name in names:
+            if name in self.related:
+                values = self.related[name]([row['id'] for row in rows])
+                for item in results:
+                    item[name] = values.get(item['id'], [])
+        return results
+
+
+BOOKS = Resource(
+    Book,
+    fields={
+        'id': _value('id'),
+        'title': _value('title'),
+        'author_id': _value('author_id'),
+        'author': (('author__sirname', 'author__name', 'author__fathername'), _author_name),
+        'editor_id': _value('editor_id'),
+        'editor': _value('editor__name'),
+        'year': _value('year'),
+        'theme_id': _value('theme_id'),
+        'theme': _value('theme__title'),
+        'type': _value('type__type'),
+        'cover': _value('cover__cover'),
+        'format': _value('format__format'),
+        'seria_id': _value('seria_id'),
+        'seria': _value('seria__seria'),
+        'tom': _value('tom'),
+        'pages': _value('pages'),
+        'status': _value('status'),
+        'controler': _value('controler'),
+        'review': _value('review'),
+        'place': _value('place__place'),
+        'image': (('images_path',), _media_url),
+        'updated_at': _value('updated_at'),
+    },
+    related={'tags': _book_tags},
+    default=('id', 'title', 'author_id', 'author', 'year', 'theme_id', 'seria_id', 'tom', 'updated_at'),
+)
+AUTHORS = Resource(
+    Author,
+    fields={
+        'id': _value('id'),
+        'sirname': _value('sirname'),
+        'name': _value('name'),
+        'fathername': _value('fathername'),
+        **COUNTERS,
+    },
+    default=('id', 'sirname', 'name', 'fathername'),
+)
+SERIES = Resource(Seria, fields={'id': _value('id'), 'seria': _value('seria'), **COUNTERS}, default=('id', 'seria'))
+TAGS = Resource(Tag, fields={'id': _value('id'), 'name': _value('name'), **COUNTERS}, default=('id', 'name'))
+THEMES = Resource(
+    Theme,
+    fields={
+        'id': _value('id'),
+        'title': _value('title'),
+        'slug': _value('slug'),
+        'parent_id': _value('parent_id'),
+        'level': _value('level'),
+        **COUNTERS,
+    },
+    default=('id', 'title', 'slug'),
+)
+
+
+def parse_limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError('limit должен быть числом')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def parse_updated_since(request):
+    value = request.GET.get('updated_since')
+    if not value:
+        return None
+    since = parse_datetime(value)
+    if since is None:
+        raise ApiError('updated_since - дата и время в формате ISO 8601')
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def encode_cursor(values):
+    return signing.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values],
+                         salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token, ordering):
+    try:
+        values = signing.loads(token, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise ApiError('Некорректный курсор')
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise ApiError('Некорректный курсор')
+    if ordering[0] == 'updated_at':
+        values[0] = parse_datetime(values[0])
+    return values
+
+
+def paginate(request, resource, queryset, ordering=('id',)):
+    """Страница выборки по ключу ordering (последнее поле - id) и курсор следующей страницы."""
+    names = resource.parse_fields(request)
+    limit = parse_limit(request)
+    token = request.GET.get('cursor')
+    if token:
+        values = decode_cursor(token, ordering)
+        if len(ordering) == 1:
+            queryset = queryset.filter(id__gt=values[0])
+        else:
+            field, value = ordering[0], values[0]
+            queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': values[1]}))
+    paths = resource.paths(names)
+    paths += [field for field in ordering if field not in paths]
+    rows = list(queryset.order_by(*ordering).values(*paths)[:limit + 1])
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'results': resource.serialize(rows, names),
+        'next': encode_cursor([rows[-1][field] for field in ordering]) if has_next else None,
+    }
+
+
+@api_view
+def books(request):
+    since = parse_updated_since(request)
+    if since is None:
+        return paginate(request, BOOKS, Book.objects.all())
+    return paginate(request, BOOKS, Book.objects.filter(updated_at__gte=since), ordering=('updated_at', 'id'))
+
+
+@api_view
+def books_batch(request):
+    """Книги по списку id одним запросом; отсутствующие (удалённые) id - в missing."""
+    try:
+        ids = list(dict.fromkeys(int(value) for value in request.GET.get('ids', '').split(',') if value.strip()))
+    except ValueError:
+        raise ApiError('ids - список чисел через запятую')
+    if len(ids) > MAX_BATCH:
+        raise ApiError(f'Не больше {MAX_BATCH} книг за запрос')
+    names = BOOKS.parse_fields(request)
+    rows = {row['id']: row for row in Book.objects.filter(id__in=ids).values(*BOOKS.paths(names))}
+    found = [rows[book_id] for book_id in ids if book_id in rows]
+    return {
+        'results': BOOKS.serialize(found, names),
+        'missing': [book_id for book_id in ids if book_id not in rows],
+    }
+
+
+@api_view
+def authors(request):
+    return paginate(request, AUTHORS, Author.objects.all())
+
+
+@api_view
+def series(request):
+    # "Без серии" (id=1) - служебная запись
+    return paginate(request, SERIES, Seria.objects.exclude(id=1))
+
+
+@api_view
+def tags(request):
+    return paginate(request, TAGS, Tag.objects.all())
+
+
+@api_view
+def themes(request):
+    """Дерево тематик целиком (или поддерево ?root=<slug>): узлы с вложенным списком children."""
+    names = THEMES.parse_fields(request)
+    queryset = Theme.objects.all()
+    root = request.GET.get('root')
+    if root:
+        theme = Theme.objects.filter(slug=root).first()
+        if theme is None:
+            raise ApiError('Тематика не найдена', status=404)
+        queryset = theme.get_descendants(include_self=True)
+    paths = THEMES.paths(names) + ['parent_id']
+    rows = list(queryset.order_by('tree_id', 'lft').values(*paths))
+    nodes = {}
+    tree = []
+    for row, item in zip(rows, THEMES.serialize(rows, names)):
+        item['children'] = []
+        nodes[row['id']] = item
+        parent = nodes.get(row['parent_id'])
+        (parent['children'] if parent is not None else tree).append(item)
+    return {'results': tree}
+
+
+@api_view
+def favorites(request):
+    if not request.user.is_authenticated:
+        raise ApiError('Требуется вход', status=401)
+    return paginate(request, BOOKS, Book.objects.filter(favorite__user=request.user))
@@ -5,4 +5,7 @@ class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
     verbose_name = 'Книга'  # имя модели в единственном числе
-    verbose_name_plural = 'Книги'  # имя модели во множественном числе
\ No newline at end of file
+    verbose_name_plural = 'Книги'  # имя модели во множественном числе
+
+    def ready(self):
+        from . import signals  # noqa: F401 подключение обработчиков сигналов
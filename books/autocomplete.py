@@ -0,0 +1,88 @@
+"""
+Автодополнение для полей-ссылок формы книги и админки.
+
+Вместо <select> со всеми авторами (издательствами, сериями, тематиками) виджет
+AutocompleteSelect выводит только выбранное значение, а варианты подгружает по мере ввода
+из JSON-представления autocomplete(): поиск по префиксу нормализованного названия
+(поле normalized, см. NormalizedNameMixin). Префикс ищется диапазоном
+normalized >= q AND normalized < q + U+10FFFF, чтобы работал обычный индекс:
+LIKE в SQLite регистронезависим и индекс по нему не используется.
+Проверка значения при отправке формы - как у ModelChoiceField, один запрос по первичному ключу.
+"""
+from django import forms
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+
+from .models import Author, Editor, Seria, Theme, normalize_name
+
+SOURCES = {
+    'author': Author,
+    'editor': Editor,
+    'seria': Seria,
+    'theme': Theme,
+}
+LIMIT = 20
+MIN_LENGTH = 1
+
+
+def label(obj):
+    if isinstance(obj, Author):
+        return obj.name_for_search()
+    if isinstance(obj, Editor):
+        return f'{obj.name}, {obj.city}' if obj.city else obj.name
+    return str(obj)
+
+
+def search(model, query, limit=LIMIT):
+    prefix = normalize_name(query)
+    queryset = model.objects.order_by('normalized', 'pk')
+    if prefix:
+        queryset = queryset.filter(normalized__gte=prefix, normalized__lt=prefix + '\U0010ffff')
+    if model is Seria:
+        # "Без серии" - служебная запись, выбирается пустым значением поля
+        queryset = queryset.exclude(id=1)
+    return queryset[:limit]
+
+
+@require_GET
+def autocomplete(request, source):
+    model = SOURCES.get(source)
+    if model is None:
+        raise Http404('Неизвестный справочник')
+    query = request.GET.get('q', '')
+    objects = list(search(model, query, LIMIT + 1)) if len(query.strip()) >= MIN_LENGTH else []
+    return JsonResponse({
+        'results': [{'id': obj.pk, 'text': label(obj)} for obj in objects[:LIMIT]],
+        'more': len(objects) > LIMIT,
+    })
+
+
+class AutocompleteSelect(forms.Select):
+    """
+    <select>, в котором выводятся только выбранные значения; поле ввода для поиска
+    и загрузку вариантов добавляет books/js/autocomplete.js.
+    """
+
+    class Media:
+        js = ('books/js/autocomplete.js',)
+
+    def __init__(self, source, attrs=None):
+        super().__init__(attrs)
+        self.source = source
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-autocomplete-url'] = reverse('autocomplete', args=[self.source])
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        # Варианты - только пустой и выбранные; весь справочник не загружается
+        selected = [item for item in value if str(item).isdigit()]
+        field = getattr(self.choices, 'field', None)
+        empty_label = field.empty_label if field is not None and field.empty_label is not None else ''
+        options = [self.create_option(name, '', empty_label, not selected, 0)]
+        if selected and field is not None:
+            for index, obj in enumerate(field.queryset.filter(pk__in=selected), start=1):
+                options.append(self.create_option(name, obj.pk, label(obj), True, index))
+        return [(None, options, 0)]
@@ -0,0 +1,135 @@
+"""
+Замеры времени ответа и числа SQL-запросов основных страниц (команда `manage.py benchmark_views`).
+
+Страницы запрашиваются тестовым клиентом Django в текущей базе (обычно заполненной
+`manage.py seed_library`). Кэш на время замеров подменяется отдельным LocMemCache:
+каждая страница сначала открывается с пустым кэшем ("холодный" запрос), затем
+несколько раз подряд ("тёплые" запросы, берётся медиана).
+Отчёт - JSON; его можно сохранить как эталон и сравнивать с ним следующие замеры:
+страница считается ухудшившейся, если медиана выросла больше чем на threshold
+(и не меньше чем на min_delta_ms) или выросло число запросов.
+"""
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Book, Favorite, Seria, Tag, Theme
+
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmarks',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
+
+def build_cases():
+    """Список (название, адрес, пользователь) по данным текущей базы."""
+    book = Book.objects.order_by('id').first()
+    if book is None:
+        return []
+    theme = Theme.objects.filter(level=0).order_by('id').first()
+    seria = Seria.objects.exclude(id=1).order_by('-books_count', 'id').first()
+    tag = Tag.objects.order_by('-books_count', 'id').first()
+    favorite = Favorite.objects.values('user_id').annotate(n=Count('id')).order_by('-n', 'user_id').first()
+    reader = get_user_model().objects.get(pk=favorite['user_id']) if favorite else None
+    word = book.title.split()[0]
+
+    cases = [
+        ('catalog', reverse('catalog'), None),
+        ('catalog_search', f"{reverse('catalog')}?search_query={word}", None),
+        ('catalog_deep_page', f"{reverse('catalog')}?page=50", None),
+        ('series', reverse('series'), None),
+        ('detail', reverse('detail_book_by_id', args=[book.pk]), None),
+        ('reader', reverse('reader'), None),
+    ]
+    if theme is not None:
+        cases.append(('category', reverse('book-by-category', args=[theme.slug]), None))
+    if seria is not None:
+        cases.append(('seria_books', reverse('seria_books', args=[seria.pk]), None))
+    if tag is not None:
+        cases.append(('tag', reverse('get_books_by_tag', args=[tag.pk]), None))
+    if reader is not None:
+        cases.append(('profile_books', reverse('users:profile_books'), reader))
+    return cases
+
+
+def measure(client, url, repeat):
+    cache.clear()
+    with CaptureQueriesContext(connection) as cold_queries:
+        started = time.perf_counter()
+        response = client.get(url)
+        if hasattr(response, 'streaming_content'):
+            b''.join(response.streaming_content)
+        cold = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise RuntimeError(f'{url}: ответ {response.status_code}')
+
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as warm_queries:
+            started = time.perf_counter()
+            client.get(url)
+            timings.append(time.perf_counter() - started)
+    return {
+        'url': url,
+        'status': response.status_code,
+        'cold_ms': round(cold * 1000, 2),
+        'cold_queries': len(cold_queries),
+        'warm_ms': round(statistics.median(timings) * 1000, 2),
+        'warm_queries': len(warm_queries),
+    }
+
+
+def run(repeat=5, cases=None):
+    with override_settings(CACHES=BENCHMARK_CACHES, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        results = {}
+        for name, url, user in cases if cases is not None else build_cases():
+            client = Client()
+            if user is not None:
+                client.force_login(user)
+            results[name] = measure(client, url, repeat)
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'books': Book.objects.count(),
+        'repeat': repeat,
+        'cases': results,
+    }
+
+
+def compare(report, baseline, threshold=0.25, min_delta_ms=5.0):
+    """Список описаний ухудшений относительно эталона (пустой, если ухудшений нет)."""
+    regressions = []
+    for name, current in report['cases'].items():
+        previous = baseline.get('cases', {}).get(name)
+        if previous is None:
+            continue
+        for field in ('cold_ms', 'warm_ms'):
+            delta = current[field] - previous[field]
+            if delta > min_delta_ms and current[field] > previous[field] * (1 + threshold):
+                regressions.append(f'{name}: {field} {previous[field]} -> {current[field]}')
+        for field in ('cold_queries', 'warm_queries'):
+            if current[field] > previous[field]:
+                regressions.append(f'{name}: {field} {previous[field]} -> {current[field]}')
+    return regressions
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+        f.write('\n')
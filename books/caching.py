@@ -0,0 +1,67 @@
+"""
+Версионирование ключей кэша каталога.
+
+Все кэшируемые данные, зависящие от содержимого каталога (счётчики, фрагменты шаблонов),
+используют ключи с текущей версией каталога. Сигналы (books/signals.py) увеличивают версию при
+любом изменении книг, тегов, тематик и серий, после чего старые записи больше не читаются и
+вытесняются из кэша сами. Поэтому такие данные можно кэшировать надолго.
+
+Вместе с версией запоминается время изменения (stamp('catalog')) - по ним строятся ETag
+и Last-Modified списков (books/conditional.py). Такие же отметки времени есть у профиля
+и избранного каждого пользователя (stamp('user:<id>')).
+"""
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'catalog:version'
+STAMP_PREFIX = 'stamp'
+LONG_TIMEOUT = 60 * 60 * 24
+
+
+def initial_version():
+    # Версия, вытесненная из кэша, начинается заново не с 1, а с текущего времени в миллисекундах:
+    # иначе она повторила бы уже выданную, и снова читались бы записи, сохранённые при той версии
+    return int(time.time() * 1000)
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        initial = initial_version()
+        cache.add(VERSION_KEY, initial, None)
+        version = cache.get(VERSION_KEY, initial)
+    return version
+
+
+def bump_catalog_version():
+    touch('catalog')
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        version = initial_version()
+        cache.set(VERSION_KEY, version, None)
+        return version
+
+
+def versioned_key(*parts):
+    return ':'.join(['catalog', str(catalog_version()), *map(str, parts)])
+
+
+def touch(name):
+    cache.set(f'{STAMP_PREFIX}:{name}', time.time(), None)
+
+
+def stamp(name):
+    """Время последнего изменения; если отметка вытеснена из кэша, она начинается заново с текущего времени."""
+    key = f'{STAMP_PREFIX}:{name}'
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, time.time(), None)
+        value = cache.get(key, time.time())
+    return value
+
+
+def catalog_stamp():
+    """(версия каталога, время её изменения) - двумя чтениями из кэша."""
+    return catalog_version(), stamp('catalog')
@@ -0,0 +1,71 @@
+"""
+Условные GET-запросы (If-None-Match / If-Modified-Since) для страниц книг и списков.
+
+Декораторы condition() из Django вычисляют ETag и Last-Modified до вызова представления,
+поэтому ответ 304 Not Modified обходится без основных запросов к базе:
+- списки - по версии и времени изменения каталога из кэша (books/caching.py);
+- описание книги - по полю Book.updated_at, одним запросом по первичному ключу.
+Страницы вошедшего пользователя зависят ещё от него самого (права, отметки "в избранном"),
+поэтому в ETag входят id пользователя и время изменения его профиля и избранного, а Last-Modified
+для них не отдаётся: по одной дате нельзя отличить страницу другого пользователя.
+"""
+import hashlib
+from datetime import datetime, timezone
+
+from django.views.decorators.http import condition
+
+from . import caching
+from .models import Book
+
+
+def _etag(*parts):
+    return hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def _user_part(request):
+    user = request.user
+    if not user.is_authenticated:
+        return 'anonymous'
+    return f'{user.pk}:{caching.stamp(f"user:{user.pk}")}'
+
+
+def _catalog_stamp(request):
+    # Функции ETag и Last-Modified вызываются обе, отметка читается из кэша один раз
+    if not hasattr(request, '_catalog_stamp'):
+        request._catalog_stamp = caching.catalog_stamp()
+    return request._catalog_stamp
+
+
+def list_etag(request, *args, **kwargs):
+    version, modified = _catalog_stamp(request)
+    return _etag(request.get_full_path(), version, modified, _user_part(request))
+
+
+def list_last_modified(request, *args, **kwargs):
+    if request.user.is_authenticated:
+        return None
+    return datetime.fromtimestamp(_catalog_stamp(request)[1], tz=timezone.utc)
+
+
+def _book_updated_at(request, pk):
+    if not hasattr(request, '_book_updated_at'):
+        request._book_updated_at = Book.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    return request._book_updated_at
+
+
+def book_etag(request, pk, **kwargs):
+    updated_at = _book_updated_at(request, pk)
+    if updated_at is None:
+        # Книги нет - представление ответит 404
+        return None
+    return _etag('book', pk, updated_at.isoformat(), _user_part(request))
+
+
+def book_last_modified(request, pk, **kwargs):
+    if request.user.is_authenticated:
+        return None
+    return _book_updated_at(request, pk)
+
+
+list_condition = condition(etag_func=list_etag, last_modified_func=list_last_modified)
+book_condition = condition(etag_func=book_etag, last_modified_func=book_last_modified)
@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .caching import catalog_version
+
+
+def catalog(request):
+    # Версия каталога для ключей {% cache %}; читается из кэша, только если шаблон её использует
+    return {'catalog_version': SimpleLazyObject(catalog_version)}
@@ -0,0 +1,211 @@
+"""
+Хранимые счётчики книг у тематик, тегов, серий, авторов и мест хранения.
+
+У каждого такого справочника есть поля books_count и read_count (BookCountersMixin),
+поэтому дерево тематик, теги в карточках и список серий выводятся с количествами
+тем же запросом, что и сами записи, без COUNT на каждый узел. Тематика считает книги
+всего поддерева: книга учитывается у своей тематики и у всех тематик выше по дереву.
+
+Счётчики меняются приращениями F() одним UPDATE на группу записей с одинаковым
+приращением, в одной транзакции на изменение:
+- сохранение и удаление книги, строки BookTags, book.tags.add() - сигналы (books/signals.py);
+- назначение тегов пакетом - sync_tags() (books/tagging.py);
+- смена статуса прочтения в админке - set_status().
+Пакетная вставка книг при импорте и генерации данных сигналов не отправляет, после неё
+(и после правок в обход ORM) счётчики пересчитываются целиком: recount(), `manage.py recount`.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Greatest
+
+from . import pagecache
+from .models import Author, Book, BookTags, Place, Seria, Tag, Theme
+
+# Поле книги -> справочник, у которого книга учитывается
+FIELDS = {'theme': Theme, 'seria': Seria, 'author': Author, 'place': Place}
+BATCH_SIZE = 500
+
+
+def book_key(book):
+    """Что книга вносит в счётчики: (id тематики, серии, автора, места хранения, прочитана ли)."""
+    return (*(getattr(book, f'{field}_id') for field in FIELDS), bool(book.status))
+
+
+class Deltas:
+    """Накопленные приращения счётчиков: справочник -> {id: [книг, прочитанных]}."""
+
+    def __init__(self):
+        self.values = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+
+    def add(self, model, pk, books, read):
+        if pk is not None:
+            value = self.values[model][pk]
+            value[0] += books
+            value[1] += read
+
+    def add_book(self, key, sign):
+        *ids, status = key
+        for model, pk in zip(FIELDS.values(), ids):
+            self.add(model, pk, sign, sign if status else 0)
+
+    def add_tags(self, pairs, read_ids, sign):
+        for book_id, tag_id in pairs:
+            self.add(Tag, tag_id, sign, sign if book_id in read_ids else 0)
+
+    def apply(self):
+        changed = False
+        with transaction.atomic():
+            for model, values in self.values.items():
+                values = {pk: value for pk, value in values.items() if value[0] or value[1]}
+                if model is Theme and values:
+                    values = _with_ancestors(values)
+                groups = defaultdict(list)
+                for pk, (books, read) in values.items():
+                    groups[books, read].append(pk)
+                for (books, read), ids in groups.items():
+                    # Разошедшийся с книгами счётчик не уходит в минус, его исправит recount()
+                    model.objects.filter(pk__in=ids).update(
+                        books_count=Greatest(F('books_count') + books, Value(0)),
+                        read_count=Greatest(F('read_count') + read, Value(0)),
+                    )
+                    changed = True
+        if changed:
+            pagecache.purge('counters')
+        self.values.clear()
+
+
+def _with_ancestors(values):
+    # Приращение тематики достаётся и всем её предкам; у общих предков приращения складываются
+    nodes = dict((pk, rest) for pk, *rest in Theme.objects.filter(pk__in=values).values_list(
+        'pk', 'tree_id', 'lft', 'rght',
+    ))
+    ancestors = Theme.objects.get_queryset_ancestors(Theme.objects.filter(pk__in=values), include_self=True)
+    result = defaultdict(lambda: [0, 0])
+    for pk, tree_id, lft, rght in ancestors.values_list('pk', 'tree_id', 'lft', 'rght'):
+        for node_pk, (node_tree_id, node_lft, node_rght) in nodes.items():
+            if node_tree_id == tree_id and lft <= node_lft and node_rght <= rght:
+                result[pk][0] += values[node_pk][0]
+                result[pk][1] += values[node_pk][1]
+    return result
+
+
+def _read_ids(book_ids):
+    return set(Book.objects.filter(pk__in=set(book_ids), status=True).values_list('pk', flat=True))
+
+
+def book_saved(old_key, new_key, book_id):
+    """Книга создана (old_key=None) или изменена: старые значения уходят из счётчиков, новые добавляются."""
+    if old_key == new_key:
+        return
+    deltas = Deltas()
+    if old_key is not None:
+        deltas.add_book(old_key, -1)
+    deltas.add_book(new_key, 1)
+    if old_key is not None and old_key[-1] != new_key[-1]:
+        # Смена статуса меняет и число прочитанных у тегов книги
+        sign = 1 if new_key[-1] else -1
+        for tag_id in BookTags.objects.filter(book_id=book_id).values_list('tag_id', flat=True):
+            deltas.add(Tag, tag_id, 0, sign)
+    deltas.apply()
+
+
+def book_deleted(key):
+    # Строки BookTags удаляются каскадом раньше книги, теги учитывают их сигналы
+    deltas = Deltas()
+    deltas.add_book(key, -1)
+    deltas.apply()
+
+
+def tags_changed(added=(), removed=()):
+    """Связи книга-тег добавлены или удалены; added и removed - пары (id книги, id тега)."""
+    added, removed = list(added), list(removed)
+    if not added and not removed:
+        return
+    read_ids = _read_ids(book_id for book_id, _ in added + removed)
+    deltas = Deltas()
+    deltas.add_tags(added, read_ids, 1)
+    deltas.add_tags(removed, read_ids, -1)
+    deltas.apply()
+
+
+def set_status(queryset, status):
+    """Меняет статус прочтения книг выборки (без сигналов сохранения). Возвращает число изменённых книг."""
+    status = bool(status)
+    sign = 1 if status else -1
+    with transaction.atomic():
+        rows = list(Book.objects.filter(pk__in=queryset.values('pk')).exclude(status=status).values_list(
+            'pk', *(f'{field}_id' for field in FIELDS),
+        ))
+        book_ids = [pk for pk, *_ in rows]
+        if not book_ids:
+            return 0
+        updated = Book.objects.filter(pk__in=book_ids).update(status=status)
+        deltas = Deltas()
+        for pk, *ids in rows:
+            for model, related_id in zip(FIELDS.values(), ids):
+                deltas.add(model, related_id, 0, sign)
+        for tag_id in BookTags.objects.filter(book_id__in=book_ids).values_list('tag_id', flat=True):
+            deltas.add(Tag, tag_id, 0, sign)
+        deltas.apply()
+    return updated
+
+
+# Полный пересчёт
+
+def _store(model, counts):
+    # Записываются только разошедшиеся значения
+    changed = []
+    for obj in model.objects.only('pk', 'books_count', 'read_count').iterator(chunk_size=2000):
+        books, read = counts.get(obj.pk, (0, 0))
+        if (obj.books_count, obj.read_count) != (books, read):
+            obj.books_count, obj.read_count = books, read
+            changed.append(obj)
+    model.objects.bulk_update(changed, ['books_count', 'read_count'], batch_size=BATCH_SIZE)
+    return len(changed)
+
+
+def _direct_counts(queryset, field, read_filter):
+    return {
+        pk: (books, read)
+        for pk, books, read in queryset.order_by().values(field).annotate(
+            books=Count('pk'), read=Count('pk', filter=read_filter),
+        ).values_list(field, 'books', 'read')
+        if pk is not None
+    }
+
+
+def theme_counts():
+    """{id тематики: (книг, прочитанных)} вместе с подтемами."""
+    counts = defaultdict(lambda: [0, 0])
+    for pk, (books, read) in _direct_counts(Book.objects.all(), 'theme', Q(status=True)).items():
+        counts[pk] = [books, read]
+    # Снизу вверх: каждая тематика добавляет свои итоги родителю
+    for pk, parent_id in Theme.objects.order_by('-level').values_list('pk', 'parent_id'):
+        if parent_id is not None and pk in counts:
+            counts[parent_id][0] += counts[pk][0]
+            counts[parent_id][1] += counts[pk][1]
+    return {pk: tuple(value) for pk, value in counts.items()}
+
+
+def recount_themes():
+    with transaction.atomic():
+        changed = _store(Theme, theme_counts())
+    if changed:
+        pagecache.purge('counters')
+    return changed
+
+
+def recount():
+    """Пересчитывает все счётчики по книгам. Возвращает {справочник: число исправленных записей}."""
+    result = {}
+    with transaction.atomic():
+        result[Theme] = _store(Theme, theme_counts())
+        for field, model in FIELDS.items():
+            if model is not Theme:
+                result[model] = _store(model, _direct_counts(Book.objects.all(), field, Q(status=True)))
+        result[Tag] = _store(Tag, _direct_counts(BookTags.objects.all(), 'tag', Q(book__status=True)))
+    if any(result.values()):
+        pagecache.purge('counters')
+    return result
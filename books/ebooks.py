@@ -0,0 +1,309 @@
+"""
+Чтение электронных книг в браузере по главам.
+
+Файл книги разбирается один раз: в ChapterIndex запоминается оглавление - для каждой главы
+заголовок и место в файле, по которому её можно прочитать, не разбирая остальной книги:
+- FB2 - байтовые смещения начала и конца раздела <section> (pyexpat сообщает позицию
+  каждого тега), в индекс попадают разделы без вложенных разделов;
+- EPUB - имя файла главы в архиве (порядок <spine>), zip позволяет прочитать его отдельно;
+- TXT - байтовые смещения страниц примерно по PAGE_BYTES, разрезанных по границам строк.
+Глава отдаётся небольшим HTML-фрагментом только из разрешённых тегов, без атрибутов.
+Фрагменты кэшируются по sha256 файла и номеру главы: при замене файла меняются и ключи,
+поэтому время ожидания первой страницы не зависит от размера книги.
+"""
+import html
+import re
+import zipfile
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+from xml.parsers import expat
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+from .caching import LONG_TIMEOUT
+from .fulltext import epub_spine, file_hash, txt_encoding
+from .models import ChapterIndex
+
+PAGE_BYTES = 16 * 1024
+TITLE_LENGTH = 80
+FRAGMENT_PREFIX = 'reader:fragment'
+FORMATS = ('.fb2', '.epub', '.txt')
+SPACE_RE = re.compile(r'\s+')
+
+
+class ReaderError(Exception):
+    pass
+
+
+def _short(text):
+    text = SPACE_RE.sub(' ', text or '').strip()
+    return text if len(text) <= TITLE_LENGTH else text[:TITLE_LENGTH - 1] + '…'
+
+
+def book_format(name):
+    name = (name or '').lower()
+    return next((fmt for fmt in FORMATS if name.endswith(fmt)), None)
+
+
+def _local(name):
+    return name.rsplit(':', 1)[-1]
+
+
+# Оглавление: список [заголовок, начало, конец] (для EPUB вместо смещений - имя файла главы)
+
+def _index_fb2(f):
+    parser = expat.ParserCreate()
+    state = {'encoding': 'utf-8', 'body': None, 'title': None}
+    stack = []
+    chapters = []
+
+    def declaration(version, encoding, standalone):
+        state['encoding'] = encoding or 'utf-8'
+
+    def start(name, attrs):
+        tag = _local(name)
+        if tag == 'body' and state['body'] is None:
+            # Примечания (<body name="notes">) в оглавление не входят
+            if attrs.get('name') != 'notes':
+                state['body'] = {'start': parser.CurrentByteIndex, 'found': False}
+        elif tag == 'section' and state['body'] is not None and state['body'] is not True:
+            if stack:
+                stack[-1]['nested'] = True
+            stack.append({'start': parser.CurrentByteIndex, 'title': '', 'nested': False, 'name': name})
+        elif tag == 'title' and stack and not stack[-1]['title'] and state['title'] is None:
+            state['title'] = []
+
+    def data(text):
+        if state['title'] is not None:
+            state['title'].append(text)
+
+    def end(name):
+        tag = _local(name)
+        if tag == 'p' and state['title'] is not None:
+            state['title'].append(' ')
+        elif tag == 'title' and state['title'] is not None:
+            stack[-1]['title'] = _short(''.join(state['title']))
+            state['title'] = None
+        elif tag == 'section' and stack:
+            node = stack.pop()
+            if not node['nested']:
+                parent = stack[-1]['title'] if stack else ''
+                chapters.append([node['title'] or parent, node['start'], parser.CurrentByteIndex, node['name']])
+                state['body']['found'] = True
+        elif tag == 'body' and isinstance(state['body'], dict):
+            if not state['body']['found']:
+                # Книга без разделов - одна глава
+                chapters.append(['', state['body']['start'], parser.CurrentByteIndex, name])
+            state['body'] = True
+
+    parser.XmlDeclHandler = declaration
+    parser.StartElementHandler = start
+    parser.CharacterDataHandler = data
+    parser.EndElementHandler = end
+    try:
+        parser.ParseFile(f)
+    except expat.ExpatError as error:
+        raise ReaderError(f'Ошибка в FB2: {error}')
+    return state['encoding'], chapters
+
+
+class _HeadingFinder(HTMLParser):
+    """Текст первого заголовка h1-h3 главы EPUB (разбор останавливается на нём)."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text = None
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('h1', 'h2', 'h3') and self.text is None:
+            self.text = []
+
+    def handle_endtag(self, tag):
+        if tag in ('h1', 'h2', 'h3') and self.text is not None:
+            self.done = True
+
+    def handle_data(self, data):
+        if self.text is not None and not self.done:
+            self.text.append(data)
+
+
+def _index_epub(f):
+    chapters = []
+    try:
+        with zipfile.ZipFile(f) as archive:
+            for name in epub_spine(archive):
+                finder = _HeadingFinder()
+                with archive.open(name) as chapter:
+                    while not finder.done and (block := chapter.read(16 * 1024)):
+                        finder.feed(block.decode('utf-8', errors='ignore'))
+                chapters.append([_short(''.join(finder.text or '')), name, None])
+    except (zipfile.BadZipFile, KeyError, StopIteration, ElementTree.ParseError) as error:
+        raise ReaderError(f'Ошибка в EPUB: {error}')
+    return 'utf-8', chapters
+
+
+def _index_txt(f):
+    encoding = txt_encoding(f)
+    chapters = []
+    start = position = 0
+    title = ''
+    for line in f:
+        if not title and line.strip():
+            title = _short(line.decode(encoding, errors='replace'))
+        position += len(line)
+        if position - start >= PAGE_BYTES:
+            chapters.append([title, start, position])
+            start, title = position, ''
+    if position > start or not chapters:
+        chapters.append([title, start, position])
+    return encoding, chapters
+
+
+INDEXERS = {'.fb2': _index_fb2, '.epub': _index_epub, '.txt': _index_txt}
+
+
+def build_index(book):
+    name = book.file_path.name
+    fmt = book_format(name)
+    if fmt is None:
+        raise ReaderError('Формат файла не поддерживается')
+    with default_storage.open(name, 'rb') as f:
+        encoding, chapters = INDEXERS[fmt](f)
+    index, _ = ChapterIndex.objects.update_or_create(book_id=book.pk, defaults={
+        'file_name': name, 'content_hash': file_hash(name), 'format': fmt[1:],
+        'encoding': encoding, 'chapters': chapters,
+    })
+    return index
+
+
+def get_index(book):
+    """Оглавление книги; строится заново, только если у книги другой файл."""
+    if not book.file_path:
+        raise ReaderError('У книги нет файла')
+    index = ChapterIndex.objects.filter(book_id=book.pk).first()
+    if index is None or index.file_name != book.file_path.name:
+        index = build_index(book)
+    return index
+
+
+# Фрагменты глав
+
+FB2_TAGS = {
+    'p': 'p', 'v': 'p', 'text-author': 'p', 'subtitle': 'h4', 'title': 'h3',
+    'emphasis': 'em', 'strong': 'strong', 'strikethrough': 's', 'sub': 'sub', 'sup': 'sup', 'code': 'code',
+    'epigraph': 'blockquote', 'cite': 'blockquote', 'poem': 'div', 'stanza': 'div',
+}
+
+
+def _render_fb2(data, encoding, tag):
+    out = []
+    state = {'title': 0}
+
+    def start(name, attrs):
+        local = _local(name)
+        if local == 'title':
+            state['title'] += 1
+        if local == 'empty-line':
+            out.append('<br>')
+        elif local == 'p' and state['title']:
+            return
+        elif local in FB2_TAGS:
+            out.append(f'<{FB2_TAGS[local]}>')
+
+    def end(name):
+        local = _local(name)
+        if local == 'title':
+            state['title'] -= 1
+        if local == 'p' and state['title']:
+            out.append(' ')
+        elif local in FB2_TAGS:
+            out.append(f'</{FB2_TAGS[local]}>')
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = lambda text: out.append(html.escape(text))
+    try:
+        parser.Parse(f'<?xml version="1.0" encoding="{encoding}"?>'.encode('ascii') + data
+                     + f'</{tag}>'.encode(encoding), True)
+    except expat.ExpatError as error:
+        raise ReaderError(f'Ошибка в FB2: {error}')
+    return ''.join(out)
+
+
+class _SafeHTML(HTMLParser):
+    """XHTML главы EPUB без стилей, скриптов, картинок и атрибутов."""
+    ALLOWED = {
+        'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'em', 'strong', 'i', 'b', 'u', 's', 'sub', 'sup',
+        'blockquote', 'ul', 'ol', 'li', 'pre', 'code',
+    }
+    VOID = {'br', 'hr'}
+    SKIP = {'script', 'style', 'head', 'svg', 'math'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skip += 1
+        elif not self.skip and (tag in self.ALLOWED or tag in self.VOID):
+            self.out.append(f'<{tag}>')
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.skip and tag in self.VOID:
+            self.out.append(f'<{tag}>')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skip = max(self.skip - 1, 0)
+        elif not self.skip and tag in self.ALLOWED:
+            self.out.append(f'</{tag}>')
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.out.append(html.escape(data))
+
+
+def _render_txt(data, encoding):
+    lines = data.decode(encoding, errors='replace').splitlines()
+    return ''.join(f'<p>{html.escape(line.strip())}</p>' for line in lines if line.strip())
+
+
+def render_chapter(index, number):
+    chapter = index.chapters[number]
+    name = index.file_name
+    if index.format == 'epub':
+        parser = _SafeHTML()
+        try:
+            with default_storage.open(name, 'rb') as f, zipfile.ZipFile(f) as archive:
+                parser.feed(archive.read(chapter[1]).decode('utf-8', errors='replace'))
+        except (zipfile.BadZipFile, KeyError) as error:
+            raise ReaderError(f'Ошибка в EPUB: {error}')
+        parser.close()
+        return ''.join(parser.out)
+    with default_storage.open(name, 'rb') as f:
+        f.seek(chapter[1])
+        data = f.read(chapter[2] - chapter[1])
+    if index.format == 'fb2':
+        return _render_fb2(data, index.encoding, chapter[3])
+    return _render_txt(data, index.encoding)
+
+
+def chapter_fragment(index, number):
+    """HTML-фрагмент главы number (с нуля) из кэша; IndexError - такой главы нет."""
+    if not 0 <= number < len(index.chapters):
+        raise IndexError(number)
+    key = f'{FRAGMENT_PREFIX}:{index.content_hash}:{number}'
+    fragment = cache.get(key)
+    if fragment is None:
+        fragment = render_chapter(index, number)
+        cache.set(key, fragment, LONG_TIMEOUT)
+    return fragment
+
+
+def chapter_titles(index):
+    return [title or f'Глава {number}' for number, (title, *_) in enumerate(index.chapters, start=1)]
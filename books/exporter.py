@@ -0,0 +1,114 @@
+"""
+Потоковая выгрузка каталога в CSV и JSON Lines.
+
+Книги читаются из базы порциями через .iterator() в виде словарей .values() с уже
+присоединёнными автором, издательством, серией и справочниками; теги подгружаются
+одним запросом на порцию, пути тематик строятся по дереву, загруженному один раз.
+Поэтому расход памяти не зависит от размера каталога. Названия колонок совпадают
+с форматом импорта (books/importer.py), выгрузку можно загрузить обратно.
+"""
+import csv
+import json
+from itertools import islice
+
+from .filters import filter_catalog
+from .models import Book, BookTags, Theme
+
+CHUNK_SIZE = 2000
+
+COLUMNS = [
+    'id', 'title', 'author', 'editor', 'editor_city', 'year', 'theme', 'type', 'cover', 'format',
+    'seria', 'tom', 'pages', 'status', 'controler', 'review', 'place', 'tags', 'images_path',
+]
+
+VALUES = (
+    'id', 'title', 'year', 'tom', 'pages', 'status', 'controler', 'review', 'images_path', 'file_path',
+    'theme_id', 'author__sirname', 'author__name', 'author__fathername', 'editor__name', 'editor__city',
+    'type__type', 'cover__cover', 'format__format', 'seria__seria', 'place__place',
+)
+
+
+def theme_paths():
+    themes = {pk: (title, parent_id) for pk, title, parent_id in Theme.objects.values_list('id', 'title', 'parent_id')}
+    paths = {}
+
+    def path(pk):
+        if pk not in paths:
+            title, parent_id = themes[pk]
+            paths[pk] = f'{path(parent_id)}/{title}' if parent_id else title
+        return paths[pk]
+
+    for pk in themes:
+        path(pk)
+    return paths
+
+
+def export_rows(params, include_files=False):
+    """Генератор словарей-строк выгрузки для книг, отобранных как на странице каталога."""
+    queryset = filter_catalog(Book.objects.all(), params).values(*VALUES)
+    paths = theme_paths()
+    rows = queryset.iterator(chunk_size=CHUNK_SIZE)
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            return
+        tags = {}
+        for book_id, name in (
+            BookTags.objects.filter(book_id__in=[row['id'] for row in chunk])
+            .order_by('tag__name').values_list('book_id', 'tag__name')
+        ):
+            tags.setdefault(book_id, []).append(name)
+        for row in chunk:
+            author = [
+                part for part in (row['author__sirname'], row['author__name'], row['author__fathername'])
+                if part and part != '.'
+            ]
+            item = {
+                'id': row['id'],
+                'title': row['title'],
+                'author': ' '.join(author),
+                'editor': row['editor__name'] or '',
+                'editor_city': row['editor__city'] or '',
+                'year': row['year'],
+                'theme': paths.get(row['theme_id'], ''),
+                'type': row['type__type'] or '',
+                'cover': row['cover__cover'] or '',
+                'format': row['format__format'] or '',
+                'seria': row['seria__seria'] or '',
+                'tom': row['tom'],
+                'pages': row['pages'],
+                'status': int(row['status']),
+                'controler': int(row['controler']),
+                'review': row['review'],
+                'place': row['place__place'] or '',
+                'tags': ','.join(tags.get(row['id'], [])),
+                'images_path': row['images_path'],
+            }
+            if include_files:
+                item['file_path'] = row['file_path']
+            yield item
+
+
+class Echo:
+    # Псевдо-файл для csv.writer: возвращает строку вместо записи в буфер
+    def write(self, value):
+        return value
+
+
+def export_csv(params, include_files=False):
+    columns = COLUMNS + ['file_path'] if include_files else COLUMNS
+    writer = csv.DictWriter(Echo(), fieldnames=columns)
+    yield '\ufeff' + writer.writeheader()  # BOM, чтобы Excel распознал UTF-8
+    for row in export_rows(params, include_files):
+        yield writer.writerow(row)
+
+
+def export_jsonl(params, include_files=False):
+    for row in export_rows(params, include_files):
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+FORMATS = {
+    'csv': (export_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (export_jsonl, 'application/x-ndjson; charset=utf-8'),
+}
@@ -0,0 +1,566 @@
+"""
+Фасетный отбор каталога: автор, издательство, тематика (с подрубриками), тип, обложка, формат,
+серия, место хранения, статус прочтения, контроль, диапазон годов и теги.
+
+Сама выборка книг фильтруется в SQL (books/filters.py), а количество книг для каждого значения
+каждого фасета считается по индексу в памяти процесса, без GROUP BY на каждый фасет:
+- у каждой книги есть номер строки; значения полей хранятся списками по строкам;
+- для частых значений фасета хранится битовая маска строк (целое число Python),
+  пересечение с текущей выборкой и подсчёт - это `(a & b).bit_count()`;
+- если выборка небольшая (или, наоборот, почти весь каталог), значения подсчитываются
+  проходом по строкам выборки (или её дополнения) через itertools.compress и Counter.
+Количество для значений фасета считается по выборке без учёта отбора по самому этому фасету,
+поэтому внутри фасета значения объединяются (ИЛИ), между фасетами - пересекаются (И).
+
+Индекс строится при первом обращении и обновляется по сигналам (books/signals.py) только для
+изменённых книг. Изменения из других процессов обнаруживаются по версии каталога
+(books/caching.py): каждое изменение оставляет в общем кэше запись журнала - id изменённых книг
+для своей версии, и отставший индекс применяет записи пропущенных версий. Полностью индекс
+строится заново, только если в журнале пробел: изменились справочники, запись вытеснена
+или версий пропущено больше MAX_REPLAY.
+"""
+import re
+import threading
+from collections import Counter, OrderedDict
+from itertools import chain, compress, count, repeat
+from operator import contains, eq
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import QueryDict
+
+from . import caching, search
+from .models import Author, Book, BookTags, Cover, Editor, Format, Place, Seria, Tag, Theme, Type
+
+# Фасеты с одним значением у книги: (параметр запроса, заголовок, поле Book)
+FIELDS = (
+    ('author', 'Автор', 'author_id'),
+    ('editor', 'Издательство', 'editor_id'),
+    ('type', 'Тип книги', 'type_id'),
+    ('cover', 'Обложка', 'cover_id'),
+    ('format', 'Формат', 'format_id'),
+    ('seria', 'Серия', 'seria_id'),
+    ('place', 'Место хранения', 'place_id'),
+    ('status', 'Прочитано', 'status'),
+    ('controler', 'На контроле', 'controler'),
+)
+BOOLEAN_FACETS = ('status', 'controler')
+
+# Битовые маски хранятся не более чем для стольких самых частых значений фасета
+MAX_BITSETS = 128
+# Выборки (или их дополнения) не больше этого размера подсчитываются проходом по строкам
+ROW_SCAN_LIMIT = 25000
+# Сколько значений фасета показывать
+LIMIT = 15
+RESULTS_CACHE_SIZE = 256
+# Журнал изменений каталога для индексов других процессов
+CHANGES_TIMEOUT = 60 * 60
+MAX_REPLAY = 1000
+
+_EXPAND = [bytes((byte >> bit) & 1 for bit in range(8)) for byte in range(256)]
+_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+_NONZERO = re.compile(rb'[^\x00]')
+
+
+def bits_from_positions(positions, size):
+    data = bytearray((size + 7) >> 3)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+def positions(mask):
+    # Номера установленных битов; нулевые байты пропускаются поиском по регулярному выражению
+    data = mask.to_bytes((mask.bit_length() + 7) >> 3, 'little')
+    for match in _NONZERO.finditer(data):
+        offset = match.start()
+        for bit in _BITS[data[offset]]:
+            yield (offset << 3) + bit
+
+
+def selector(mask, size):
+    # Маска -> последовательность 0/1 по строкам для itertools.compress
+    data = mask.to_bytes((size + 7) >> 3 or 1, 'little')
+    return b''.join(map(_EXPAND.__getitem__, data))[:size]
+
+
+class Facet:
+    """Значения одного поля по строкам индекса, маски частых значений и общие количества."""
+
+    def __init__(self, multi=False, all_bitsets=False):
+        self.multi = multi
+        self.all_bitsets = all_bitsets
+        self.values = []
+        self.bitsets = {}
+        self.totals = Counter()
+
+    def _row_values(self, value):
+        return value if self.multi else (value,)
+
+    def load(self, values):
+        self.values = values
+        positions = {}
+        for position, value in enumerate(values):
+            for item in self._row_values(value):
+                if item is not None:
+                    positions.setdefault(item, []).append(position)
+        self.totals = Counter({value: len(rows) for value, rows in positions.items()})
+        frequent = positions if self.all_bitsets else dict(self.totals.most_common(MAX_BITSETS))
+        size = len(values)
+        self.bitsets = {value: bits_from_positions(positions[value], size) for value in frequent}
+
+    def set(self, position, value):
+        if position == len(self.values):
+            self.values.append(self.empty)
+        old = self.values[position]
+        bit = 1 << position
+        for item in self._row_values(old):
+            if item is not None:
+                self.totals[item] -= 1
+                if item in self.bitsets:
+                    self.bitsets[item] &= ~bit
+        self.values[position] = value
+        for item in self._row_values(value):
+            if item is not None:
+                self.totals[item] += 1
+                if item in self.bitsets:
+                    self.bitsets[item] |= bit
+                elif self.all_bitsets:
+                    self.bitsets[item] = bit
+
+    @property
+    def empty(self):
+        return () if self.multi else None
+
+    def mask(self, value):
+        if value in self.bitsets:
+            return self.bitsets[value]
+        # Редкое значение: строки ищутся проходом по списку значений
+        if self.multi:
+            matches = map(contains, self.values, repeat(value))
+        else:
+            matches = map(eq, self.values, repeat(value))
+        return bits_from_positions(compress(count(), matches), len(self.values))
+
+    def scan(self, rows):
+        # rows - последовательность 0/1 по всем строкам или номера строк небольшой выборки
+        if isinstance(rows, bytes):
+            rows = compress(self.values, rows)
+        else:
+            rows = map(self.values.__getitem__, rows)
+        if self.multi:
+            rows = chain.from_iterable(rows)
+        counter = Counter(rows)
+        counter.pop(None, None)
+        return counter
+
+    def intersect(self, mask):
+        return Counter({value: (bits & mask).bit_count() for value, bits in self.bitsets.items()})
+
+    def counts(self, mask, index):
+        """
+        Количество книг по значениям фасета в выборке mask. Способ подсчёта выбирается по
+        примерной стоимости: пересечение масок растёт с числом значений и размером каталога,
+        проход по строкам - с размером выборки.
+        """
+        if mask == index.alive:
+            return self.totals
+        size = mask.bit_count()
+        rest = index.alive_count - size
+        bitsets_cost = len(self.bitsets) * index.size / 10000
+        scan_cost = min(size, rest) * 0.2 + index.size / 200
+        exact = len(self.bitsets) == len(self.totals)
+        if exact and bitsets_cost <= scan_cost:
+            return self.intersect(mask)
+        if size <= index.size // 50:
+            return self.scan(positions(mask))
+        if size <= rest and size <= ROW_SCAN_LIMIT:
+            return self.scan(index.selector(mask))
+        if rest <= ROW_SCAN_LIMIT:
+            return self.totals - self.scan(index.selector(index.alive & ~mask))
+        # Средняя по размеру выборка: точные количества только для частых значений
+        return self.intersect(mask)
+
+
+class FacetIndex:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.results = OrderedDict()
+        self.selectors = {}
+
+    def selector(self, mask):
+        # Одна и та же выборка нужна нескольким фасетам, последовательность строк строится один раз
+        rows = self.selectors.get(mask)
+        if rows is None:
+            rows = self.selectors[mask] = selector(mask, self.size)
+        return rows
+
+    def build(self):
+        rows = list(Book.objects.order_by('id').values_list('id', 'theme_id', 'year', *(field for _, _, field in FIELDS)))
+        tags = {}
+        for book_id, tag_id in BookTags.objects.values_list('book_id', 'tag_id'):
+            tags.setdefault(book_id, []).append(tag_id)
+
+        self.ids = [row[0] for row in rows]
+        self.positions = {book_id: position for position, book_id in enumerate(self.ids)}
+        self.size = len(self.ids)
+        self.alive = (1 << self.size) - 1
+        self.alive_count = self.size
+        self.facets = {name: Facet() for name, _, _ in FIELDS}
+        self.facets['theme'] = Facet(all_bitsets=True)
+        self.facets['year'] = Facet(all_bitsets=True)
+        self.facets['tag'] = Facet(multi=True)
+        self.facets['theme'].load([row[1] for row in rows])
+        self.facets['year'].load([row[2] for row in rows])
+        for offset, (name, _, _) in enumerate(FIELDS, start=3):
+            self.facets[name].load([row[offset] for row in rows])
+        self.facets['tag'].load([tuple(sorted(tags.get(book_id, ()))) for book_id in self.ids])
+        self.load_themes()
+        self.load_labels()
+        self.results.clear()
+
+    def load_themes(self):
+        self.theme_parents = {}
+        self.theme_children = {}
+        self.theme_titles = {}
+        for theme_id, parent_id, slug, title in Theme.objects.values_list('id', 'parent_id', 'slug', 'title'):
+            self.theme_parents[theme_id] = parent_id
+            self.theme_children.setdefault(parent_id, []).append(theme_id)
+            self.theme_titles[theme_id] = (title, slug)
+        self.subtrees = {}
+
+    def load_labels(self):
+        def author(sirname, name, fathername):
+            return ' '.join(part for part in (sirname, name, fathername) if part and part != '.')
+
+        self.labels = {
+            'author': {row[0]: author(*row[1:]) for row in Author.objects.values_list('id', 'sirname', 'name', 'fathername')},
+            'editor': dict(Editor.objects.values_list('id', 'name')),
+            'type': dict(Type.objects.values_list('id', 'type')),
+            'cover': dict(Cover.objects.values_list('id', 'cover')),
+            'format': dict(Format.objects.values_list('id', 'format')),
+            'seria': dict(Seria.objects.exclude(id=1).values_list('id', 'seria')),
+            'place': dict(Place.objects.values_list('id', 'place')),
+            'tag': dict(Tag.objects.values_list('id', 'name')),
+            'status': {True: 'Прочитано', False: 'Не прочитано'},
+            'controler': {True: 'К прочтению', False: 'Отложено'},
+        }
+
+    def replay(self, version):
+        """
+        Доводит индекс до версии version по журналу изменений. Возвращает False, если журнал
+        неполон и индекс нужно строить заново.
+        """
+        if self.version is None or not 0 < version - self.version <= MAX_REPLAY:
+            return False
+        keys = [changes_key(number) for number in range(self.version + 1, version + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys):
+            return False
+        self.update(set().union(*changes.values()))
+        return True
+
+    def update(self, book_ids):
+        """Обновляет строки индекса для изменённых, добавленных и удалённых книг."""
+        book_ids = set(book_ids)
+        if not book_ids:
+            return
+        rows = {
+            row[0]: row for row in
+            Book.objects.filter(id__in=book_ids).values_list('id', 'theme_id', 'year', *(field for _, _, field in FIELDS))
+        }
+        tags = {}
+        for book_id, tag_id in BookTags.objects.filter(book_id__in=rows).values_list('book_id', 'tag_id'):
+            tags.setdefault(book_id, []).append(tag_id)
+
+        for book_id in book_ids:
+            row = rows.get(book_id)
+            position = self.positions.get(book_id)
+            if position is None:
+                if row is None:
+                    continue
+                position = self.positions[book_id] = self.size
+                self.ids.append(book_id)
+                self.size += 1
+            bit = 1 << position
+            if row is None:
+                values = [None] * (len(FIELDS) + 2)
+                book_tags = ()
+                if self.alive & bit:
+                    self.alive &= ~bit
+                    self.alive_count -= 1
+            else:
+                values = row[1:]
+                book_tags = tuple(sorted(tags.get(book_id, ())))
+                if not self.alive & bit:
+                    self.alive |= bit
+                    self.alive_count += 1
+            self.facets['theme'].set(position, values[0])
+            self.facets['year'].set(position, values[1])
+            for offset, (name, _, _) in enumerate(FIELDS, start=2):
+                self.facets[name].set(position, values[offset])
+            self.facets['tag'].set(position, book_tags)
+        self.subtrees = {}
+        self.results.clear()
+
+    def subtree(self, theme_id):
+        # Маска книг тематики вместе со всеми подрубриками
+        bits = self.subtrees.get(theme_id)
+        if bits is None:
+            bits = self.facets['theme'].bitsets.get(theme_id, 0)
+            for child_id in self.theme_children.get(theme_id, ()):
+                bits |= self.subtree(child_id)
+            self.subtrees[theme_id] = bits
+        return bits
+
+    def year_range(self, year_from, year_to):
+        bits = 0
+        for year, year_bits in self.facets['year'].bitsets.items():
+            if (year_from is None or year >= year_from) and (year_to is None or year <= year_to):
+                bits |= year_bits
+        return bits
+
+    def filter_masks(self, selection, search_ids=None):
+        masks = {}
+        for name, values in selection.items():
+            if name == 'theme':
+                masks[name] = self.subtree(values)
+            elif name == 'year':
+                masks[name] = self.year_range(*values)
+            else:
+                bits = 0
+                for value in values:
+                    bits |= self.facets[name].mask(value)
+                masks[name] = bits
+        if search_ids is not None:
+            masks['search_query'] = bits_from_positions(
+                (self.positions[book_id] for book_id in search_ids if book_id in self.positions), self.size
+            )
+        return masks
+
+    def counts(self, selection, search_ids=None):
+        masks = self.filter_masks(selection, search_ids)
+
+        def base(exclude=None):
+            mask = self.alive
+            for name, bits in masks.items():
+                if name != exclude:
+                    mask &= bits
+            return mask
+
+        result = {}
+        for name in [name for name, _, _ in FIELDS] + ['tag', 'year']:
+            result[name] = self.facets[name].counts(base(name), self)
+        self.selectors.clear()
+        mask = base('theme')
+        parent_id = selection.get('theme')
+        result['theme'] = Counter({
+            child_id: (self.subtree(child_id) & mask).bit_count()
+            for child_id in self.theme_children.get(parent_id, ())
+        })
+        result['total'] = base().bit_count()
+        return result
+
+
+_index = FacetIndex()
+
+
+def changes_key(version):
+    return f'facets:changes:{version}'
+
+
+def get_index():
+    with _index.lock:
+        version = caching.catalog_version()
+        if _index.version != version:
+            if not _index.replay(version):
+                _index.build()
+            _index.version = version
+    return _index
+
+
+def catalog_changed(version, book_ids=None):
+    """
+    Вызывается сигналами после увеличения версии каталога. После фиксации транзакции изменённые
+    книги записываются в журнал для других процессов; если индекс этого процесса отстаёт ровно
+    на это изменение, обновляются только строки book_ids, иначе недостающие версии применит
+    get_index(). book_ids=None - изменились справочники: записи в журнале нет, индексы всех
+    процессов строятся заново.
+    """
+    def apply():
+        if book_ids is None:
+            with _index.lock:
+                _index.version = None
+            return
+        cache.set(changes_key(version), set(book_ids), CHANGES_TIMEOUT)
+        with _index.lock:
+            if _index.version is not None and version == _index.version + 1:
+                _index.update(book_ids)
+                _index.version = version
+
+    transaction.on_commit(apply)
+
+
+def _ints(values):
+    result = set()
+    for value in values:
+        try:
+            result.add(int(value))
+        except (TypeError, ValueError):
+            pass
+    return result
+
+
+def _getlist(params, name):
+    if hasattr(params, 'getlist'):
+        return params.getlist(name)
+    value = params.get(name)
+    if value in (None, ''):
+        return []
+    return value if isinstance(value, (list, tuple)) else [value]
+
+
+def parse_selection(params):
+    """Выбранные значения фасетов из параметров запроса: {фасет: множество значений}."""
+    selection = {}
+    for name, _, _ in FIELDS:
+        values = _getlist(params, name)
+        if name in BOOLEAN_FACETS:
+            values = {value == '1' for value in values if value in ('0', '1')}
+        else:
+            values = _ints(values)
+        if values:
+            selection[name] = values
+    tags = _ints(_getlist(params, 'tag'))
+    if tags:
+        selection['tag'] = tags
+    years = [next(iter(_ints(_getlist(params, name))), None) for name in ('year_from', 'year_to')]
+    if years != [None, None]:
+        selection['year'] = tuple(years)
+    return selection
+
+
+def _param_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return str(value)
+
+
+def _toggle(params, name, value):
+    query = params.copy()
+    query.pop('page', None)
+    query.pop('cursor', None)
+    values = query.getlist(name)
+    value = _param_value(value)
+    if value in values:
+        values.remove(value)
+    else:
+        values.append(value)
+    query.setlist(name, values)
+    return query.urlencode()
+
+
+def _replace(params, **values):
+    query = params.copy()
+    query.pop('page', None)
+    query.pop('cursor', None)
+    for name, value in values.items():
+        if value is None:
+            query.pop(name, None)
+        else:
+            query[name] = str(value)
+    return query.urlencode()
+
+
+def facet_counts(params):
+    """
+    Фасеты для боковой панели каталога: список словарей с заголовком и значениями
+    (название, количество, выбрано ли, строка запроса для переключения значения).
+    """
+    if not isinstance(params, QueryDict):
+        query = QueryDict(mutable=True)
+        for name, value in params.items():
+            query.setlist(name, value if isinstance(value, (list, tuple)) else [value])
+        params = query
+    selection = parse_selection(params)
+    if params.get('theme', ''):
+        from .filters import get_theme
+
+        # Тематика ищется так же, как при отборе книг (слаг уникален только среди подрубрик одного раздела);
+        # несуществующая - id 0, такой тематики нет и книг в отборе тоже
+        theme = get_theme(params)
+        selection['theme'] = theme.pk if theme is not None else 0
+    index = get_index()
+    search_query = params.get('search_query', '')
+    key = (index.version, tuple(sorted((name, repr(value)) for name, value in selection.items())), search_query)
+    with index.lock:
+        counts = index.results.get(key)
+        if counts is None:
+            search_ids = search.matching_ids(search_query) if search_query else None
+            counts = index.counts(selection, search_ids)
+            index.results[key] = counts
+            if len(index.results) > RESULTS_CACHE_SIZE:
+                index.results.popitem(last=False)
+        else:
+            index.results.move_to_end(key)
+
+    facets = []
+    for name, title, _ in FIELDS + (('tag', 'Теги', None),):
+        labels = index.labels[name]
+        selected = selection.get(name, set())
+        values = [(value, total) for value, total in counts[name].most_common() if total and value in labels]
+        shown = values[:LIMIT]
+        shown += [(value, counts[name].get(value, 0)) for value in selected
+                  if value in labels and value not in dict(shown)]
+        if not shown:
+            continue
+        facets.append({
+            'name': name,
+            'title': title,
+            'values': [
+                {
+                    'label': labels[value],
+                    'count': total,
+                    'selected': value in selected,
+                    'query': _toggle(params, name, value),
+                }
+                for value, total in shown
+            ],
+        })
+
+    decades = Counter()
+    for year, total in counts['year'].items():
+        decades[year // 10 * 10] += total
+    year_from, year_to = selection.get('year', (None, None))
+    decade_values = [
+        {
+            'label': f'{decade}-е' if decade else 'Год не указан',
+            'count': total,
+            'selected': (year_from, year_to) == (decade, decade + 9),
+            'query': _replace(params, year_from=None, year_to=None) if (year_from, year_to) == (decade, decade + 9)
+            else _replace(params, year_from=decade, year_to=decade + 9),
+        }
+        for decade, total in sorted(decades.items()) if total
+    ]
+    if decade_values:
+        facets.append({'name': 'year', 'title': 'Год издания', 'values': decade_values})
+
+    theme_values = [
+        {
+            'label': index.theme_titles[theme_id][0],
+            'count': total,
+            'selected': False,
+            'query': _replace(params, theme=index.theme_titles[theme_id][1]),
+        }
+        for theme_id, total in sorted(counts['theme'].items(), key=lambda item: index.theme_titles[item[0]][0])
+        if total
+    ]
+    if selection.get('theme') in index.theme_titles:
+        title = index.theme_titles[selection['theme']][0]
+        theme_values.insert(0, {'label': title, 'count': counts['total'], 'selected': True,
+                                'query': _replace(params, theme=None)})
+    if theme_values:
+        facets.insert(0, {'name': 'theme', 'title': 'Тематика', 'values': theme_values})
+    return facets
@@ -0,0 +1,76 @@
+"""
+Отбор и сортировка книг каталога по параметрам запроса.
+
+Используется страницей каталога (CatalogView) и выгрузкой каталога (books/exporter.py),
+чтобы оба пути понимали одни и те же параметры: search_query, sort, order, theme
+и параметры фасетов (books/facets.py).
+"""
+from django.db.models import Exists, OuterRef
+
+from .facets import FIELDS, parse_selection
+from .models import BookTags, Theme
+from .search import search_books
+
+SORT_FIELDS = ('rank', 'title', 'year')
+
+
+def get_sort(params):
+    # По умолчанию результаты поиска упорядочены по релевантности, остальной каталог - по названию
+    sort = params.get('sort', 'rank')
+    if sort not in SORT_FIELDS or sort == 'rank' and not params.get('search_query', ''):
+        sort = 'title'
+    return sort
+
+
+def get_order_by(params):
+    sort = get_sort(params)
+    if params.get('order', 'asc') == 'asc':
+        return sort
+    return f'-{sort}'
+
+
+def get_theme(params):
+    """Тематика из параметра theme; None - если параметр не задан или такой тематики нет."""
+    slug = params.get('theme', '')
+    if not slug:
+        return None
+    return Theme.objects.filter(slug=slug).first()
+
+def filter_by_theme(queryset, theme):
+    # Книги всего поддерева тематики по границам вложенного множества MPTT
+    return queryset.filter(
+        theme__tree_id=theme.tree_id,
+        theme__lft__gte=theme.lft,
+        theme__rght__lte=theme.rght,
+    )
+
+
+def filter_facets(queryset, params):
+    # Внутри фасета значения объединяются, между фасетами - пересекаются
+    selection = parse_selection(params)
+    for name, _, field in FIELDS:
+        if name in selection:
+            queryset = queryset.filter(**{f'{field}__in': selection[name]})
+    if 'tag' in selection:
+        tagged = BookTags.objects.filter(book=OuterRef('pk'), tag_id__in=selection['tag'])
+        queryset = queryset.filter(Exists(tagged))
+    year_from, year_to = selection.get('year', (None, None))
+    if year_from is not None:
+        queryset = queryset.filter(year__gte=year_from)
+    if year_to is not None:
+        queryset = queryset.filter(year__lte=year_to)
+    return queryset
+
+
+def filter_catalog(queryset, params):
+    search_query = params.get('search_query', '')
+    theme = get_theme(params)
+    if theme is not None:
+        queryset = filter_by_theme(queryset, theme)
+    elif params.get('theme', ''):
+        # Несуществующая тематика - пустой отбор, а не весь каталог
+        queryset = queryset.none()
+    queryset = filter_facets(queryset, params)
+    if search_query:
+        queryset = search_books(queryset, search_query)
+    return queryset.order_by(get_order_by(params))
@@ -1,7 +1,10 @@
 from django import forms
 from django.template.context_processors import request
 
-from .models import Book, Tag, BookTags, Favorite, Author, Editor, Theme, Type, Cover, Format, Seria, Place
+from .autocomplete import AutocompleteSelect
+from .models import Book, Tag, BookTags, Favorite, Author, Editor, Theme, Type, Cover, Format, Seria, Place, UploadSession
+from .tagging import parse_tags, set_book_tags
+from .uploads import ChunkedFileInput
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
@@ -24,13 +27,13 @@ class BookForm(forms.ModelForm):
     author = forms.ModelChoiceField(
         queryset=Author.objects.all(),
         label='Автор книги:',
-        widget=forms.Select(attrs={'class': 'form-control'}),
+        widget=AutocompleteSelect('author', attrs={'class': 'form-control'}),
     )
 
     editor = forms.ModelChoiceField(
         queryset=Editor.objects.all(),
         label='Издательство:',
-        widget=forms.Select(attrs={'class': 'form-control'}),
+        widget=AutocompleteSelect('editor', attrs={'class': 'form-control'}),
     )
 
     year = forms.CharField(
@@ -41,7 +44,7 @@ class BookForm(forms.ModelForm):
     theme  = forms.ModelChoiceField(
         queryset=Theme.objects.all(),
         label='Тематика:',
-        widget=forms.Select(attrs={'class': 'form-control'}),
+        widget=AutocompleteSelect('theme', attrs={'class': 'form-control'}),
     )
 
     type = forms.ModelChoiceField(
@@ -66,7 +69,7 @@ class BookForm(forms.ModelForm):
         queryset=Seria.objects.all(),
         label='Серия:',
         empty_label='Серия не выбрана',
-        widget=forms.Select(attrs={'class': 'form-control'}),
+        widget=AutocompleteSelect('seria', attrs={'class': 'form-control'}),
     )
 
     tom = forms.CharField(
@@ -103,10 +106,13 @@ class BookForm(forms.ModelForm):
 
     file_path = forms.FileField(
         required=False,
-        widget=forms.FileInput(attrs={"id": "image_field"}),
+        widget=ChunkedFileInput(attrs={"id": "image_field"}),
         label='Загрузите электронный вид книги:',
     )
 
+    # id завершённой загрузки частями (books/uploads.py) вместо самого файла
+    upload = forms.UUIDField(required=False, widget=forms.HiddenInput)
+
     tags = forms.CharField(
         label='Теги',
         required=False,
@@ -129,29 +135,38 @@ class BookForm(forms.ModelForm):
             'title': 'Название книги',
         }
 
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+
     def clean_tags(self):
         # преобразование строки тегов в список тегов
-        tags_str = self.cleaned_data['tags'].lower()
-        tag_list = [tag.strip() for tag in tags_str.split(',') if tag.strip()]
-        return tag_list
+        return parse_tags(self.cleaned_data['tags'])
+
+    def clean_upload(self):
+        pk = self.cleaned_data['upload']
+        if pk is None:
+            return None
+        session = None
+        if self.user is not None and self.user.is_authenticated:
+            session = UploadSession.objects.filter(
+                pk=pk, user=self.user, status=UploadSession.Status.COMPLETE,
+            ).first()
+        if session is None:
+            raise ValidationError('Загрузка файла не найдена или не завершена, загрузите файл заново')
+        return session
 
     def save(self, *args, **kwargs):
         instance = super().save(commit=False)
+        if self.cleaned_data.get('upload'):
+            # Файл уже в хранилище: книге достаточно его имени
+            instance.file_path.name = self.cleaned_data['upload'].file_name
         # Сохраняем карточку в базу данных, чтобы у нее появился id
         # Без id мы не сможем добавить теги
         instance.save()
 
-        current_tags = set(self.cleaned_data['tags'])
-
-        for tag in instance.tags.all():
-            if tag.name not in current_tags:
-                instance.tags.remove(tag)
-
-        # Обрабатываем теги
-        for tag_name in current_tags:
-            tag, created = Tag.objects.get_or_create(name=tag_name)
-            # На каждой итерации пополняется таблица много-ко-многим
-            instance.tags.add(tag)
+        # Теги назначаются одним набором: недостающие создаются, лишние связи удаляются
+        set_book_tags(instance, self.cleaned_data['tags'])
 
         return instance
 
@@ -0,0 +1,350 @@
+"""
+Полнотекстовый поиск по содержимому электронных книг (Book.file_path).
+
+Текст извлекается потоково средствами стандартной библиотеки и делится на части
+(главы; длинные главы - на куски по PART_CHARS символов), в памяти одновременно
+находится только одна часть:
+- TXT - чтение строк с определением кодировки (UTF-8, иначе cp1251);
+- FB2 (и .fb2.zip) - xml.etree.iterparse, части - разделы <section>, картинки <binary> не читаются;
+- EPUB - zipfile, главы в порядке <spine> из OPF, XHTML разбирается html.parser порциями.
+
+Части попадают в виртуальную таблицу SQLite FTS5 "books_content" - инвертированный индекс
+с позициями слов (detail=full), поэтому работают и фразы в кавычках, и snippet() с подсветкой.
+Для каждой книги в BookContent хранится sha256 файла: книга переиндексируется, только если
+содержимое файла изменилось. Индекс обновляет фоновая задача books.index_content после
+сохранения книги с новым файлом, целиком - команда `manage.py reindex_contents`.
+"""
+import codecs
+import hashlib
+import io
+import logging
+import posixpath
+import re
+import zipfile
+from html.parser import HTMLParser
+from typing import NamedTuple
+from xml.etree import ElementTree
+
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from . import search
+from .models import Book, BookContent
+
+logger = logging.getLogger(__name__)
+
+PART_CHARS = 20000
+READ_SIZE = 64 * 1024
+SNIPPET_TOKENS = 16
+# Маркеры подсветки в snippet(): в тексте книги не встречаются, после экранирования заменяются на <mark>
+MARK_START, MARK_END = '\x02', '\x03'
+SPACE_RE = re.compile(r'\s+')
+# unicode61 не считает "ё" вариантом "е", а в книгах и запросах они встречаются вперемешку
+YO = str.maketrans('ёЁ', 'еЕ')
+
+
+class Parts:
+    """Накопитель текста: отдаёт готовые части (заголовок, текст) не длиннее PART_CHARS."""
+
+    def __init__(self):
+        self.title = ''
+        self.chunks = []
+        self.size = 0
+        self.ready = []
+
+    def add(self, text):
+        text = SPACE_RE.sub(' ', text).strip().translate(YO)
+        if not text:
+            return
+        self.chunks.append(text)
+        self.size += len(text) + 1
+        if self.size >= PART_CHARS:
+            self.flush()
+
+    def flush(self, title=None):
+        if self.chunks:
+            self.ready.append((self.title, ' '.join(self.chunks)))
+        self.chunks, self.size = [], 0
+        if title is not None:
+            self.title = title.translate(YO)
+
+    def take(self):
+        ready, self.ready = self.ready, []
+        return ready
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def txt_encoding(f):
+    # Кодировка текстового файла по его началу: UTF-8, иначе cp1251
+    head = f.read(READ_SIZE)
+    f.seek(0)
+    try:
+        head.decode('utf-8')
+        return 'utf-8-sig'
+    except UnicodeDecodeError as error:
+        # Обрезанный в конце порции многобайтовый символ - это ещё UTF-8
+        return 'utf-8-sig' if error.start >= len(head) - 3 else 'cp1251'
+
+
+def extract_txt(f):
+    parts = Parts()
+    for line in io.TextIOWrapper(f, encoding=txt_encoding(f), errors='replace'):
+        parts.add(line)
+        yield from parts.take()
+    parts.flush()
+    yield from parts.take()
+
+
+def extract_fb2(f):
+    parts = Parts()
+    depth = {'section': 0, 'title': 0, 'binary': 0}
+    title = []
+    for event, element in ElementTree.iterparse(f, events=('start', 'end')):
+        tag = _local(element.tag)
+        if event == 'start':
+            if tag in depth:
+                depth[tag] += 1
+            if tag == 'section':
+                parts.flush()
+            continue
+        if tag == 'binary':
+            depth['binary'] -= 1
+        elif tag == 'title':
+            depth['title'] -= 1
+            parts.flush(' '.join(title))
+            title = []
+        elif tag in ('p', 'v', 'subtitle', 'text-author'):
+            text = ''.join(element.itertext())
+            if depth['title']:
+                title.append(SPACE_RE.sub(' ', text).strip())
+            elif depth['section']:
+                parts.add(text)
+        elif tag == 'section':
+            depth['section'] -= 1
+            parts.flush()
+        yield from parts.take()
+        # Обработанные элементы освобождаются, дерево документа не накапливается
+        if tag in ('p', 'v', 'subtitle', 'text-author', 'section', 'binary', 'title', 'description'):
+            element.clear()
+    parts.flush()
+    yield from parts.take()
+
+
+class XHTMLText(HTMLParser):
+    SKIP = {'script', 'style', 'head'}
+    BLOCKS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote'}
+    HEADINGS = {'h1', 'h2', 'h3'}
+
+    def __init__(self, parts):
+        super().__init__(convert_charrefs=True)
+        self.parts = parts
+        self.skip = 0
+        self.heading = None
+        self.buffer = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skip += 1
+        elif tag in self.HEADINGS and self.heading is None:
+            self.heading = []
+        if tag in self.BLOCKS:
+            self.flush_buffer()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skip = max(self.skip - 1, 0)
+        elif tag in self.HEADINGS and self.heading is not None:
+            self.parts.flush(SPACE_RE.sub(' ', ''.join(self.heading)).strip())
+            self.heading = None
+        if tag in self.BLOCKS:
+            self.flush_buffer()
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        if self.heading is not None:
+            self.heading.append(data)
+        else:
+            self.buffer.append(data)
+
+    def flush_buffer(self):
+        if self.buffer:
+            self.parts.add(''.join(self.buffer))
+            self.buffer = []
+
+
+def epub_spine(archive):
+    container = ElementTree.fromstring(archive.read('META-INF/container.xml'))
+    rootfile = next(element for element in container.iter() if _local(element.tag) == 'rootfile')
+    opf_path = rootfile.get('full-path')
+    opf = ElementTree.fromstring(archive.read(opf_path))
+    base = posixpath.dirname(opf_path)
+    manifest = {
+        item.get('id'): posixpath.normpath(posixpath.join(base, item.get('href')))
+        for item in opf.iter() if _local(item.tag) == 'item'
+    }
+    return [manifest[item.get('idref')] for item in opf.iter()
+            if _local(item.tag) == 'itemref' and item.get('idref') in manifest]
+
+
+def extract_epub(f):
+    with zipfile.ZipFile(f) as archive:
+        for name in epub_spine(archive):
+            parts = Parts()
+            parser = XHTMLText(parts)
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            with archive.open(name) as chapter:
+                while block := chapter.read(READ_SIZE):
+                    parser.feed(decoder.decode(block))
+                    yield from parts.take()
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+            parser.flush_buffer()
+            parts.flush()
+            yield from parts.take()
+
+
+def extract_zip(f):
+    # .fb2.zip - архив с одним файлом FB2
+    with zipfile.ZipFile(f) as archive:
+        name = next((name for name in archive.namelist() if name.lower().endswith('.fb2')), None)
+        if name is None:
+            return
+        with archive.open(name) as member:
+            yield from extract_fb2(member)
+
+
+EXTRACTORS = {
+    '.txt': extract_txt,
+    '.fb2': extract_fb2,
+    '.epub': extract_epub,
+    '.zip': extract_zip,
+}
+
+
+def extractor_for(name):
+    return EXTRACTORS.get(posixpath.splitext(name.lower())[1])
+
+
+def file_hash(name):
+    digest = hashlib.sha256()
+    with default_storage.open(name, 'rb') as f:
+        while block := f.read(READ_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_enabled():
+    return search.is_enabled()
+
+
+def remove_book(book_id):
+    if is_enabled():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM "books_content" WHERE book_id = %s', [book_id])
+
+
+class Extracted(NamedTuple):
+    book_id: int
+    content_hash: str
+    rows: list
+    chars: int
+    error: str
+
+
+def extract_book(book_id, name, known_hash='', force=False):
+    """
+    Хэш и текст файла книги без обращений к базе (выполняется и в процессах `reindex_contents`).
+    None - файл не изменился с прошлой индексации (known_hash).
+    """
+    digest = file_hash(name)
+    if digest == known_hash and not force:
+        return None
+    rows, chars, error = [], 0, ''
+    try:
+        with default_storage.open(name, 'rb') as f:
+            for number, (title, text) in enumerate(extractor_for(name)(f)):
+                rows.append((book_id, number, title, text))
+                chars += len(text)
+    except (OSError, ValueError, zipfile.BadZipFile, ElementTree.ParseError, StopIteration, KeyError) as exc:
+        logger.warning('Не удалось извлечь текст книги %s (%s): %s', book_id, name, exc)
+        rows, error = [], f'{type(exc).__name__}: {exc}'[:500]
+    return Extracted(book_id, digest, rows, chars, error)
+
+
+def save_extracted(extracted):
+    # Части записываются одной короткой транзакцией уже после извлечения:
+    # блокировка записи SQLite не держится, пока читается и разбирается файл
+    with transaction.atomic():
+        remove_book(extracted.book_id)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO "books_content"(book_id, part, title, body) VALUES (%s, %s, %s, %s)', extracted.rows,
+            )
+        BookContent.objects.update_or_create(book_id=extracted.book_id, defaults={
+            'content_hash': extracted.content_hash, 'parts': len(extracted.rows), 'chars': extracted.chars,
+            'error': extracted.error, 'indexed_at': timezone.now(),
+        })
+
+
+def forget_book(book_id):
+    with transaction.atomic():
+        remove_book(book_id)
+        BookContent.objects.filter(book_id=book_id).delete()
+
+
+def index_book(book, force=False):
+    """
+    Индексирует текст файла книги. Возвращает число частей или None, если файл
+    не изменился с прошлой индексации (или формат не поддерживается).
+    """
+    if not is_enabled():
+        return None
+    name = book.file_path.name if book.file_path else ''
+    if not name or extractor_for(name) is None:
+        forget_book(book.pk)
+        return None
+    known_hash = BookContent.objects.filter(book_id=book.pk).values_list('content_hash', flat=True).first()
+    extracted = extract_book(book.pk, name, known_hash or '', force)
+    if extracted is None:
+        return None
+    save_extracted(extracted)
+    return len(extracted.rows)
+
+
+def highlight(snippet):
+    return mark_safe(escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search_contents(query, user=None, limit=50):
+    """
+    Книги, в тексте которых найден запрос, по релевантности: [(книга, [(глава, подсвеченный фрагмент)])].
+    Слова ищутся по префиксу, текст в кавычках - как фраза.
+    """
+    if not is_enabled():
+        return []
+    phrases = re.findall(r'"([^"]+)"', query)
+    words = search.build_match_expression(re.sub(r'"[^"]*"', ' ', query))
+    expression = ' '.join([*(f'"{search.normalize(phrase)}"' for phrase in phrases if phrase.strip()), words]).strip()
+    if not expression:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT book_id, title, snippet("books_content", 3, %s, %s, \'…\', %s) '
+            'FROM "books_content" WHERE "books_content" MATCH %s ORDER BY rank LIMIT %s',
+            [MARK_START, MARK_END, SNIPPET_TOKENS, expression, limit * 3],
+        )
+        rows = cursor.fetchall()
+    found = {}
+    for book_id, title, snippet in rows:
+        snippets = found.setdefault(book_id, [])
+        if len(snippets) < 3:
+            snippets.append((title, highlight(snippet)))
+    books = Book.objects.cards(user).in_bulk(list(found)[:limit])
+    return [(books[book_id], snippets) for book_id, snippets in found.items() if book_id in books]
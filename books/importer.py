@@ -0,0 +1,308 @@
+"""
+Массовый импорт каталога из CSV или JSON Lines (команда `manage.py import_books`).
+
+Файл читается потоково, записи обрабатываются пачками. Справочники (авторы, издательства,
+серии, типы, обложки, форматы, места хранения, теги, тематики) загружаются в память один раз,
+недостающие значения создаются через bulk_create по одному запросу на справочник в пачке.
+Каждая пачка сохраняется в своей транзакции; после неё номер последней обработанной записи
+пишется в файл состояния, поэтому прерванный импорт можно продолжить (--resume).
+Дерево тематик перестраивается и счётчики книг справочников (books/counters.py) пересчитываются
+один раз в конце импорта.
+
+Поля записи: title, author ("Фамилия Имя Отчество"), editor, editor_city, year, theme
+(путь рубрики через "/"), type, cover, format, seria, tom, pages, status, controler, review,
+place, tags (через запятую или списком в JSON), images_path, file_path.
+"""
+import csv
+import json
+import os
+import time
+
+from django.db import transaction
+from django.utils.text import slugify
+
+from . import caching, counters, pagecache, search, tagging
+from .models import Author, Book, Cover, Editor, Format, Place, Seria, Tag, Theme, Type
+
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+})
+
+TRUE_VALUES = {'1', 'true', 'yes', 'да', '+'}
+
+
+def slugify_ru(text):
+    return slugify(text.lower().translate(TRANSLIT))[:50] or 'theme'
+
+
+def read_records(path, fmt=None):
+    """Потоково читает записи файла; формат определяется по расширению, если не задан."""
+    if fmt is None:
+        fmt = 'jsonl' if path.endswith(('.jsonl', '.json', '.ndjson')) else 'csv'
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+def parse_int(value):
+    try:
+        return int(str(value).strip() or 0)
+    except ValueError:
+        return 0
+
+
+def split_author(value):
+    # Пустые части ФИО в справочнике авторов хранятся как "."
+    parts = str(value or '').split()
+    if not parts:
+        return None
+    parts = (parts + ['.', '.'])[:3] if len(parts) < 3 else [parts[0], parts[1], ' '.join(parts[2:])]
+    return tuple(parts)
+
+
+class Lookup:
+    """Справочник "значение -> id" в памяти с пакетным созданием недостающих значений."""
+
+    def __init__(self, model, fields, dry_run=False):
+        self.model = model
+        self.fields = fields
+        self.dry_run = dry_run
+        self.created = 0
+        self.ids = {
+            tuple(row[:-1]): row[-1]
+            for row in model.objects.values_list(*fields, 'id')
+        }
+        self.pending = set()
+
+    def request(self, key):
+        if key is not None and key not in self.ids:
+            self.pending.add(key)
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending = sorted(self.pending)
+        self.pending = set()
+        self.created += len(pending)
+        if self.dry_run:
+            self.ids.update((key, None) for key in pending)
+            return
+        objects = [self.model(**dict(zip(self.fields, key))) for key in pending]
+        for obj in objects:
+            # bulk_create не вызывает save(), нормализованное имя для автодополнения заполняем сами
+            if hasattr(obj, 'set_normalized'):
+                obj.set_normalized()
+        objects = self.model.objects.bulk_create(objects)
+        self.ids.update((key, obj.id) for key, obj in zip(pending, objects))
+
+    def get(self, key):
+        if key is None:
+            return None
+        return self.ids[key]
+
+
+class ThemeLookup:
+    """Тематики по названию (Theme.title уникален); недостающие узлы пути создаются без пересчёта дерева."""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.created = 0
+        self.ids = dict(Theme.objects.values_list('title', 'id'))
+        self.slugs = set(Theme.objects.values_list('slug', flat=True))
+
+    def unique_slug(self, title):
+        # Страницы рубрик находят тематику только по slug, поэтому он должен быть уникален
+        base = slug = slugify_ru(title)
+        number = 1
+        while slug in self.slugs:
+            number += 1
+            slug = f'{base[:45]}-{number}'
+        self.slugs.add(slug)
+        return slug
+
+    def resolve(self, path):
+        titles = [title.strip() for title in str(path or '').split('/') if title.strip()]
+        parent_id = None
+        for title in titles:
+            if title not in self.ids:
+                self.created += 1
+                if self.dry_run:
+                    self.ids[title] = None
+                else:
+                    theme = Theme(title=title, slug=self.unique_slug(title), parent_id=parent_id)
+                    with Theme.objects.disable_mptt_updates():
+                        theme.save()
+                    self.ids[title] = theme.id
+            parent_id = self.ids[title]
+        return parent_id
+
+
+class CatalogImporter:
+
+    def __init__(self, batch_size=1000, dry_run=False, state_path=None, stdout=None):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.state_path = state_path
+        self.stdout = stdout
+        self.authors = Lookup(Author, ('sirname', 'name', 'fathername'), dry_run)
+        self.editors = Lookup(Editor, ('name', 'city'), dry_run)
+        self.series = Lookup(Seria, ('seria',), dry_run)
+        self.types = Lookup(Type, ('type',), dry_run)
+        self.covers = Lookup(Cover, ('cover',), dry_run)
+        self.formats = Lookup(Format, ('format',), dry_run)
+        self.places = Lookup(Place, ('place',), dry_run)
+        self.themes = ThemeLookup(dry_run)
+        self.lookups = (
+            self.authors, self.editors, self.series, self.types,
+            self.covers, self.formats, self.places,
+        )
+        self.imported = 0
+        self.tags_created = 0
+        self.seen_tags = set()
+
+    def reserve_placeholder(self):
+        # Служебная серия "без серии" (id=1) скрыта в API, на страницах серий и в шаблонах:
+        # создаём её до импорта, иначе id=1 получит первая импортированная серия
+        if not Seria.objects.filter(id=1).exists():
+            Seria.objects.create(id=1, seria='Без серии')
+            self.series.ids[('Без серии',)] = 1
+
+    def load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return 0
+        with open(self.state_path, encoding='utf-8') as f:
+            return json.load(f).get('done', 0)
+
+    def save_state(self, done):
+        if self.dry_run or not self.state_path:
+            return
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump({'done': done}, f)
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    @staticmethod
+    def _key(value):
+        value = str(value or '').strip()
+        return (value,) if value else None
+
+    def _keys(self, record):
+        editor = str(record.get('editor') or '').strip()
+        return {
+            'author': split_author(record.get('author')),
+            'editor': (editor, str(record.get('editor_city') or '').strip()) if editor else None,
+            'seria': self._key(record.get('seria')),
+            'type': self._key(record.get('type')),
+            'cover': self._key(record.get('cover')),
+            'format': self._key(record.get('format')),
+            'place': self._key(record.get('place')),
+        }
+
+    def import_batch(self, records):
+        keyed = [(record, self._keys(record), tagging.parse_tags(record.get('tags'))) for record in records]
+        lookups = {
+            'author': self.authors, 'editor': self.editors, 'seria': self.series, 'type': self.types,
+            'cover': self.covers, 'format': self.formats, 'place': self.places,
+        }
+        for record, keys, tag_names in keyed:
+            for name, key in keys.items():
+                lookups[name].request(key)
+        for lookup in self.lookups:
+            lookup.flush()
+
+        books = []
+        for record, keys, tag_names in keyed:
+            books.append(Book(
+                title=str(record.get('title') or '').strip()[:100],
+                year=parse_int(record.get('year')),
+                tom=parse_int(record.get('tom')),
+                pages=parse_int(record.get('pages')),
+                status=parse_bool(record.get('status')),
+                controler=parse_bool(record.get('controler')),
+                review=str(record.get('review') or '')[:2000],
+                images_path=record.get('images_path') or '',
+                file_path=record.get('file_path') or '',
+                theme_id=self.themes.resolve(record.get('theme')),
+                **{f'{name}_id': lookups[name].get(key) for name, key in keys.items()},
+            ))
+        if self.dry_run:
+            names = {name for record, keys, tag_names in keyed for name in tag_names} - self.seen_tags
+            self.tags_created += len(names) - Tag.objects.filter(normalized__in=names).count()
+            self.seen_tags |= names
+            return len(books)
+
+        books = Book.objects.bulk_create(books)
+        # Версия каталога увеличивается один раз в конце импорта, а не после каждой пачки
+        self.tags_created += tagging.sync_tags(
+            {book.id: tag_names for book, (record, keys, tag_names) in zip(books, keyed) if tag_names},
+            replace=False, notify=False,
+        )
+        # bulk_create не отправляет сигналы, поэтому поисковый индекс обновляем явно
+        search.index_books(book.id for book in books)
+        return len(books)
+
+    def run(self, records, resume=False):
+        skip = self.load_state() if resume else 0
+        if not self.dry_run:
+            self.reserve_placeholder()
+        done = 0
+        started = time.monotonic()
+        batch = []
+
+        def flush():
+            nonlocal batch
+            with transaction.atomic():
+                self.imported += self.import_batch(batch)
+            self.save_state(done)
+            elapsed = time.monotonic() - started
+            self.log(f'Обработано записей: {done}, импортировано книг: {self.imported} '
+                     f'({self.imported / elapsed if elapsed else 0:.0f} книг/с)')
+            batch = []
+
+        for record in records:
+            done += 1
+            if done <= skip:
+                continue
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                flush()
+        if batch:
+            flush()
+
+        if not self.dry_run:
+            # Узлы создавались без пересчёта дерева; после прерванного импорта дерево тоже пересчитываем
+            if self.themes.created or skip:
+                Theme.objects.rebuild()
+            # Книги вставлялись пакетами без сигналов: счётчики справочников пересчитываются целиком
+            counters.recount()
+            caching.bump_catalog_version()
+            pagecache.purge_all()
+            if self.state_path and os.path.exists(self.state_path):
+                os.remove(self.state_path)
+        return {
+            'records': done - skip,
+            'books': self.imported,
+            'seconds': time.monotonic() - started,
+            'created': {
+                lookup.model._meta.verbose_name_plural: lookup.created
+                for lookup in self.lookups
+            } | {
+                Tag._meta.verbose_name_plural: self.tags_created,
+                Theme._meta.verbose_name_plural: self.themes.created,
+            },
+        }
@@ -0,0 +1,56 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время ответа и число SQL-запросов основных страниц и сравнивает с эталоном'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Количество повторных ("тёплых") запросов')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'),
+                            help='Файл эталонного отчёта')
+        parser.add_argument('--save-baseline', action='store_true', help='Сохранить отчёт как новый эталон')
+        parser.add_argument('--output', help='Сохранить отчёт в файл')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Допустимый относительный рост времени ответа (0.25 = 25%%)')
+        parser.add_argument('--min-delta-ms', type=float, default=5.0,
+                            help='Рост времени меньше этого порога не считается ухудшением')
+
+    def handle(self, *args, **options):
+        report = benchmarks.run(repeat=options['repeat'])
+        if not report['cases']:
+            raise CommandError('В базе нет книг: заполните её командой seed_library')
+
+        self.stdout.write(f"Книг в базе: {report['books']}")
+        self.stdout.write(f"{'страница':<20}{'холодный, мс':>14}{'SQL':>6}{'тёплый, мс':>14}{'SQL':>6}")
+        for name, case in report['cases'].items():
+            self.stdout.write(
+                f"{name:<20}{case['cold_ms']:>14.1f}{case['cold_queries']:>6}"
+                f"{case['warm_ms']:>14.1f}{case['warm_queries']:>6}"
+            )
+        if options['output']:
+            benchmarks.save(report, options['output'])
+
+        baseline_path = options['baseline']
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(baseline_path) or '.', exist_ok=True)
+            benchmarks.save(report, baseline_path)
+            self.stdout.write(self.style.SUCCESS(f'Эталон сохранён в {baseline_path}'))
+            return
+        if not os.path.exists(baseline_path):
+            self.stdout.write(self.style.WARNING(f'Эталон {baseline_path} не найден, сравнение пропущено'))
+            return
+
+        baseline = benchmarks.load(baseline_path)
+        if baseline.get('books') != report['books']:
+            self.stdout.write(self.style.WARNING(
+                f"Эталон снят на {baseline.get('books')} книгах, сейчас их {report['books']}"
+            ))
+        regressions = benchmarks.compare(report, baseline, options['threshold'], options['min_delta_ms'])
+        if regressions:
+            raise CommandError('Ухудшения относительно эталона:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Ухудшений относительно эталона нет'))
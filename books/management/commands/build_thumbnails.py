@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from books import thumbnails
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии обложек для уже загруженных книг'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Перестроить копии, даже если они уже есть')
+
+    def handle(self, *args, **options):
+        books = Book.objects.exclude(images_path='').only('id', 'images_path', 'images_hash').order_by('id')
+        if not options['force']:
+            books = books.filter(images_hash='')
+        processed = failed = 0
+        for book in books.iterator(chunk_size=500):
+            if thumbnails.process_book(book, force=options['force']):
+                processed += 1
+            else:
+                failed += 1
+                self.stderr.write(f'Книга {book.pk}: не удалось обработать обложку {book.images_path.name}')
+        self.stdout.write(self.style.SUCCESS(f'Обработано обложек: {processed}, с ошибками: {failed}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books import uploads
+
+
+class Command(BaseCommand):
+    help = 'Удаляет истёкшие сессии загрузки файлов частями и недокачанные файлы'
+
+    def handle(self, *args, **options):
+        count = uploads.cleanup_expired()
+        self.stdout.write(self.style.SUCCESS(f'Удалено сессий загрузки: {count}'))
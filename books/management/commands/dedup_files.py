@@ -0,0 +1,47 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from books import caching, facets, pagecache, storage
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = ('Переносит обложки и файлы книг, загруженные под исходными именами, в хранилище '
+            'с адресацией по содержимому (одинаковые файлы остаются в одном экземпляре) '
+            'и пересчитывает счётчики ссылок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько файлов будет перенесено')
+
+    def handle(self, *args, **options):
+        moved = missing = 0
+        for field in ('images_path', 'file_path'):
+            names = (
+                Book.objects.exclude(**{field: ''}).order_by()
+                .values_list(field, flat=True).distinct()
+            )
+            legacy = [name for name in names if storage.blob_digest(name) is None]
+            for name in legacy:
+                if not storage.blob_storage.exists(name):
+                    missing += 1
+                    self.stderr.write(f'Файл не найден: {name}')
+                    continue
+                moved += 1
+                if options['dry_run']:
+                    continue
+                with storage.blob_storage.open(name, 'rb') as f:
+                    new_name = storage.blob_storage.save(name, File(f, name=name))
+                # Книги переводятся на новое имя без сигналов сохранения, ссылки пересчитываются ниже
+                Book.objects.filter(**{field: name}).update(**{field: new_name})
+                storage.blob_storage.delete(name)
+        if options['dry_run']:
+            self.stdout.write(f'Будет перенесено файлов: {moved}, не найдено: {missing}')
+            return
+        if moved:
+            # Адреса обложек в кэшированных страницах изменились
+            facets.catalog_changed(caching.bump_catalog_version(), None)
+            pagecache.purge_all()
+        blobs = storage.recount()
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено файлов: {moved}, не найдено: {missing}, файлов в хранилище: {blobs}'
+        ))
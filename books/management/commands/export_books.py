@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from books.exporter import FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Выгружает каталог в CSV или JSON Lines потоково, не загружая его целиком в память'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help='Формат выгрузки')
+        parser.add_argument('--output', '-o', help='Файл для записи (по умолчанию - стандартный вывод)')
+        parser.add_argument('--search-query', default='', help='Поисковый запрос, как на странице каталога')
+        parser.add_argument('--sort', default='title', help='Поле сортировки: title, year или rank')
+        parser.add_argument('--order', choices=['asc', 'desc'], default='asc', help='Порядок сортировки')
+        parser.add_argument('--theme', default='', help='slug тематики (с подтемами)')
+        parser.add_argument('--with-files', action='store_true', help='Добавить пути к файлам электронных книг')
+
+    def handle(self, *args, **options):
+        params = {
+            'search_query': options['search_query'],
+            'sort': options['sort'],
+            'order': options['order'],
+            'theme': options['theme'],
+        }
+        generate, _ = FORMATS[options['format']]
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for chunk in generate(params, include_files=options['with_files']):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from books import storage
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из хранилища обложки и файлы книг, на которые не ссылается ни одна книга'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=storage.GRACE.total_seconds() / 3600,
+                            help='Не удалять файлы, загруженные за последние столько часов')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет удалено')
+
+    def handle(self, *args, **options):
+        removed, size = storage.collect_garbage(grace=timedelta(hours=options['hours']), dry_run=options['dry_run'])
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(f'{verb} файлов: {removed} ({size / 1024 / 1024:.1f} МБ)'))
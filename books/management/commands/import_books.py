@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from books.importer import CatalogImporter, read_records
+
+
+class Command(BaseCommand):
+    help = 'Импортирует книги из файла CSV или JSON Lines пачками через bulk_create'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу CSV или JSON Lines')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество книг в одной транзакции')
+        parser.add_argument('--dry-run', action='store_true', help='Проверить файл, ничего не записывая в базу')
+        parser.add_argument('--resume', action='store_true', help='Продолжить прерванный импорт с сохранённой позиции')
+        parser.add_argument('--state-file', help='Файл с позицией импорта (по умолчанию <path>.import-state)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        importer = CatalogImporter(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            state_path=options['state_file'] or f'{path}.import-state',
+            stdout=self.stdout,
+        )
+        try:
+            result = importer.run(read_records(path, options['format']), resume=options['resume'])
+        except FileNotFoundError:
+            raise CommandError(f'Файл {path} не найден')
+
+        prefix = 'Проверка завершена' if options['dry_run'] else 'Импорт завершён'
+        seconds = result['seconds']
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}: записей {result['records']}, книг {result['books']} за {seconds:.1f} с "
+            f"({result['books'] / seconds if seconds else 0:.0f} книг/с)"
+        ))
+        for name, count in result['created'].items():
+            if count:
+                self.stdout.write(f'  создано ({name}): {count}')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from books import search
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает полнотекстовый индекс каталога (FTS5)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество книг в одной пачке')
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            self.stderr.write('Полнотекстовый индекс поддерживается только для SQLite')
+            return
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано книг: {count}'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from books import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает хранимые счётчики книг у тематик, тегов, серий, авторов и мест хранения'
+
+    def handle(self, *args, **options):
+        for model, changed in counters.recount().items():
+            self.stdout.write(f'{model._meta.verbose_name_plural}: исправлено записей {changed}')
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
@@ -0,0 +1,68 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from books import fulltext
+from books.models import Book, BookContent
+
+
+def extract(task):
+    # Выполняется в дочернем процессе: читает и разбирает файл, в базу не пишет
+    book_id, name, known_hash, force = task
+    try:
+        return fulltext.extract_book(book_id, name, known_hash, force)
+    except OSError as error:
+        return fulltext.Extracted(book_id, known_hash, [], 0, f'{type(error).__name__}: {error}'[:500])
+
+
+class Command(BaseCommand):
+    help = 'Индексирует текст электронных книг для поиска по содержимому (только изменённые файлы)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help='Количество процессов, извлекающих текст')
+        parser.add_argument('--force', action='store_true', help='Переиндексировать и неизменённые файлы')
+
+    def handle(self, *args, **options):
+        if not fulltext.is_enabled():
+            self.stderr.write('Поиск по тексту книг поддерживается только для SQLite')
+            return
+        tasks = []
+        books = Book.objects.order_by('id').values_list('id', 'file_path', 'content__content_hash')
+        for book_id, name, known_hash in books.iterator(chunk_size=1000):
+            if name and fulltext.extractor_for(name):
+                tasks.append((book_id, name, known_hash or '', options['force']))
+            elif known_hash is not None:
+                # Файл убран или заменён неподдерживаемым форматом
+                fulltext.forget_book(book_id)
+
+        if options['processes'] <= 1 or len(tasks) <= 1:
+            self.save(map(extract, tasks))
+            return
+        # Соединения с базой не должны достаться дочерним процессам от родителя.
+        # Текст извлекают дочерние процессы, а пишет в индекс только этот:
+        # SQLite допускает одну пишущую транзакцию за раз
+        connections.close_all()
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+        with ProcessPoolExecutor(max_workers=options['processes'], mp_context=context,
+                                 initializer=django.setup) as executor:
+            self.save(executor.map(extract, tasks, chunksize=4))
+
+    def save(self, results):
+        indexed = skipped = failed = 0
+        for extracted in results:
+            if extracted is None:
+                skipped += 1
+                continue
+            fulltext.save_extracted(extracted)
+            if extracted.error:
+                failed += 1
+                self.stderr.write(f'Книга {extracted.book_id}: {extracted.error}')
+            else:
+                indexed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано книг: {indexed}, без изменений: {skipped}, с ошибками: {failed}'
+        ))
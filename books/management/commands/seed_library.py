@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.seeding import LibrarySeeder
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетической библиотекой для замеров производительности'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10000, help='Количество книг')
+        parser.add_argument('--users', type=int, default=50, help='Количество читателей с избранным')
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора случайных чисел')
+        parser.add_argument('--theme-depth', type=int, default=4, help='Глубина дерева тематик')
+        parser.add_argument('--theme-fanout', type=int, default=4, help='Количество подрубрик у рубрики')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Размер пачки bulk_create')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        seeder = LibrarySeeder(
+            books=options['books'],
+            users=options['users'],
+            seed=options['seed'],
+            theme_depth=options['theme_depth'],
+            theme_fanout=options['theme_fanout'],
+            batch_size=options['batch_size'],
+            stdout=self.stdout,
+        )
+        result = seeder.run()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с: ' + ', '.join(f'{name} {count}' for name, count in result.items())
+        ))
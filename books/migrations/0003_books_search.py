@@ -0,0 +1,74 @@
+# Generated by Django 4.2 on 2026-10-18 17:59
+
+import books.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS "books_search" USING fts5('
+        'title, author, editor, seria, tags, review, tokenize="unicode61 remove_diacritics 2")'
+    )
+    # Веса столбцов для bm25: совпадение в названии важнее совпадения в рецензии
+    schema_editor.execute(
+        'INSERT INTO "books_search"("books_search", rank) VALUES (\'rank\', \'bm25(10.0, 6.0, 2.0, 3.0, 4.0, 1.0)\')'
+    )
+
+    def normalize(text):
+        return (text or '').casefold().replace('ё', 'е')
+
+    Book = apps.get_model('books', 'Book')
+    rows = []
+    for book in Book.objects.select_related('author', 'editor', 'seria').prefetch_related('tags'):
+        author = book.author
+        rows.append((
+            book.id,
+            normalize(book.title),
+            normalize(' '.join(part for part in (author.sirname, author.name, author.fathername) if part != '.') if author else ''),
+            normalize(f'{book.editor.name} {book.editor.city}' if book.editor else ''),
+            normalize(book.seria.seria if book.seria else ''),
+            normalize(' '.join(tag.name for tag in book.tags.all())),
+            normalize(book.review),
+        ))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO "books_search"(rowid, title, author, editor, seria, tags, review) VALUES (%s, %s, %s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS "books_search"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSearch',
+            fields=[
+                ('book', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='books.book')),
+                ('title', models.TextField()),
+                ('author', models.TextField()),
+                ('editor', models.TextField()),
+                ('seria', models.TextField()),
+                ('tags', models.TextField()),
+                ('review', models.TextField()),
+                ('document', books.models.SearchVectorField(db_column='books_search')),
+                ('rank', models.FloatField(db_column='rank')),
+            ],
+            options={
+                'db_table': 'books_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
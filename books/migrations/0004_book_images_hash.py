@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_books_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='images_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+
+def normalize(name):
+    return ' '.join(str(name).split()).lower()[:100]
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    # Теги, различающиеся только регистром или пробелами, сливаются в тег с меньшим id
+    Tag = apps.get_model('books', 'Tag')
+    BookTags = apps.get_model('books', 'BookTags')
+    kept = {}
+    for tag in Tag.objects.order_by('id'):
+        key = normalize(tag.name)
+        if key not in kept:
+            kept[key] = tag.id
+            tag.normalized = key
+            tag.save(update_fields=['normalized'])
+            continue
+        target = kept[key]
+        tagged = set(BookTags.objects.filter(tag_id=target).values_list('book_id', flat=True))
+        BookTags.objects.filter(tag_id=tag.id, book_id__in=tagged).delete()
+        BookTags.objects.filter(tag_id=tag.id).update(tag_id=target)
+        tag.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_images_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='normalized',
+            field=models.CharField(db_column='NormalizedName', editable=False, max_length=100, null=True),
+        ),
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='normalized',
+            field=models.CharField(db_column='NormalizedName', editable=False, max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+
+
+def normalize_name(text):
+    return ' '.join(str(text).casefold().replace('ё', 'е').split())[:255]
+
+
+def fill_normalized(apps, schema_editor):
+    sources = {
+        'Author': lambda obj: ' '.join(p for p in (obj.sirname, obj.name, obj.fathername) if p != '.'),
+        'Editor': lambda obj: obj.name,
+        'Seria': lambda obj: obj.seria,
+        'Theme': lambda obj: obj.title,
+    }
+    for model_name, source in sources.items():
+        model = apps.get_model('books', model_name)
+        objects = list(model.objects.all())
+        for obj in objects:
+            obj.normalized = normalize_name(source(obj))
+        model.objects.bulk_update(objects, ['normalized'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_tag_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='normalized',
+            field=models.CharField(db_column='NormalizedName', db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='editor',
+            name='normalized',
+            field=models.CharField(db_column='NormalizedName', db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='seria',
+            name='normalized',
+            field=models.CharField(db_column='NormalizedName', db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='theme',
+            name='normalized',
+            field=models.CharField(db_column='NormalizedName', db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_normalized_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_column='UpdatedAt', db_index=True, verbose_name='Изменена'),
+        ),
+    ]
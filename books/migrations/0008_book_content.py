@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2026-10-18 18:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_content_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # Части текста книг; detail=full хранит позиции слов (фразы, NEAR, snippet)
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS "books_content" USING fts5('
+        'book_id UNINDEXED, part UNINDEXED, title, body, '
+        'tokenize="unicode61 remove_diacritics 2", detail=full)'
+    )
+    # Совпадение в заголовке главы важнее совпадения в тексте
+    schema_editor.execute(
+        'INSERT INTO "books_content"("books_content", rank) VALUES (\'rank\', \'bm25(0.0, 0.0, 4.0, 1.0)\')'
+    )
+
+
+def drop_content_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS "books_content"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_book_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookContent',
+            fields=[
+                ('book', models.OneToOneField(db_column='BookID', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='content', serialize=False, to='books.book')),
+                ('content_hash', models.CharField(db_column='ContentHash', max_length=64, verbose_name='sha256 файла')),
+                ('parts', models.IntegerField(db_column='Parts', default=0, verbose_name='Частей текста')),
+                ('chars', models.IntegerField(db_column='Chars', default=0, verbose_name='Символов')),
+                ('error', models.CharField(blank=True, db_column='Error', default='', max_length=500, verbose_name='Ошибка')),
+                ('indexed_at', models.DateTimeField(db_column='IndexedAt', verbose_name='Проиндексирована')),
+            ],
+            options={
+                'verbose_name': 'текст книги',
+                'verbose_name_plural': 'тексты книг',
+                'db_table': 'BookContent',
+            },
+        ),
+        migrations.RunPython(create_content_table, drop_content_table),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2 on 2026-10-18 18:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0008_book_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChapterIndex',
+            fields=[
+                ('book', models.OneToOneField(db_column='BookID', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='chapter_index', serialize=False, to='books.book')),
+                ('file_name', models.CharField(db_column='FileName', max_length=255, verbose_name='Файл')),
+                ('content_hash', models.CharField(db_column='ContentHash', max_length=64, verbose_name='sha256 файла')),
+                ('format', models.CharField(db_column='Format', max_length=10, verbose_name='Формат')),
+                ('encoding', models.CharField(blank=True, db_column='Encoding', default='', max_length=30, verbose_name='Кодировка')),
+                ('chapters', models.JSONField(db_column='Chapters', default=list, verbose_name='Главы')),
+                ('built_at', models.DateTimeField(auto_now=True, db_column='BuiltAt', verbose_name='Построено')),
+            ],
+            options={
+                'verbose_name': 'оглавление книги',
+                'verbose_name_plural': 'оглавления книг',
+                'db_table': 'ChapterIndex',
+            },
+        ),
+        migrations.CreateModel(
+            name='ReadingPosition',
+            fields=[
+                ('id', models.AutoField(db_column='id', primary_key=True, serialize=False)),
+                ('chapter', models.IntegerField(db_column='Chapter', default=0, verbose_name='Глава')),
+                ('progress', models.FloatField(db_column='Progress', default=0, verbose_name='Прочитано в главе')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_column='UpdatedAt', verbose_name='Изменено')),
+                ('book', models.ForeignKey(db_column='BookID', on_delete=django.db.models.deletion.CASCADE, to='books.book')),
+                ('user', models.ForeignKey(db_column='UserID', on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'место чтения',
+                'verbose_name_plural': 'места чтения',
+                'db_table': 'ReadingPosition',
+                'unique_together': {('user', 'book')},
+            },
+        ),
+    ]
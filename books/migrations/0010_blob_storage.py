@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-18 18:55
+
+import books.storage
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_reader'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(db_column='BlobID', primary_key=True, serialize=False)),
+                ('name', models.CharField(db_column='Name', max_length=255, unique=True, verbose_name='Файл')),
+                ('size', models.BigIntegerField(db_column='Size', default=0, verbose_name='Размер')),
+                ('refs', models.IntegerField(db_column='Refs', db_index=True, default=0, verbose_name='Ссылок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_column='CreatedAt', verbose_name='Загружен')),
+                ('touched_at', models.DateTimeField(db_column='TouchedAt', default=django.utils.timezone.now, verbose_name='Использован')),
+            ],
+            options={
+                'verbose_name': 'файл',
+                'verbose_name_plural': 'файлы',
+                'db_table': 'Blob',
+            },
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='file_path',
+            field=models.FileField(blank=True, storage=books.storage.ContentAddressedStorage(), upload_to='books/e_books'),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='images_path',
+            field=models.ImageField(blank=True, storage=books.storage.ContentAddressedStorage(), upload_to='books/images'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2 on 2026-10-18 18:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0010_blob_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(db_column='UploadID', default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(db_column='FileName', max_length=255, verbose_name='Имя файла')),
+                ('size', models.BigIntegerField(db_column='Size', verbose_name='Размер')),
+                ('chunk_size', models.IntegerField(db_column='ChunkSize', verbose_name='Размер части')),
+                ('sha256', models.CharField(blank=True, db_column='Sha256', default='', max_length=64, verbose_name='sha256')),
+                ('status', models.CharField(choices=[('open', 'Загружается'), ('assembling', 'Проверяется'), ('complete', 'Загружен'), ('failed', 'Ошибка')], db_column='Status', default='open', max_length=12, verbose_name='Состояние')),
+                ('file_name', models.CharField(blank=True, db_column='StoredName', default='', max_length=255, verbose_name='Файл')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_column='CreatedAt', verbose_name='Начата')),
+                ('expires_at', models.DateTimeField(db_column='ExpiresAt', db_index=True, verbose_name='Действует до')),
+                ('user', models.ForeignKey(db_column='UserID', on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'загрузка файла',
+                'verbose_name_plural': 'загрузки файлов',
+                'db_table': 'UploadSession',
+            },
+        ),
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.AutoField(db_column='id', primary_key=True, serialize=False)),
+                ('index', models.IntegerField(db_column='ChunkIndex')),
+                ('session', models.ForeignKey(db_column='UploadID', on_delete=django.db.models.deletion.CASCADE, related_name='received', to='books.uploadsession')),
+            ],
+            options={
+                'db_table': 'UploadChunk',
+                'unique_together': {('session', 'index')},
+            },
+        ),
+    ]
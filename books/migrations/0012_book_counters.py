@@ -0,0 +1,96 @@
+# Generated by Django 4.2 on 2026-10-18 19:01
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_counters(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    BookTags = apps.get_model('books', 'BookTags')
+
+    def store(model, rows):
+        counts = {pk: (books, read) for pk, books, read in rows if pk is not None}
+        objects = list(model.objects.only('pk'))
+        for obj in objects:
+            obj.books_count, obj.read_count = counts.get(obj.pk, (0, 0))
+        model.objects.bulk_update(objects, ['books_count', 'read_count'], batch_size=500)
+
+    def direct(queryset, field, read_filter):
+        return queryset.order_by().values(field).annotate(
+            books=Count('pk'), read=Count('pk', filter=read_filter),
+        ).values_list(field, 'books', 'read')
+
+    for field, model_name in (('seria', 'Seria'), ('author', 'Author'), ('place', 'Place')):
+        store(apps.get_model('books', model_name), direct(Book.objects.all(), field, Q(status=True)))
+    store(apps.get_model('books', 'Tag'), direct(BookTags.objects.all(), 'tag', Q(book__status=True)))
+
+    # Тематики - вместе с подтемами: итоги передаются снизу вверх
+    Theme = apps.get_model('books', 'Theme')
+    totals = {pk: [books, read] for pk, books, read in direct(Book.objects.all(), 'theme', Q(status=True))}
+    for pk, parent_id in Theme.objects.order_by('-level').values_list('pk', 'parent_id'):
+        if parent_id is not None and pk in totals:
+            parent = totals.setdefault(parent_id, [0, 0])
+            parent[0] += totals[pk][0]
+            parent[1] += totals[pk][1]
+    store(Theme, [(pk, books, read) for pk, (books, read) in totals.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='books_count',
+            field=models.PositiveIntegerField(db_column='BooksCount', default=0, editable=False, verbose_name='Книг'),
+        ),
+        migrations.AddField(
+            model_name='author',
+            name='read_count',
+            field=models.PositiveIntegerField(db_column='ReadCount', default=0, editable=False, verbose_name='Прочитано'),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='books_count',
+            field=models.PositiveIntegerField(db_column='BooksCount', default=0, editable=False, verbose_name='Книг'),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='read_count',
+            field=models.PositiveIntegerField(db_column='ReadCount', default=0, editable=False, verbose_name='Прочитано'),
+        ),
+        migrations.AddField(
+            model_name='seria',
+            name='books_count',
+            field=models.PositiveIntegerField(db_column='BooksCount', default=0, editable=False, verbose_name='Книг'),
+        ),
+        migrations.AddField(
+            model_name='seria',
+            name='read_count',
+            field=models.PositiveIntegerField(db_column='ReadCount', default=0, editable=False, verbose_name='Прочитано'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='books_count',
+            field=models.PositiveIntegerField(db_column='BooksCount', default=0, editable=False, verbose_name='Книг'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='read_count',
+            field=models.PositiveIntegerField(db_column='ReadCount', default=0, editable=False, verbose_name='Прочитано'),
+        ),
+        migrations.AddField(
+            model_name='theme',
+            name='books_count',
+            field=models.PositiveIntegerField(db_column='BooksCount', default=0, editable=False, verbose_name='Книг'),
+        ),
+        migrations.AddField(
+            model_name='theme',
+            name='read_count',
+            field=models.PositiveIntegerField(db_column='ReadCount', default=0, editable=False, verbose_name='Прочитано'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
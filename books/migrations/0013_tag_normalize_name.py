@@ -0,0 +1,55 @@
+from django.db import migrations
+from django.db.models import Count, Q
+
+
+def normalize(name):
+    return ' '.join(str(name).casefold().replace('ё', 'е').split())[:100]
+
+
+def renormalize_tags(apps, schema_editor):
+    # Нормализация тегов как у остальных справочников: теги, различающиеся только "ё"/"е"
+    # (или регистром в смысле casefold), сливаются в тег с меньшим id
+    Tag = apps.get_model('books', 'Tag')
+    BookTags = apps.get_model('books', 'BookTags')
+    kept = {}
+    merged = set()
+    changed = []
+    for tag in Tag.objects.order_by('id'):
+        key = normalize(tag.name)
+        if key not in kept:
+            kept[key] = tag.id
+            if tag.normalized != key:
+                changed.append((tag, key))
+            continue
+        target = kept[key]
+        tagged = set(BookTags.objects.filter(tag_id=target).values_list('book_id', flat=True))
+        BookTags.objects.filter(tag_id=tag.id, book_id__in=tagged).delete()
+        BookTags.objects.filter(tag_id=tag.id).update(tag_id=target)
+        tag.delete()
+        merged.add(target)
+
+    # Сначала временные значения: новое имя одного тега может совпадать с прежним именем другого
+    for tag, key in changed:
+        tag.normalized = f'#{tag.id}'
+    Tag.objects.bulk_update([tag for tag, _ in changed], ['normalized'], batch_size=500)
+    for tag, key in changed:
+        tag.normalized = key
+    Tag.objects.bulk_update([tag for tag, _ in changed], ['normalized'], batch_size=500)
+
+    # Счётчики книг у тегов, в которые слились другие
+    counts = BookTags.objects.filter(tag_id__in=merged).order_by().values('tag').annotate(
+        books=Count('pk'), read=Count('pk', filter=Q(book__status=True)),
+    ).values_list('tag', 'books', 'read')
+    for tag_id, books, read in counts:
+        Tag.objects.filter(pk=tag_id).update(books_count=books, read_count=read)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_book_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(renormalize_tags, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,87 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.urls import reverse
+from django.utils import timezone
 from mptt.models import MPTTModel, TreeForeignKey
 
+from .storage import blob_storage
+
+
+def normalize_name(text):
+    # Форма имени для поиска по префиксу: без учёта регистра, "ё" = "е", одиночные пробелы
+    return ' '.join(str(text).casefold().replace('ё', 'е').split())[:255]
+
+
+class NormalizedNameMixin(models.Model):
+    """
+    Справочник с индексируемой нормализованной формой названия (для автодополнения, books/autocomplete.py).
+    Модель задаёт name_for_search(); поле обновляется при save(), а при bulk_create -
+    вызовом set_normalized() для каждого объекта.
+    """
+    normalized = models.CharField(max_length=255, db_index=True, editable=False, default='',
+                                  db_column='NormalizedName')
+
+    class Meta:
+        abstract = True
+
+    def name_for_search(self):
+        raise NotImplementedError
+
+    def set_normalized(self):
+        self.normalized = normalize_name(self.name_for_search())
+
+    def save(self, *args, **kwargs):
+        self.set_normalized()
+        super().save(*args, **kwargs)
+
+
+class BookCountersMixin(models.Model):
+    """
+    Справочник с хранимым числом своих книг (books/counters.py): для тематики - вместе с подтемами.
+    Счётчики меняют сигналы сохранения и удаления книг и их тегов, пересчитывает `manage.py recount`.
+    """
+    books_count = models.PositiveIntegerField(default=0, editable=False, db_column='BooksCount',
+                                              verbose_name='Книг')
+    read_count = models.PositiveIntegerField(default=0, editable=False, db_column='ReadCount',
+                                             verbose_name='Прочитано')
+
+    class Meta:
+        abstract = True
+
+    @property
+    def unread_count(self):
+        return self.books_count - self.read_count
+
+
+class BookQuerySet(models.QuerySet):
+    # Поля, которые выводит карточка книги (books/includes/book_preview.html)
+    CARD_FIELDS = (
+        'id', 'title', 'year', 'status', 'controler', 'images_path', 'images_hash', 'file_path',
+        'author__id', 'author__sirname', 'author__name', 'author__fathername',
+        'theme__id', 'theme__title', 'theme__slug',
+    )
+
+    def cards(self, user=None):
+        """
+        Выборка для вывода карточек книг: связанные объекты подгружаются одним запросом,
+        теги - одним дополнительным, длинная рецензия не загружается,
+        признак "в избранном" вычисляется в том же запросе (поле is_favorite).
+        """
+        queryset = (
+            self.select_related('author', 'theme')
+            .prefetch_related(models.Prefetch('tags', queryset=Tag.objects.order_by('name')))
+            .only(*self.CARD_FIELDS)
+        )
+        if user is not None and user.is_authenticated:
+            favorites = Favorite.objects.filter(user=user, book=models.OuterRef('pk'))
+            return queryset.annotate(is_favorite=models.Exists(favorites))
+        return queryset.annotate(is_favorite=models.Value(False, output_field=models.BooleanField()))
+
+
 class Book(models.Model):
     class Status(models.IntegerChoices):
         UNCHECKED = 0, 'Не прочитано'
@@ -28,11 +105,17 @@ class Book(models.Model):
     pages = models.IntegerField(default=0, db_column='Количество страниц', verbose_name='Страницы')
     status = models.BooleanField(default=0, choices=(map(lambda x: (bool(x[0]), x[1]), Status.choices)), verbose_name='Прочитано')
     controler = models.BooleanField(default=0, choices=(map(lambda x: (bool(x[0]), x[1]), Controler.choices)), verbose_name='На контроле')
-    images_path = models.ImageField(upload_to='books/images', blank=True)
-    file_path = models.FileField(upload_to='books/e_books', blank=True)
+    images_path = models.ImageField(upload_to='books/images', storage=blob_storage, blank=True)
+    # sha256 содержимого обложки, по нему адресуются уменьшенные копии (books/thumbnails.py)
+    images_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    file_path = models.FileField(upload_to='books/e_books', storage=blob_storage, blank=True)
     review = models.CharField(max_length=2000, db_column='Рецензия', verbose_name='Рецензия')
     place = models.ForeignKey('Place', on_delete=models.CASCADE, db_column='PlaceID', null=True, verbose_name='Место хранения')
     tags = models.ManyToManyField('Tag', through='BookTags', related_name='books')
+    # Время последнего изменения книги, её тегов или справочников, которые выводятся в её описании
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, db_column='UpdatedAt', verbose_name='Изменена')
+
+    objects = BookQuerySet.as_manager()
 
     class Meta:
         db_table = 'Books'  # имя таблицы в базе данных
@@ -46,9 +129,11 @@ class Book(models.Model):
         return f'/books/{self.id}/detail/'
 
 
-class Tag(models.Model):
+class Tag(BookCountersMixin, models.Model):
     id = models.AutoField(primary_key=True, db_column='TagID')
     name = models.CharField(max_length=100, db_column='Name')
+    # Имя без различий в регистре, "ё"/"е" и пробелах; уникальный индекс не даёт создать один тег дважды
+    normalized = models.CharField(max_length=100, unique=True, editable=False, db_column='NormalizedName')
 
     class Meta:
         db_table = 'Tag'
@@ -58,6 +143,14 @@ class Tag(models.Model):
     def __str__(self):
         return f'Тег {self.name}'
 
+    @staticmethod
+    def normalize(name):
+        return normalize_name(name)[:100]
+
+    def save(self, *args, **kwargs):
+        self.normalized = self.normalize(self.name)
+        super().save(*args, **kwargs)
+
 
 class BookTags(models.Model):
     id = models.AutoField(primary_key=True, db_column='id')
@@ -85,7 +178,7 @@ class Favorite(models.Model):
          unique_together = ('user', 'book')
 
 
-class Author(models.Model):
+class Author(NormalizedNameMixin, BookCountersMixin, models.Model):
     id = models.AutoField(primary_key=True, db_column='AuthorID')
     sirname = models.CharField(max_length=100, db_column='Фамилия',verbose_name='Фамилия')
     name = models.CharField(max_length=100, db_column='Имя', verbose_name='Имя')
@@ -103,7 +196,10 @@ class Author(models.Model):
             self.fathername = ""
         return f'{self.sirname} {self.name} {self.fathername}'
 
-class Editor(models.Model):
+    def name_for_search(self):
+        return ' '.join(part for part in (self.sirname, self.name, self.fathername) if part != '.')
+
+class Editor(NormalizedNameMixin, models.Model):
     id = models.AutoField(primary_key=True, db_column='EditorID')
     name = models.CharField(max_length=100, db_column='Издательство',verbose_name='Издательство')
     city = models.CharField(max_length=100, db_column='Город',verbose_name='Город')
@@ -116,7 +212,10 @@ class Editor(models.Model):
     def __str__(self):
         return f'Издательство {self.name}, г. {self.city}'
 
-class Theme(MPTTModel):
+    def name_for_search(self):
+        return self.name
+
+class Theme(NormalizedNameMixin, BookCountersMixin, MPTTModel):
     title = models.CharField(max_length=50, unique=True, verbose_name='Тематика')
     parent = TreeForeignKey('self', on_delete=models.PROTECT, null=True, blank=True, related_name='children',
                             db_index=True, verbose_name='Родительская категория')
@@ -136,6 +235,9 @@ class Theme(MPTTModel):
     def __str__(self):
         return self.title
 
+    def name_for_search(self):
+        return self.title
+
 
 class Type(models.Model):
     id = models.AutoField(primary_key=True, db_column='TypeID')
@@ -175,7 +277,7 @@ class Format(models.Model):
         return f'{self.format}'
 
 
-class Seria(models.Model):
+class Seria(NormalizedNameMixin, BookCountersMixin, models.Model):
     id = models.AutoField(primary_key=True, db_column='SeriaID')
     seria = models.CharField(max_length=50, db_column='Серия книг',verbose_name='Серии книг')
 
@@ -187,7 +289,10 @@ class Seria(models.Model):
     def __str__(self):
         return f'{self.seria}'
 
-class Place(models.Model):
+    def name_for_search(self):
+        return self.seria
+
+class Place(BookCountersMixin, models.Model):
     id = models.AutoField(primary_key=True, db_column='PlaceID')
     place = models.CharField(max_length=50, db_column='Место хранения',verbose_name='Места хранения')
 
@@ -197,4 +302,156 @@ class Place(models.Model):
         verbose_name_plural = 'Места хранения'
 
     def __str__(self):
-        return f'{self.place}'
\ No newline at end of file
+        return f'{self.place}'
+
+class SearchVectorField(models.TextField):
+    """
+    Служебный столбец виртуальной таблицы FTS5, имя которого совпадает с именем таблицы.
+    Поддерживает единственный lookup: __match
+    """
+
+
+@SearchVectorField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class BookSearch(models.Model):
+    # Поисковый индекс каталога: виртуальная таблица SQLite FTS5 (создаётся миграцией,
+    # заполняется сигналами из books/signals.py). rowid таблицы совпадает с BookID
+    book = models.OneToOneField(Book, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+                                related_name='search_entry')
+    title = models.TextField()
+    author = models.TextField()
+    editor = models.TextField()
+    seria = models.TextField()
+    tags = models.TextField()
+    review = models.TextField()
+    document = SearchVectorField(db_column='books_search')
+    rank = models.FloatField(db_column='rank')
+
+    class Meta:
+        managed = False
+        db_table = 'books_search'
+
+
+class BookContent(models.Model):
+    # Состояние индекса текста электронной книги (books/fulltext.py): сами части текста
+    # хранятся в виртуальной таблице SQLite FTS5 "books_content"
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, db_column='BookID',
+                                related_name='content')
+    content_hash = models.CharField(max_length=64, db_column='ContentHash', verbose_name='sha256 файла')
+    parts = models.IntegerField(default=0, db_column='Parts', verbose_name='Частей текста')
+    chars = models.IntegerField(default=0, db_column='Chars', verbose_name='Символов')
+    error = models.CharField(max_length=500, blank=True, default='', db_column='Error', verbose_name='Ошибка')
+    indexed_at = models.DateTimeField(db_column='IndexedAt', verbose_name='Проиндексирована')
+
+    class Meta:
+        db_table = 'BookContent'
+        verbose_name = 'текст книги'
+        verbose_name_plural = 'тексты книг'
+
+
+class ChapterIndex(models.Model):
+    # Оглавление электронной книги для чтения по главам (books/ebooks.py)
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, db_column='BookID',
+                                related_name='chapter_index')
+    file_name = models.CharField(max_length=255, db_column='FileName', verbose_name='Файл')
+    content_hash = models.CharField(max_length=64, db_column='ContentHash', verbose_name='sha256 файла')
+    format = models.CharField(max_length=10, db_column='Format', verbose_name='Формат')
+    encoding = models.CharField(max_length=30, blank=True, default='', db_column='Encoding', verbose_name='Кодировка')
+    # [[заголовок, начало, конец, ...]] - место главы в файле, см. books/ebooks.py
+    chapters = models.JSONField(default=list, db_column='Chapters', verbose_name='Главы')
+    built_at = models.DateTimeField(auto_now=True, db_column='BuiltAt', verbose_name='Построено')
+
+    class Meta:
+        db_table = 'ChapterIndex'
+        verbose_name = 'оглавление книги'
+        verbose_name_plural = 'оглавления книг'
+
+
+class ReadingPosition(models.Model):
+    # Место, на котором пользователь остановился при чтении книги
+    id = models.AutoField(primary_key=True, db_column='id')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_column='UserID')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, db_column='BookID')
+    chapter = models.IntegerField(default=0, db_column='Chapter', verbose_name='Глава')
+    # Доля прокрутки главы, от 0 до 1
+    progress = models.FloatField(default=0, db_column='Progress', verbose_name='Прочитано в главе')
+    updated_at = models.DateTimeField(auto_now=True, db_column='UpdatedAt', verbose_name='Изменено')
+
+    class Meta:
+        db_table = 'ReadingPosition'
+        verbose_name = 'место чтения'
+        verbose_name_plural = 'места чтения'
+        unique_together = ('user', 'book')
+
+
+class Blob(models.Model):
+    # Файл в хранилище с адресацией по содержимому (books/storage.py) и число книг, которые на него ссылаются
+    id = models.AutoField(primary_key=True, db_column='BlobID')
+    name = models.CharField(max_length=255, unique=True, db_column='Name', verbose_name='Файл')
+    size = models.BigIntegerField(default=0, db_column='Size', verbose_name='Размер')
+    refs = models.IntegerField(default=0, db_index=True, db_column='Refs', verbose_name='Ссылок')
+    created_at = models.DateTimeField(auto_now_add=True, db_column='CreatedAt', verbose_name='Загружен')
+    # Время последней загрузки файла: файл без ссылок удаляется не сразу (storage.GRACE)
+    touched_at = models.DateTimeField(default=timezone.now, db_column='TouchedAt', verbose_name='Использован')
+
+    class Meta:
+        db_table = 'Blob'
+        verbose_name = 'файл'
+        verbose_name_plural = 'файлы'
+
+    def __str__(self):
+        return self.name
+
+
+class UploadSession(models.Model):
+    # Загрузка большого файла книги частями (books/uploads.py)
+    class Status(models.TextChoices):
+        OPEN = 'open', 'Загружается'
+        ASSEMBLING = 'assembling', 'Проверяется'
+        COMPLETE = 'complete', 'Загружен'
+        FAILED = 'failed', 'Ошибка'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, db_column='UploadID')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_column='UserID')
+    filename = models.CharField(max_length=255, db_column='FileName', verbose_name='Имя файла')
+    size = models.BigIntegerField(db_column='Size', verbose_name='Размер')
+    chunk_size = models.IntegerField(db_column='ChunkSize', verbose_name='Размер части')
+    # sha256 всего файла, если клиент его сообщил
+    sha256 = models.CharField(max_length=64, blank=True, default='', db_column='Sha256', verbose_name='sha256')
+    status = models.CharField(max_length=12, choices=Status.choices, default=Status.OPEN, db_column='Status',
+                              verbose_name='Состояние')
+    # Имя собранного файла в хранилище (books/storage.py)
+    file_name = models.CharField(max_length=255, blank=True, default='', db_column='StoredName', verbose_name='Файл')
+    created_at = models.DateTimeField(auto_now_add=True, db_column='CreatedAt', verbose_name='Начата')
+    expires_at = models.DateTimeField(db_index=True, db_column='ExpiresAt', verbose_name='Действует до')
+
+    class Meta:
+        db_table = 'UploadSession'
+        verbose_name = 'загрузка файла'
+        verbose_name_plural = 'загрузки файлов'
+
+    @property
+    def chunks(self):
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+
+class UploadChunk(models.Model):
+    # Принятая и проверенная часть файла; строки вставляются параллельными запросами без блокировок сессии
+    id = models.AutoField(primary_key=True, db_column='id')
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='received', db_column='UploadID')
+    index = models.IntegerField(db_column='ChunkIndex')
+
+    class Meta:
+        db_table = 'UploadChunk'
+        unique_together = ('session', 'index')
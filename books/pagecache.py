@@ -0,0 +1,175 @@
+"""
+Кэш целых страниц для анонимных посетителей.
+
+Страница кэшируется, если у запроса нет сессии и сообщений (значит, посетитель не вошёл),
+а в адресе только параметры из PARAMS. Ключ - путь и нормализованная строка запроса:
+параметры отсортированы, пустые значения и значения по умолчанию отброшены.
+Тело хранится сжатым gzip и отдаётся как есть клиентам, которые принимают gzip.
+
+Сброс точечный. Каждая запись помнит версии своих зависимостей - строк вида 'book:15',
+'theme-books:proza', 'catalog'. При чтении версии сверяются одним get_many, и запись,
+у которой хоть одна зависимость сброшена (purge), считается промахом.
+Сигналы (books/signals.py) при изменении книги сбрасывают её страницу и списки, в которых
+она выводится: каталог, страницы её тематики и тематик выше по дереву, серии.
+"""
+import gzip
+import hashlib
+import re
+import uuid
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import urlencode
+
+from .caching import LONG_TIMEOUT
+from .paginators import CURSOR_PARAM
+
+PARAMS = ('sort', 'order', 'page', 'search_query', CURSOR_PARAM)
+DEFAULTS = {'order': 'asc', 'page': '1'}
+TIMEOUT = LONG_TIMEOUT
+PREFIX = 'pagecache'
+# Зависимости всех страниц: общий сброс и счётчик книг в меню (MenuMixin)
+COMMON = ('all', 'books_count')
+
+_ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def page_key(request):
+    """Ключ страницы или None, если запрос кэшировать нельзя."""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    # Без cookie сессии пользователь точно анонимный, и request.user не загружается
+    if settings.SESSION_COOKIE_NAME in request.COOKIES or CookieStorage.cookie_name in request.COOKIES:
+        return None
+    params = []
+    for name in request.GET:
+        if name not in PARAMS:
+            return None
+        value = ' '.join(request.GET.get(name).split())
+        if value and value != DEFAULTS.get(name):
+            params.append((name, value))
+    query = urlencode(sorted(params))
+    return f'{PREFIX}:page:' + hashlib.md5(f'{request.path}?{query}'.encode()).hexdigest()
+
+
+def _dependency_key(name):
+    return f'{PREFIX}:dep:{name}'
+
+
+def versions(dependencies):
+    """{ключ зависимости: текущая версия}; отсутствующие версии создаются."""
+    keys = [_dependency_key(name) for name in dependencies]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    for key in missing:
+        cache.add(key, uuid.uuid4().hex, None)
+    if missing:
+        found.update(cache.get_many(missing))
+    return found
+
+
+def purge(*dependencies):
+    """Сбрасывает страницы, зависящие от перечисленного (после фиксации транзакции)."""
+    tokens = {_dependency_key(name): uuid.uuid4().hex for name in dependencies}
+    transaction.on_commit(lambda: cache.set_many(tokens, None))
+
+
+def purge_all():
+    purge('all')
+
+
+def purge_books(book_ids, placements=(), count_changed=False):
+    """
+    Сбрасывает страницы книг и списки, где они выводятся.
+    placements - известные пары (id тематики, id серии), например прежние значения полей книги;
+    для остальных книг пары загружаются из базы.
+    """
+    from .models import Book, Theme
+
+    book_ids = [book_id for book_id in book_ids if book_id is not None]
+    placements = set(placements)
+    if book_ids:
+        placements.update(Book.objects.filter(pk__in=book_ids).values_list('theme_id', 'seria_id'))
+    dependencies = ['catalog', *(f'book:{book_id}' for book_id in book_ids)]
+    if count_changed:
+        dependencies.append('books_count')
+    if any(seria_id not in (None, 1) for _, seria_id in placements):
+        dependencies.append('series')
+    # Книга выводится на странице своей тематики и всех тематик выше по дереву
+    themes = Theme.objects.filter(pk__in={theme_id for theme_id, _ in placements if theme_id})
+    for theme in themes.only('tree_id', 'lft', 'rght'):
+        dependencies += [
+            f'theme-books:{slug}' for slug in Theme.objects.filter(
+                tree_id=theme.tree_id, lft__lte=theme.lft, rght__gte=theme.rght,
+            ).values_list('slug', flat=True)
+        ]
+    purge(*dependencies)
+
+
+def cached_response(request, entry):
+    if _ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = HttpResponse(entry['body'], content_type=entry['content_type'])
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(entry['body']), content_type=entry['content_type'])
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['X-Page-Cache'] = 'hit'
+    return response
+
+
+def get(request, key):
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    current = cache.get_many(list(entry['dependencies']))
+    if current != entry['dependencies']:
+        return None
+    return cached_response(request, entry)
+
+
+def store(key, response, dependencies):
+    if response.status_code != 200 or response.streaming or response.cookies or response.has_header('Content-Encoding'):
+        return
+    cache.set(key, {
+        'dependencies': dependencies,
+        'content_type': response['Content-Type'],
+        'body': gzip.compress(response.content),
+    }, TIMEOUT)
+    response['X-Page-Cache'] = 'miss'
+
+
+class AnonymousPageCacheMixin:
+    """
+    Примесь для представлений: страница для анонимных посетителей берётся из кэша
+    до MenuMixin, запросов к базе и отрисовки шаблона.
+    page_dependencies - от чего зависит страница; get_object_dependencies() - зависимости,
+    известные только после загрузки объекта (например, автор книги).
+    """
+    page_dependencies = ()
+
+    def get_page_dependencies(self):
+        return [*COMMON, *self.page_dependencies]
+
+    def get_object_dependencies(self):
+        return []
+
+    def dispatch(self, request, *args, **kwargs):
+        key = page_key(request)
+        if key is None:
+            return super().dispatch(request, *args, **kwargs)
+        response = get(request, key)
+        if response is not None:
+            return response
+        # Версии запоминаются до отрисовки: сброс во время неё не даст сохранить устаревшую страницу
+        dependencies = versions(self.get_page_dependencies())
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        if response.status_code == 200:
+            dependencies.update(versions(self.get_object_dependencies()))
+            store(key, response, dependencies)
+        return response
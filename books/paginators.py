@@ -0,0 +1,234 @@
+"""
+Пагинация списков книг.
+
+CachedCountPaginator - обычная постраничная (OFFSET) навигация, но общее количество
+записей считается один раз и кладётся в кэш, а не выполняет COUNT(DISTINCT ...) на каждой странице.
+
+KeysetPaginator - курсорная навигация по ключу (поле сортировки, BookID). Страница выбирается
+условием WHERE по ключу последней показанной записи, поэтому глубокие страницы стоят столько же,
+сколько первая. Курсоры next/prev - непрозрачные подписанные токены.
+Режим включается параметром ?cursor= в адресе.
+"""
+import hashlib
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, ImproperlyConfigured
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+from .caching import LONG_TIMEOUT, versioned_key
+
+CURSOR_PARAM = 'cursor'
+COUNT_TIMEOUT = LONG_TIMEOUT
+
+
+def cached_count(queryset, timeout=COUNT_TIMEOUT):
+    # Ключ - хэш SQL-запроса: одинаковые выборки на разных страницах делят один счётчик.
+    # Версия каталога в ключе сбрасывает счётчики при любом изменении данных
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        # Заведомо пустая выборка (.none(), filter(pk__in=[])) - SQL для неё не строится
+        return 0
+    key = versioned_key('count', hashlib.sha1(f'{sql}{params}'.encode()).hexdigest())
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, 'query'):
+            return cached_count(self.object_list)
+        return super().count
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next:
+            return self.paginator.encode_cursor(self.object_list[-1], forward=True)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous:
+            return self.paginator.encode_cursor(self.object_list[0], forward=False)
+        return None
+
+
+class KeysetPaginator:
+    """
+    Курсорный пагинатор. Порядок берётся из первого поля order_by() выборки,
+    первичный ключ добавляется как второй ключ, чтобы порядок был однозначным.
+    Поле сортировки - собственное поле модели без NULL или аннотация выборки:
+    значение ключа читается из записи и сравнивается в WHERE.
+    """
+    salt = 'books.paginators.cursor'
+
+    def __init__(self, object_list, per_page):
+        self.per_page = int(per_page)
+        ordering = object_list.query.order_by
+        self.pk_name = object_list.model._meta.pk.name
+        field = ordering[0] if ordering else self.pk_name
+        if not isinstance(field, str):
+            raise ImproperlyConfigured(f'Курсорная навигация не поддерживает сортировку по выражению {field!r}')
+        self.descending = field.startswith('-')
+        self.field = field.lstrip('-')
+        if self.field == 'pk':
+            self.field = self.pk_name
+        self.check_field(object_list, self.field)
+        self.ordering = field
+        self.object_list = object_list
+
+    @staticmethod
+    def check_field(queryset, name):
+        if name in queryset.query.annotations:
+            return
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = None
+        # Поля связанных моделей (author__sirname) и внешние ключи не читаются из записи как значение,
+        # а NULL не сравнивается операторами < и > - такие записи выпали бы из обхода
+        if field is None or not field.concrete or field.is_relation or field.null:
+            raise ImproperlyConfigured(
+                f'Курсорная навигация по полю {name!r} невозможна: нужно собственное поле модели без NULL или аннотация'
+            )
+
+    @property
+    def count(self):
+        return cached_count(self.object_list)
+
+    def _order(self, reverse=False):
+        desc = self.descending != reverse
+        prefix = '-' if desc else ''
+        if self.field == self.pk_name:
+            return [prefix + self.pk_name]
+        return [prefix + self.field, prefix + self.pk_name]
+
+    def _after(self, value, pk, forward):
+        # Записи строго "после" ключа (value, pk) в направлении обхода
+        op = 'gt' if self.descending != forward else 'lt'
+        if self.field == self.pk_name:
+            return Q(**{f'{self.pk_name}__{op}': pk})
+        return (
+            Q(**{f'{self.field}__{op}': value}) |
+            Q(**{self.field: value, f'{self.pk_name}__{op}': pk})
+        )
+
+    def encode_cursor(self, obj, forward):
+        payload = {
+            'v': getattr(obj, self.field),
+            'k': obj.pk,
+            'f': forward,
+            'o': self.ordering,
+        }
+        return signing.dumps(payload, salt=self.salt, compress=True)
+
+    def decode_cursor(self, token):
+        try:
+            payload = signing.loads(token, salt=self.salt)
+            value, pk, forward, ordering = payload['v'], payload['k'], bool(payload['f']), payload['o']
+        except (signing.BadSignature, KeyError, TypeError):
+            raise InvalidPage('Некорректный курсор')
+        # Курсор, выданный для другой сортировки, указывает на чужой ключ
+        if ordering != self.ordering:
+            raise InvalidPage('Курсор выдан для другой сортировки')
+        return value, pk, forward
+
+    def page(self, token=None):
+        queryset = self.object_list
+        if not token:
+            rows = list(queryset.order_by(*self._order())[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], self, len(rows) > self.per_page, False)
+
+        value, pk, forward = self.decode_cursor(token)
+        queryset = queryset.filter(self._after(value, pk, forward))
+        rows = list(queryset.order_by(*self._order(reverse=not forward))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if forward:
+            return KeysetPage(rows, self, has_more, True)
+        rows.reverse()
+        return KeysetPage(rows, self, True, has_more)
+
+
+def paginate(request, queryset, per_page):
+    """
+    Разбивает выборку на страницы в режиме, заданном запросом (курсор или номер страницы).
+    Возвращает (paginator, page, page_range); page_range - сокращённый список номеров страниц
+    для OFFSET-режима и None для курсорного.
+    """
+    if CURSOR_PARAM in request.GET:
+        paginator = KeysetPaginator(queryset, per_page)
+        try:
+            page = paginator.page(request.GET.get(CURSOR_PARAM))
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return paginator, page, None
+
+    paginator = CachedCountPaginator(queryset, per_page)
+    try:
+        page = paginator.page(request.GET.get('page') or 1)
+    except InvalidPage as e:
+        raise Http404(str(e))
+    page_range = paginator.get_elided_page_range(page.number, on_each_side=2, on_ends=1)
+    return paginator, page, page_range
+
+
+def pagination_query(request):
+    # Параметры текущего запроса без номера страницы и курсора - для ссылок навигации
+    params = request.GET.copy()
+    params.pop('page', None)
+    params.pop(CURSOR_PARAM, None)
+    return params.urlencode()
+
+
+class KeysetPaginationMixin:
+    """
+    Примесь для ListView: сокращённая панель страниц, кэшируемый счётчик
+    и курсорный режим по параметру ?cursor=.
+    """
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, self.page_range = paginate(self.request, queryset, page_size)
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['page_range'] = getattr(self, 'page_range', None)
+        context['pagination_query'] = pagination_query(self.request)
+        return context
@@ -0,0 +1,121 @@
+"""
+Полнотекстовый поиск по каталогу.
+
+Индекс хранится в виртуальной таблице SQLite FTS5 "books_search" (модель BookSearch),
+строка индекса имеет rowid = BookID. Текст в индекс и в запрос попадает уже нормализованным:
+встроенные LOWER()/REGEXP в SQLite не приводят к нижнему регистру кириллицу, а "ё" и "е"
+пользователи пишут вперемешку. Индекс обновляется сигналами (books/signals.py),
+полностью перестраивается командой `manage.py rebuild_search_index`.
+"""
+import re
+
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+
+from .models import Book, BookSearch
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    return (text or '').casefold().replace('ё', 'е')
+
+
+def is_enabled():
+    # FTS5 есть только в SQLite; на других СУБД остаётся поиск через iregex
+    return connection.vendor == 'sqlite'
+
+
+def build_match_expression(query):
+    # Каждое слово запроса ищется как префикс, слова объединяются по И
+    words = WORD_RE.findall(normalize(query))
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def author_full_name(author):
+    if author is None:
+        return ''
+    return ' '.join(part for part in (author.sirname, author.name, author.fathername) if part != '.')
+
+
+def book_document(book):
+    return (
+        normalize(book.title),
+        normalize(author_full_name(book.author)),
+        normalize(f'{book.editor.name} {book.editor.city}' if book.editor else ''),
+        normalize(book.seria.seria if book.seria else ''),
+        normalize(' '.join(tag.name for tag in book.tags.all())),
+        normalize(book.review),
+    )
+
+
+def remove_books(book_ids):
+    book_ids = list(book_ids)
+    if not is_enabled() or not book_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany('DELETE FROM "books_search" WHERE rowid = %s', [(pk,) for pk in book_ids])
+
+
+def index_books(book_ids):
+    book_ids = list(book_ids)
+    if not is_enabled() or not book_ids:
+        return
+    books = (
+        Book.objects.filter(id__in=book_ids)
+        .select_related('author', 'editor', 'seria')
+        .prefetch_related('tags')
+    )
+    rows = [(book.id, *book_document(book)) for book in books]
+    remove_books(book_ids)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO "books_search"(rowid, title, author, editor, seria, tags, review) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+def rebuild_index(batch_size=1000):
+    if not is_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM "books_search"')
+    count = 0
+    book_ids = Book.objects.order_by('id').values_list('id', flat=True)
+    batch = []
+    for pk in book_ids.iterator(chunk_size=batch_size):
+        batch.append(pk)
+        if len(batch) == batch_size:
+            index_books(batch)
+            count += len(batch)
+            batch = []
+    index_books(batch)
+    count += len(batch)
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO "books_search"("books_search") VALUES (\'optimize\')')
+    return count
+
+
+def search_books(queryset, query):
+    """
+    Отбирает из queryset книги, подходящие под поисковый запрос.
+    Если доступен FTS5, результат аннотируется полем rank (bm25, чем меньше, тем релевантнее).
+    """
+    if not is_enabled():
+        return queryset.filter(
+            Q(title__iregex=query) |
+            Q(author__sirname__iregex=query) |
+            Q(tags__name__iregex=query)
+        ).annotate(rank=Value(0.0, output_field=FloatField())).distinct()
+
+    expression = build_match_expression(query)
+    if not expression:
+        # В запросе нет ни одного слова; поле rank нужно и пустой выборке - по нему сортирует каталог
+        return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+    return queryset.filter(search_entry__document__match=expression).annotate(rank=F('search_entry__rank'))
+
+
+def matching_ids(query):
+    """id всех книг, подходящих под поисковый запрос (без сортировки и загрузки полей)."""
+    return list(search_books(Book.objects.all(), query).order_by().values_list('id', flat=True))
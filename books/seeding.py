@@ -0,0 +1,213 @@
+"""
+Генератор синтетической библиотеки для замеров производительности и тестов
+(команда `manage.py seed_library`, books/benchmarks.py, books/tests.py).
+
+Данные создаются через bulk_create и похожи на настоящий каталог:
+- дерево тематик заданной глубины и ветвистости (MPTT пересчитывается один раз в конце);
+- авторы, серии, издательства и теги выбираются по закону Ципфа: у немногих авторов
+  много книг, у большинства - одна-две;
+- у части пользователей есть избранное, у активных - сотни книг.
+Генерация детерминирована при одинаковом seed.
+"""
+import itertools
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from . import caching, counters, pagecache, search
+from .models import (
+    Author, Book, BookTags, Cover, Editor, Favorite, Format, Place, Seria, Tag, Theme, Type,
+)
+
+SURNAMES = (
+    'Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов',
+    'Михайлов', 'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов',
+)
+NAMES = ('Александр', 'Мария', 'Сергей', 'Анна', 'Дмитрий', 'Елена', 'Андрей', 'Ольга', 'Алексей', '.')
+FATHERNAMES = ('Александрович', 'Сергеевна', 'Петрович', 'Ивановна', 'Николаевич', '.')
+WORDS = (
+    'война', 'мир', 'время', 'город', 'море', 'дорога', 'тайна', 'ночь', 'свет', 'история', 'сад',
+    'дом', 'путь', 'зима', 'лето', 'звезда', 'остров', 'ветер', 'память', 'река', 'сердце', 'огонь',
+    'ёлка', 'письмо', 'капитан', 'мастер', 'книга', 'последний', 'тихий', 'белый', 'северный',
+)
+CITIES = ('Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург')
+TYPES = ('Художественная', 'Научная', 'Учебная', 'Справочная', 'Детская')
+COVERS = ('Твёрдая', 'Мягкая', 'Суперобложка', 'Интегральная')
+FORMATS = ('60x84/16', '70x100/32', '84x108/32', 'A5', 'A4', '60x90/16', '75x90/32', '70x90/16')
+PLACES = ('Гостиная', 'Кабинет', 'Спальня', 'Дача', 'Антресоль', 'Электронная')
+
+
+class Zipf:
+    """Выбор элемента с вероятностью, обратно пропорциональной рангу в степени s."""
+
+    def __init__(self, items, s=1.1, rng=random):
+        self.items = list(items)
+        self.weights = list(itertools.accumulate(1 / rank ** s for rank in range(1, len(self.items) + 1)))
+        self.rng = rng
+
+    def __call__(self):
+        return self.rng.choices(self.items, cum_weights=self.weights)[0]
+
+    def sample(self, k):
+        return {self() for _ in range(k)}
+
+
+class LibrarySeeder:
+
+    def __init__(self, books=1000, users=20, seed=1, theme_depth=4, theme_fanout=4, batch_size=2000, stdout=None):
+        self.books = books
+        self.users = users
+        self.rng = random.Random(seed)
+        self.theme_depth = theme_depth
+        self.theme_fanout = theme_fanout
+        self.batch_size = batch_size
+        self.stdout = stdout
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def _create(self, model, objects):
+        for obj in objects:
+            if hasattr(obj, 'set_normalized'):
+                obj.set_normalized()
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_lookups(self):
+        rng = self.rng
+        if not Seria.objects.filter(id=1).exists():
+            # Служебная запись "без серии" (id=1) есть в любой библиотеке
+            self._create(Seria, [Seria(id=1, seria='Без серии')])
+        self.types = self._create(Type, [Type(type=name) for name in TYPES])
+        self.covers = self._create(Cover, [Cover(cover=name) for name in COVERS])
+        self.formats = self._create(Format, [Format(format=name) for name in FORMATS])
+        self.places = self._create(Place, [Place(place=name) for name in PLACES])
+        start = Editor.objects.count()
+        self.editors = self._create(Editor, [
+            Editor(name=f'Издательство {start + number}', city=rng.choice(CITIES))
+            for number in range(1, max(self.books // 50, 10) + 1)
+        ])
+        self.authors = self._create(Author, [
+            Author(sirname=f'{rng.choice(SURNAMES)}-{number}', name=rng.choice(NAMES), fathername=rng.choice(FATHERNAMES))
+            for number in range(1, max(self.books // 10, 20) + 1)
+        ])
+        start = Seria.objects.count()
+        self.series = self._create(Seria, [
+            Seria(seria=f'Серия {start + number}') for number in range(1, max(self.books // 40, 5) + 1)
+        ])
+        existing = set(Tag.objects.values_list('normalized', flat=True))
+        names = [f'{rng.choice(WORDS)}-{number}' for number in range(1, max(self.books // 20, 30) + 1)]
+        self._create(Tag, [Tag(name=name, normalized=Tag.normalize(name)) for name in names
+                           if Tag.normalize(name) not in existing])
+        self.tags = list(Tag.objects.filter(normalized__in=[Tag.normalize(name) for name in names]))
+
+    def create_themes(self):
+        # Дерево строится по уровням без пересчёта MPTT, границы узлов считаются одним rebuild()
+        prefix = f'{Theme.objects.count() + 1}'
+        level = [None]
+        leaves = []
+        for depth in range(1, self.theme_depth + 1):
+            nodes = []
+            for parent in level:
+                parent_path = parent.slug[len('r-'):] if parent is not None else prefix
+                for number in range(1, self.theme_fanout + 1):
+                    path = f'{parent_path}-{number}'
+                    nodes.append(Theme(
+                        title=f'Рубрика {path}', slug=f'r-{path}', parent=parent,
+                        lft=0, rght=0, tree_id=0, level=depth - 1,
+                    ))
+            with Theme.objects.disable_mptt_updates():
+                level = self._create(Theme, nodes)
+            if depth == self.theme_depth:
+                leaves = level
+        Theme.objects.rebuild()
+        self.themes = list(Theme.objects.filter(id__in=[theme.id for theme in leaves]))
+        # Часть книг относится к промежуточным рубрикам, а не только к листьям
+        self.themes += list(Theme.objects.filter(level__lt=self.theme_depth - 1, slug__startswith=f'r-{prefix}-'))
+
+    def create_books(self):
+        rng = self.rng
+        authors = Zipf(self.authors, rng=rng)
+        editors = Zipf(self.editors, rng=rng)
+        series = Zipf(self.series, s=1.3, rng=rng)
+        themes = Zipf(self.themes, s=0.8, rng=rng)
+        tags = Zipf(self.tags, rng=rng)
+        created = 0
+        self.book_ids = []
+        while created < self.books:
+            size = min(self.batch_size, self.books - created)
+            batch = []
+            for _ in range(size):
+                words = rng.sample(WORDS, rng.randint(1, 4))
+                in_seria = rng.random() < 0.3
+                batch.append(Book(
+                    title=' '.join(words).capitalize()[:100],
+                    author_id=authors().id,
+                    editor_id=editors().id,
+                    year=rng.randint(1900, 2024) if rng.random() > 0.05 else 0,
+                    theme_id=themes().id,
+                    type_id=rng.choice(self.types).id,
+                    cover_id=rng.choice(self.covers).id,
+                    format_id=rng.choice(self.formats).id,
+                    seria_id=series().id if in_seria else 1,
+                    tom=rng.randint(1, 12) if in_seria else 0,
+                    pages=rng.randint(50, 1200),
+                    status=rng.random() < 0.4,
+                    controler=rng.random() < 0.1,
+                    review=' '.join(rng.choices(WORDS, k=rng.randint(5, 40))),
+                    place_id=rng.choice(self.places).id,
+                ))
+            with transaction.atomic():
+                books = Book.objects.bulk_create(batch)
+                BookTags.objects.bulk_create(
+                    [BookTags(book_id=book.id, tag_id=tag.id)
+                     for book in books for tag in tags.sample(rng.randint(0, 5))],
+                    batch_size=self.batch_size,
+                )
+            self.book_ids += [book.id for book in books]
+            created += size
+            self.log(f'Книг создано: {created}')
+
+    def create_users(self):
+        rng = self.rng
+        User = get_user_model()
+        start = User.objects.count()
+        password = make_password(None)
+        users = User.objects.bulk_create([
+            User(username=f'reader{start + number}', email=f'reader{start + number}@example.com', password=password)
+            for number in range(1, self.users + 1)
+        ])
+        books = Zipf(self.book_ids, s=0.9, rng=rng)
+        favorites = []
+        for user in users:
+            # Активность читателей тоже неравномерна: у немногих сотни книг в избранном
+            count = min(int(rng.paretovariate(1.2) * 5), len(self.book_ids), 500)
+            favorites += [Favorite(user_id=user.id, book_id=book_id) for book_id in books.sample(count)]
+        Favorite.objects.bulk_create(favorites, batch_size=self.batch_size)
+        self.user_ids = [user.id for user in users]
+
+    def run(self):
+        self.log('Справочники...')
+        self.create_lookups()
+        self.log('Тематики...')
+        self.create_themes()
+        self.create_books()
+        self.log('Пользователи и избранное...')
+        self.create_users()
+        self.log('Поисковый индекс...')
+        search.rebuild_index()
+        # Книги и теги вставлялись пакетами, без сигналов
+        self.log('Счётчики книг...')
+        counters.recount()
+        caching.bump_catalog_version()
+        pagecache.purge_all()
+        return {
+            'books': len(self.book_ids),
+            'authors': len(self.authors),
+            'themes': Theme.objects.count(),
+            'tags': len(self.tags),
+            'users': len(self.user_ids),
+            'favorites': Favorite.objects.filter(user_id__in=self.user_ids).count(),
+        }
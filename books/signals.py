@@ -0,0 +1,365 @@
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import caching, counters, facets, fulltext, pagecache, search, storage, tasks
+from .models import Author, Book, BookTags, Cover, Editor, Favorite, Format, Place, Seria, Tag, Theme, Type
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    search.remove_books([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.tags.through)
+def reindex_book_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        if action != 'pre_clear':
+            search.index_books([instance.pk])
+        return
+    # tag.books.add(...) / tag.books.clear(): меняются теги сразу у нескольких книг
+    if action == 'pre_clear':
+        instance._cleared_book_ids = list(instance.books.values_list('id', flat=True))
+    elif action == 'post_clear':
+        search.index_books(getattr(instance, '_cleared_book_ids', []))
+    else:
+        search.index_books(pk_set or [])
+
+
+@receiver(post_save, sender=BookTags)
+@receiver(post_delete, sender=BookTags)
+def reindex_book_tag_row(sender, instance, raw=False, **kwargs):
+    # Строки BookTags, изменённые напрямую (например, из админки), минуя m2m-менеджер
+    if raw:
+        return
+    search.index_books([instance.book_id])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Editor)
+@receiver(post_save, sender=Seria)
+@receiver(post_save, sender=Tag)
+def reindex_related_books(sender, instance, created=False, raw=False, **kwargs):
+    # Переименование автора, издательства, серии или тега меняет текст индекса его книг;
+    # книг может быть много, поэтому индекс обновляется в фоновой задаче
+    if raw or created:
+        return
+    model_name = sender._meta.model_name
+    tasks.reindex_reference.enqueue(model_name, instance.pk, dedup_key=f'reindex:{model_name}:{instance.pk}')
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=BookTags)
+@receiver(post_delete, sender=BookTags)
+@receiver(post_save, sender=Theme)
+@receiver(post_delete, sender=Theme)
+@receiver(post_save, sender=Seria)
+@receiver(post_delete, sender=Seria)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Editor)
+@receiver(post_delete, sender=Editor)
+@receiver(post_save, sender=Type)
+@receiver(post_delete, sender=Type)
+@receiver(post_save, sender=Cover)
+@receiver(post_delete, sender=Cover)
+@receiver(post_save, sender=Format)
+@receiver(post_delete, sender=Format)
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+def invalidate_catalog_cache(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    version = caching.bump_catalog_version()
+    # Изменение книги обновляет только её строку фасетного индекса, изменение любого справочника -
+    # весь индекс вместе с подписями значений фасетов
+    if sender is Book:
+        book_ids = [instance.pk]
+    elif sender is BookTags:
+        book_ids = [instance.book_id]
+    else:
+        book_ids = None
+    facets.catalog_changed(version, book_ids)
+
+
+@receiver(m2m_changed, sender=Book.tags.through)
+def invalidate_catalog_cache_on_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    version = caching.bump_catalog_version()
+    if not reverse:
+        book_ids = [instance.pk]
+    elif action == 'post_clear':
+        book_ids = getattr(instance, '_cleared_book_ids', None)
+    else:
+        book_ids = pk_set or []
+    facets.catalog_changed(version, book_ids)
+
+
+@receiver(pre_save, sender=Book)
+def detect_cover_change(sender, instance, raw=False, **kwargs):
+    # Новый загруженный файл ещё не сохранён в хранилище (_committed=False)
+    if raw:
+        return
+    if not instance.images_path:
+        instance.images_hash = ''
+        instance._cover_changed = False
+    else:
+        instance._cover_changed = not instance.images_path._committed or not instance.images_hash
+
+
+@receiver(post_save, sender=Book)
+def build_cover_thumbnails(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, '_cover_changed', False):
+        return
+    instance._cover_changed = False
+    # Уменьшенные копии строит обработчик очереди, запрос сохранения книги их не ждёт
+    tasks.process_cover.enqueue(instance.pk, dedup_key=f'cover:{instance.pk}')
+
+
+@receiver(pre_save, sender=Book)
+def detect_file_change(sender, instance, raw=False, **kwargs):
+    # Загружен новый файл книги (ещё не сохранён в хранилище) или файл убран
+    if raw:
+        return
+    instance._file_changed = bool(instance.file_path) and not instance.file_path._committed
+
+
+@receiver(post_save, sender=Book)
+def index_book_content(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old_file = getattr(instance, '_old_file', '') or ''
+    changed = getattr(instance, '_file_changed', False) or old_file != (instance.file_path.name or '')
+    instance._file_changed = False
+    if changed:
+        # Текст книги индексируется для поиска и чтения обработчиком очереди
+        tasks.index_content.enqueue(instance.pk, dedup_key=f'content:{instance.pk}')
+        tasks.build_chapter_index.enqueue(instance.pk, dedup_key=f'chapters:{instance.pk}')
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book_content(sender, instance, **kwargs):
+    fulltext.remove_book(instance.pk)
+
+
+@receiver(post_save, sender=Book)
+def count_book_file_refs(sender, instance, raw=False, **kwargs):
+    # Счётчики ссылок на файлы в хранилище с адресацией по содержимому (books/storage.py)
+    if raw:
+        return
+    storage.change_refs(getattr(instance, '_old_files', []), storage.book_files(instance))
+    instance._old_files = storage.book_files(instance)
+
+
+@receiver(post_delete, sender=Book)
+def release_book_file_refs(sender, instance, **kwargs):
+    storage.change_refs(storage.book_files(instance), [])
+
+
+@receiver(pre_save, sender=Book)
+def remember_book_placement(sender, instance, raw=False, **kwargs):
+    # Прежние тематика и серия: их страницы тоже нужно сбросить, если книгу перенесли
+    if raw or instance.pk is None:
+        instance._old_placement = None
+        instance._old_file = ''
+        instance._old_files = []
+        instance._old_counters = None
+        return
+    old = Book.objects.filter(pk=instance.pk).values_list(
+        'theme_id', 'seria_id', 'file_path', 'images_path', 'author_id', 'place_id', 'status',
+    ).first()
+    instance._old_placement = old[:2] if old else None
+    instance._old_file = old[2] if old else ''
+    instance._old_files = list(old[2:4]) if old else []
+    # Прежние значения в порядке counters.book_key()
+    instance._old_counters = (old[0], old[1], old[4], old[5], bool(old[6])) if old else None
+
+
+@receiver(post_save, sender=Book)
+def count_saved_book(sender, instance, raw=False, **kwargs):
+    # Счётчики книг у тематик, серий, авторов и мест хранения (books/counters.py)
+    if raw:
+        return
+    key = counters.book_key(instance)
+    counters.book_saved(getattr(instance, '_old_counters', None), key, instance.pk)
+    instance._old_counters = key
+
+
+@receiver(post_delete, sender=Book)
+def uncount_deleted_book(sender, instance, **kwargs):
+    counters.book_deleted(counters.book_key(instance))
+
+
+@receiver(post_save, sender=BookTags)
+@receiver(post_delete, sender=BookTags)
+def count_book_tag_row(sender, instance, raw=False, created=False, signal=None, **kwargs):
+    # Удаление через book.tags.remove()/clear() тоже приходит сюда: менеджер удаляет строки запросом с сигналами
+    if raw:
+        return
+    pair = [(instance.book_id, instance.tag_id)]
+    if signal is post_delete:
+        counters.tags_changed(removed=pair)
+    elif created:
+        counters.tags_changed(added=pair)
+
+
+@receiver(m2m_changed, sender=Book.tags.through)
+def count_added_book_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    # book.tags.add() вставляет строки BookTags пакетом, без post_save; pk_set - только новые связи
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        counters.tags_changed(added=[(book_id, instance.pk) for book_id in pk_set])
+    else:
+        counters.tags_changed(added=[(instance.pk, tag_id) for tag_id in pk_set])
+
+
+@receiver(pre_save, sender=Theme)
+def remember_theme_parent(sender, instance, raw=False, **kwargs):
+    instance._old_parent_id = (
+        Theme.objects.filter(pk=instance.pk).values_list('parent_id', flat=True).first()
+        if not raw and instance.pk is not None else None
+    )
+
+
+@receiver(post_save, sender=Theme)
+def recount_moved_theme(sender, instance, raw=False, created=False, **kwargs):
+    # Тематика перенесена в другую ветку: итоги поддеревьев пересчитываются целиком (тематик немного)
+    if raw or created or instance.parent_id == getattr(instance, '_old_parent_id', instance.parent_id):
+        return
+    counters.recount_themes()
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def purge_book_pages(sender, instance, raw=False, created=False, signal=None, **kwargs):
+    if raw:
+        return
+    placements = [(instance.theme_id, instance.seria_id)]
+    old = getattr(instance, '_old_placement', None)
+    if old:
+        placements.append(old)
+    pagecache.purge_books([instance.pk], placements, count_changed=created or signal is post_delete)
+
+
+@receiver(post_save, sender=BookTags)
+@receiver(post_delete, sender=BookTags)
+def purge_book_tag_pages(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    pagecache.purge_books([instance.book_id])
+
+
+@receiver(m2m_changed, sender=Book.tags.through)
+def purge_book_tags_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        pagecache.purge_books([instance.pk])
+    elif action == 'post_clear':
+        pagecache.purge_books(getattr(instance, '_cleared_book_ids', []))
+    else:
+        pagecache.purge_books(pk_set or [])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Editor)
+@receiver(post_delete, sender=Editor)
+@receiver(post_save, sender=Seria)
+@receiver(post_delete, sender=Seria)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Theme)
+@receiver(post_delete, sender=Theme)
+@receiver(post_save, sender=Type)
+@receiver(post_delete, sender=Type)
+@receiver(post_save, sender=Cover)
+@receiver(post_delete, sender=Cover)
+@receiver(post_save, sender=Format)
+@receiver(post_delete, sender=Format)
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+def purge_reference_pages(sender, instance, raw=False, **kwargs):
+    # Справочники выводятся в карточках и фасетах всех списков, но в описании - только своих книг
+    if raw:
+        return
+    dependencies = [f'{sender._meta.model_name}:{instance.pk}', 'catalog', 'listings']
+    if sender is Theme:
+        dependencies.append('themes')
+    elif sender is Seria:
+        dependencies.append('series')
+    elif sender is Tag:
+        dependencies.append('tags')
+    pagecache.purge(*dependencies)
+
+
+def touch_books(book_ids):
+    # Book.updated_at для условных запросов (books/conditional.py) без сигналов сохранения книги
+    Book.objects.filter(pk__in=list(book_ids)).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=BookTags)
+@receiver(post_delete, sender=BookTags)
+def touch_book_on_tag_row(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    touch_books([instance.book_id])
+
+
+@receiver(m2m_changed, sender=Book.tags.through)
+def touch_books_on_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        touch_books([instance.pk])
+    elif action == 'post_clear':
+        touch_books(getattr(instance, '_cleared_book_ids', []))
+    else:
+        touch_books(pk_set or [])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Editor)
+@receiver(post_save, sender=Seria)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Theme)
+@receiver(post_save, sender=Type)
+@receiver(post_save, sender=Cover)
+@receiver(post_save, sender=Format)
+@receiver(post_save, sender=Place)
+def touch_related_books(sender, instance, created=False, raw=False, **kwargs):
+    # Переименование справочника меняет описание всех его книг
+    if raw or created:
+        return
+    books = instance.books.all() if sender is Tag else Book.objects.filter(**{sender._meta.model_name: instance})
+    books.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def touch_user_on_favorite(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    caching.touch(f'user:{instance.user_id}')
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def touch_user(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    caching.touch(f'user:{instance.pk}')
@@ -0,0 +1,66 @@
+// Автодополнение для <select data-autocomplete-url="..."> (виджет books.autocomplete.AutocompleteSelect).
+// Перед списком добавляется поле поиска; варианты подгружаются по мере ввода и заменяют
+// содержимое списка, выбранное значение при этом сохраняется.
+(function () {
+    const DELAY = 250;
+
+    function setup(select) {
+        if (select.dataset.autocompleteReady) {
+            return;
+        }
+        select.dataset.autocompleteReady = '1';
+        const input = document.createElement('input');
+        input.type = 'search';
+        input.className = 'form-control mb-1 vTextField';
+        input.placeholder = 'Начните вводить название';
+        input.autocomplete = 'off';
+        select.parentNode.insertBefore(input, select);
+
+        let timer = null;
+        let controller = null;
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            timer = setTimeout(() => load(select, input.value.trim()), DELAY);
+        });
+
+        function load(select, query) {
+            if (!query) {
+                return;
+            }
+            if (controller) {
+                controller.abort();
+            }
+            controller = new AbortController();
+            const url = select.dataset.autocompleteUrl + '?q=' + encodeURIComponent(query);
+            fetch(url, {signal: controller.signal})
+                .then((response) => response.json())
+                .then((data) => {
+                    const current = select.value;
+                    const keep = Array.from(select.options).filter((option) => option.value === '' || option.value === current);
+                    select.innerHTML = '';
+                    keep.forEach((option) => select.appendChild(option));
+                    data.results.forEach((item) => {
+                        if (String(item.id) !== current) {
+                            select.appendChild(new Option(item.text, item.id));
+                        }
+                    });
+                    select.size = Math.min(select.options.length, 8);
+                })
+                .catch(() => {});
+        }
+
+        select.addEventListener('change', () => {
+            select.size = 0;
+        });
+    }
+
+    function init() {
+        document.querySelectorAll('select[data-autocomplete-url]').forEach(setup);
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', init);
+    } else {
+        init();
+    }
+})();
@@ -0,0 +1,142 @@
+// Загрузка большого файла книги частями до отправки формы (books/uploads.py):
+// части отправляются параллельно с sha256 каждой, после обрыва связи загрузка того же файла
+// продолжается с недостающих частей, форма уходит без файла - только с id сессии в поле upload
+(function () {
+    const PARALLEL = 3;
+    const RETRIES = 3;
+    const STORAGE_PREFIX = 'chunked-upload:';
+
+    function hex(buffer) {
+        return Array.from(new Uint8Array(buffer), (byte) => byte.toString(16).padStart(2, '0')).join('');
+    }
+
+    function request(url, token, options) {
+        const headers = Object.assign({'X-CSRFToken': token}, options.headers || {});
+        return fetch(url, Object.assign({}, options, {headers: headers, credentials: 'same-origin'}))
+            .then((response) => {
+                if (response.status === 204) {
+                    return null;
+                }
+                return response.json().then((data) => {
+                    if (!response.ok) {
+                        const error = new Error(data.error || response.statusText);
+                        error.status = response.status;
+                        throw error;
+                    }
+                    return data;
+                });
+            });
+    }
+
+    function upload(input, file, token, report) {
+        const baseUrl = input.dataset.uploadUrl;
+        const key = STORAGE_PREFIX + [file.name, file.size, file.lastModified].join(':');
+
+        function start() {
+            // Сессия, начатая для этого же файла до обрыва, продолжается
+            const saved = localStorage.getItem(key);
+            const resume = saved
+                ? request(baseUrl + saved + '/', token, {method: 'GET'}).catch(() => null)
+                : Promise.resolve(null);
+            return resume.then((session) => {
+                if (session && session.status === 'open') {
+                    return session;
+                }
+                return request(baseUrl, token, {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({filename: file.name, size: file.size}),
+                }).then((created) => {
+                    localStorage.setItem(key, created.id);
+                    return created;
+                });
+            });
+        }
+
+        function sendChunk(session, index, attempt) {
+            const blob = file.slice(index * session.chunk_size, (index + 1) * session.chunk_size);
+            return blob.arrayBuffer()
+                .then((data) => crypto.subtle.digest('SHA-256', data).then((digest) => [data, hex(digest)]))
+                .then(([data, digest]) => request(baseUrl + session.id + '/' + index + '/', token, {
+                    method: 'PUT',
+                    headers: {'Content-Type': 'application/octet-stream', 'X-Chunk-Sha256': digest},
+                    body: data,
+                }))
+                .catch((error) => {
+                    if (attempt < RETRIES && !(error.status >= 400 && error.status < 422)) {
+                        return sendChunk(session, index, attempt + 1);
+                    }
+                    throw error;
+                });
+        }
+
+        return start().then((session) => {
+            const received = new Set(session.received);
+            const queue = [];
+            for (let index = 0; index < session.chunks; index++) {
+                if (!received.has(index)) {
+                    queue.push(index);
+                }
+            }
+            let done = received.size;
+            report(done, session.chunks);
+            const worker = () => {
+                const index = queue.shift();
+                if (index === undefined) {
+                    return Promise.resolve();
+                }
+                return sendChunk(session, index, 1).then(() => {
+                    report(++done, session.chunks);
+                    return worker();
+                });
+            };
+            const workers = [];
+            for (let i = 0; i < PARALLEL; i++) {
+                workers.push(worker());
+            }
+            return Promise.all(workers)
+                .then(() => request(baseUrl + session.id + '/complete/', token, {method: 'POST'}))
+                .then(() => {
+                    localStorage.removeItem(key);
+                    return session.id;
+                });
+        });
+    }
+
+    document.querySelectorAll('input[type=file][data-upload-url]').forEach((input) => {
+        const form = input.form;
+        const field = form && form.elements.namedItem('upload');
+        if (!field || !window.crypto || !crypto.subtle) {
+            return;
+        }
+        const status = document.createElement('div');
+        status.className = 'form-text';
+        input.after(status);
+        let busy = false;
+
+        form.addEventListener('submit', (event) => {
+            const file = input.files[0];
+            if (busy || field.value || !file || file.size <= Number(input.dataset.chunkedFrom)) {
+                return;
+            }
+            event.preventDefault();
+            busy = true;
+            const token = form.elements.namedItem('csrfmiddlewaretoken').value;
+            upload(input, file, token, (done, total) => {
+                status.textContent = 'Загружено частей: ' + done + ' из ' + total;
+            })
+                .then((id) => {
+                    field.value = id;
+                    // Файл уже на сервере, форма отправляется без него
+                    input.value = '';
+                    status.textContent = 'Файл загружен';
+                    form.submit();
+                })
+                .catch((error) => {
+                    busy = false;
+                    status.textContent = 'Загрузка прервана: ' + error.message
+                        + '. Отправьте форму ещё раз, чтобы продолжить.';
+                });
+        });
+    });
+})();
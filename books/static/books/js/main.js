@@ -2,3 +2,19 @@ document.querySelector('h1').addEventListener('click', () => {
     document.querySelector('h1').classList.toggle('text-danger');
     document.querySelector('h1').classList.toggle('bg-warning');
 })
+
+
+// Ленивая подгрузка содержимого раскрываемых блоков <details data-fragment-url="...">
+document.querySelectorAll('details[data-fragment-url]').forEach((details) => {
+    details.addEventListener('toggle', () => {
+        if (!details.open || details.dataset.loaded) {
+            return;
+        }
+        details.dataset.loaded = '1';
+        fetch(details.dataset.fragmentUrl)
+            .then((response) => response.text())
+            .then((html) => {
+                details.querySelector('.fragment-content').innerHTML = html;
+            });
+    });
+});
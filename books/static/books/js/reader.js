@@ -0,0 +1,105 @@
+// Чтение книги по главам: главы подгружаются фрагментами без перезагрузки страницы,
+// место чтения (глава и доля её прокрутки) сохраняется не чаще раза в несколько секунд
+(function () {
+    const reader = document.getElementById('reader');
+    if (!reader) {
+        return;
+    }
+    const text = document.getElementById('reader-text');
+    const title = document.getElementById('reader-title');
+    const counter = document.getElementById('reader-counter');
+    const prev = document.getElementById('reader-prev');
+    const next = document.getElementById('reader-next');
+    const links = reader.querySelectorAll('.reader-toc a');
+    const total = Number(reader.dataset.chapters);
+    // Адрес первой главы: номер - последняя часть пути
+    const chapterUrl = (number) => reader.dataset.chapterUrl.replace(/1\/$/, number + '/');
+    const token = reader.querySelector('[name=csrfmiddlewaretoken]').value;
+    const SAVE_DELAY = 3000;
+    let chapter = Number(reader.dataset.chapter);
+    let saveTimer = null;
+
+    function progress() {
+        const top = text.getBoundingClientRect().top + window.scrollY;
+        const height = Math.max(text.offsetHeight - window.innerHeight, 1);
+        return Math.min(Math.max((window.scrollY - top) / height, 0), 1);
+    }
+
+    function savePosition() {
+        saveTimer = null;
+        const data = new FormData();
+        data.append('csrfmiddlewaretoken', token);
+        data.append('chapter', chapter);
+        data.append('progress', progress().toFixed(4));
+        navigator.sendBeacon(reader.dataset.positionUrl, data);
+    }
+
+    function scheduleSave() {
+        if (saveTimer === null) {
+            saveTimer = setTimeout(savePosition, SAVE_DELAY);
+        }
+    }
+
+    function update(number) {
+        chapter = number;
+        const link = links[number - 1];
+        title.textContent = link ? link.textContent : '';
+        counter.textContent = number + ' / ' + total;
+        prev.href = '?chapter=' + (number - 1);
+        next.href = '?chapter=' + (number + 1);
+        prev.classList.toggle('disabled', number <= 1);
+        next.classList.toggle('disabled', number >= total);
+        links.forEach((item, index) => item.classList.toggle('active', index === number - 1));
+    }
+
+    function open(number, push) {
+        if (number < 1 || number > total) {
+            return;
+        }
+        fetch(chapterUrl(number), {credentials: 'same-origin'})
+            .then((response) => {
+                if (!response.ok) {
+                    throw new Error(response.status);
+                }
+                return response.text();
+            })
+            .then((html) => {
+                text.innerHTML = html;
+                update(number);
+                window.scrollTo(0, text.getBoundingClientRect().top + window.scrollY - 80);
+                if (push) {
+                    history.pushState({chapter: number}, '', '?chapter=' + number);
+                }
+                scheduleSave();
+            })
+            .catch(() => {
+                window.location.search = '?chapter=' + number;
+            });
+    }
+
+    reader.addEventListener('click', (event) => {
+        const link = event.target.closest('a[href^="?chapter="]');
+        if (!link || link.classList.contains('disabled')) {
+            return;
+        }
+        event.preventDefault();
+        open(Number(new URLSearchParams(link.search).get('chapter')), true);
+    });
+    window.addEventListener('popstate', (event) => {
+        open(event.state ? event.state.chapter : Number(reader.dataset.chapter), false);
+    });
+    window.addEventListener('scroll', scheduleSave, {passive: true});
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden' && saveTimer !== null) {
+            clearTimeout(saveTimer);
+            savePosition();
+        }
+    });
+
+    // Возврат к месту, на котором чтение остановилось
+    const saved = Number(reader.dataset.progress);
+    if (saved > 0) {
+        const top = text.getBoundingClientRect().top + window.scrollY;
+        window.scrollTo(0, top + saved * Math.max(text.offsetHeight - window.innerHeight, 1));
+    }
+})();
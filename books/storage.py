@@ -0,0 +1,254 @@
+"""
+Хранилище обложек и файлов электронных книг с адресацией по содержимому.
+
+Загруженный файл сохраняется под именем из sha256 содержимого в каталогах, разбитых
+по первым символам хэша: books/images/ab/cd/abcd...ef.jpg. Каталог (upload_to поля)
+и расширение сохраняются - по ним media.py решает, кому отдавать файл, а books/ebooks.py
+и books/fulltext.py выбирают разбор формата. Одинаковый файл хранится один раз:
+если такой уже есть, загрузка не пишет ничего, только отмечает использование.
+
+Для каждого файла есть строка Blob со счётчиком ссылок из книг (поля images_path и file_path).
+Счётчики меняют сигналы сохранения и удаления книги (books/signals.py), пересчитывает
+`manage.py dedup_files`, она же переносит файлы, загруженные до этого хранилища.
+Файлы без ссылок удаляет `manage.py gc_files` - не раньше GRACE после последней загрузки,
+чтобы не удалить файл книги, которая ещё сохраняется.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+from collections import Counter
+from datetime import timedelta
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+CHUNK_SIZE = 64 * 1024
+GRACE = timedelta(days=1)
+GC_BATCH = 500
+TMP_DIR = 'tmp/uploads'
+BLOB_RE = re.compile(r'^(?P<directory>.+)/[0-9a-f]{2}/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(?P<ext>(\.\w+)*)$')
+# Составные расширения, которые нужно сохранить целиком
+DOUBLE_EXTENSIONS = ('.fb2.zip',)
+
+
+def blob_extension(name):
+    name = name.lower()
+    for ext in DOUBLE_EXTENSIONS:
+        if name.endswith(ext):
+            return ext
+    ext = posixpath.splitext(name)[1]
+    return ext if re.fullmatch(r'\.\w{1,10}', ext) else ''
+
+
+def blob_name(directory, digest, ext):
+    return f'{directory}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def blob_digest(name):
+    """sha256 из имени файла в хранилище или None для файлов, загруженных по-старому."""
+    match = BLOB_RE.match(name or '')
+    return match['digest'] if match else None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище в MEDIA_ROOT, имя файла - хэш содержимого."""
+
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым в _save(), занятость исходного имени не важна
+        return name
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        directory = posixpath.dirname(name) or 'files'
+        ext = blob_extension(name)
+        temporary_path = getattr(content, 'temporary_file_path', None)
+        if temporary_path is not None:
+            # Большая загрузка уже лежит во временном файле: хэш считается по нему, файл переносится.
+            # Файл, собранный из частей (books/uploads.py), уже проверен и передаёт свой хэш
+            digest = getattr(content, 'sha256', None)
+            if digest:
+                size = os.path.getsize(temporary_path())
+            else:
+                digest, size = self._hash_path(temporary_path())
+            target = blob_name(directory, digest, ext)
+            if not self.exists(target):
+                self._prepare(target)
+                file_move_safe(temporary_path(), self.path(target))
+                self._set_permissions(target)
+        elif self._seekable(content):
+            # Сначала только хэш: повтор уже сохранённого файла на диск не пишется
+            digest, size = self._hash_chunks(content.chunks(CHUNK_SIZE))
+            target = blob_name(directory, digest, ext)
+            if not self.exists(target):
+                self._write(target, content.chunks(CHUNK_SIZE))
+        else:
+            target, size = self._write_streaming(directory, ext, content)
+
+        blob, created = Blob.objects.get_or_create(name=target, defaults={'size': size})
+        if not created:
+            Blob.objects.filter(pk=blob.pk).update(touched_at=timezone.now())
+        return target
+
+    @staticmethod
+    def _seekable(content):
+        try:
+            content.seek(0)
+        except (AttributeError, OSError, ValueError):
+            return False
+        return True
+
+    @staticmethod
+    def _hash_chunks(chunks):
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+        return digest.hexdigest(), size
+
+    def _hash_path(self, path):
+        with open(path, 'rb') as f:
+            return self._hash_chunks(iter(lambda: f.read(CHUNK_SIZE), b''))
+
+    def _prepare(self, name):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+
+    def _set_permissions(self, name):
+        if self.file_permissions_mode is not None:
+            os.chmod(self.path(name), self.file_permissions_mode)
+
+    def _temporary(self):
+        os.makedirs(self.path(TMP_DIR), exist_ok=True)
+        descriptor, path = tempfile.mkstemp(dir=self.path(TMP_DIR))
+        return os.fdopen(descriptor, 'wb'), path
+
+    def _write(self, target, chunks):
+        # Запись во временный файл и переименование: параллельная загрузка того же файла
+        # не увидит его недописанным
+        out, path = self._temporary()
+        try:
+            with out:
+                for chunk in chunks:
+                    out.write(chunk)
+            self._prepare(target)
+            os.replace(path, self.path(target))
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        self._set_permissions(target)
+
+    def _write_streaming(self, directory, ext, content):
+        # Поток, который нельзя прочитать дважды: хэш считается при записи во временный файл
+        digest = hashlib.sha256()
+        size = 0
+        out, path = self._temporary()
+        try:
+            with out:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            target = blob_name(directory, digest.hexdigest(), ext)
+            if self.exists(target):
+                os.remove(path)
+            else:
+                self._prepare(target)
+                os.replace(path, self.path(target))
+                self._set_permissions(target)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        return target, size
+
+    def delete(self, name):
+        # Файл может принадлежать нескольким книгам: удаляет только gc_files
+        if blob_digest(name) is None:
+            super().delete(name)
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def book_files(book):
+    return [name for name in (book.images_path.name, book.file_path.name) if name]
+
+
+def change_refs(old_names, new_names):
+    """Меняет счётчики ссылок на файлы: old_names - прежние файлы книги, new_names - новые."""
+    from .models import Blob
+
+    changes = Counter(name for name in new_names if name)
+    changes.subtract(name for name in old_names if name)
+    for name, delta in changes.items():
+        if delta:
+            Blob.objects.filter(name=name).update(refs=F('refs') + delta)
+
+
+def referenced_names(names):
+    from .models import Book
+
+    names = list(names)
+    referenced = set(Book.objects.filter(images_path__in=names).values_list('images_path', flat=True))
+    referenced.update(Book.objects.filter(file_path__in=names).values_list('file_path', flat=True))
+    return referenced
+
+
+def recount():
+    """Пересчитывает счётчики ссылок всех файлов по книгам. Возвращает число файлов."""
+    from .models import Blob, Book
+
+    counts = Counter()
+    for images_path, file_path in Book.objects.values_list('images_path', 'file_path').iterator(chunk_size=2000):
+        counts.update(name for name in (images_path, file_path) if name)
+    blobs = list(Blob.objects.only('id', 'name', 'refs'))
+    changed = [blob for blob in blobs if blob.refs != counts.get(blob.name, 0)]
+    for blob in changed:
+        blob.refs = counts.get(blob.name, 0)
+    Blob.objects.bulk_update(changed, ['refs'], batch_size=500)
+    return len(blobs)
+
+
+def collect_garbage(grace=GRACE, dry_run=False):
+    """Удаляет файлы без ссылок, не использовавшиеся дольше grace. Возвращает (число, байт)."""
+    from .models import Blob
+
+    cutoff = timezone.now() - grace
+    candidates = list(Blob.objects.filter(refs__lte=0, touched_at__lt=cutoff).order_by('pk'))
+    removed = size = 0
+    for start in range(0, len(candidates), GC_BATCH):
+        batch = candidates[start:start + GC_BATCH]
+        # Ссылки проверяются и по самим книгам: счётчик мог разойтись после массовых операций
+        referenced = referenced_names(blob.name for blob in batch)
+        for blob in batch:
+            if blob.name in referenced:
+                continue
+            if not dry_run:
+                # Строка удаляется с повторной проверкой: файл мог быть загружен заново после выборки
+                deleted, _ = Blob.objects.filter(pk=blob.pk, refs__lte=0, touched_at__lt=cutoff).delete()
+                if not deleted:
+                    continue
+                FileSystemStorage.delete(blob_storage, blob.name)
+            removed += 1
+            size += blob.size
+    if not dry_run:
+        _remove_stale_temporary(cutoff)
+    return removed, size
+
+
+def _remove_stale_temporary(cutoff):
+    # Временные файлы загрузок, прерванных до переименования
+    directory = blob_storage.path(TMP_DIR)
+    if not os.path.isdir(directory):
+        return
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime < cutoff.timestamp():
+            os.remove(entry.path)
@@ -0,0 +1,94 @@
+"""
+Назначение тегов книгам целыми множествами.
+
+Используется формой книги, админкой и импортом каталога. На любое количество книг
+и тегов уходит постоянное число запросов: загрузка существующих тегов по нормализованному
+имени, bulk_create недостающих, загрузка текущих связей, одна пакетная вставка
+и одно удаление строк BookTags.
+Пакетные операции не отправляют сигналы, поэтому Book.updated_at, поисковый индекс, версия каталога,
+фасетный индекс и кэш страниц обновляются здесь явно (notify=False - если это делает вызывающий код).
+Счётчики книг у тегов (books/counters.py) меняются всегда.
+"""
+from django.db import connection
+from django.utils import timezone
+
+from . import caching, counters, facets, pagecache, search
+from .models import Book, BookTags, Tag
+
+
+def parse_tags(value):
+    """Строка тегов через запятую или список -> отсортированный список уникальных нормализованных имён."""
+    names = value if isinstance(value, (list, tuple, set)) else str(value or '').split(',')
+    return sorted({Tag.normalize(name) for name in names if name and str(name).strip()})
+
+
+def get_tag_ids(names):
+    """
+    Возвращает ({нормализованное имя: id тега}, число созданных тегов), создавая недостающие теги.
+    Второй параллельно создающий тот же тег запрос не падает: конфликт уникального
+    индекса игнорируется, и id дочитываются из базы.
+    """
+    wanted = {Tag.normalize(name): name for name in names if str(name).strip()}
+    if not wanted:
+        return {}, 0
+    ids = dict(Tag.objects.filter(normalized__in=wanted).values_list('normalized', 'id'))
+    missing = [key for key in wanted if key not in ids]
+    if missing:
+        Tag.objects.bulk_create(
+            [Tag(name=' '.join(wanted[key].split()), normalized=key) for key in missing],
+            ignore_conflicts=True,
+        )
+        ids.update(Tag.objects.filter(normalized__in=missing).values_list('normalized', 'id'))
+    return ids, len(missing)
+
+
+def delete_rows(row_ids, batch_size=500):
+    # Строки BookTags удаляются одним запросом на пакет, без выборки объектов и сигналов на каждую строку:
+    # от BookTags ничего не зависит, а то, что обновили бы сигналы, sync_tags() обновляет сама
+    table = connection.ops.quote_name(BookTags._meta.db_table)
+    column = connection.ops.quote_name(BookTags._meta.pk.column)
+    with connection.cursor() as cursor:
+        for start in range(0, len(row_ids), batch_size):
+            batch = row_ids[start:start + batch_size]
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({", ".join(["%s"] * len(batch))})', batch)
+
+
+def sync_tags(book_tags, replace=True, notify=True):
+    """
+    Назначает теги книгам. book_tags - {id книги: имена тегов}.
+    replace=True - у книг остаются только перечисленные теги, иначе теги только добавляются.
+    Возвращает количество созданных тегов.
+    """
+    book_tags = {book_id: parse_tags(names) for book_id, names in book_tags.items()}
+    if not book_tags:
+        return 0
+    ids, created = get_tag_ids({name for names in book_tags.values() for name in names})
+    wanted = {(book_id, ids[name]) for book_id, names in book_tags.items() for name in names}
+    current = {
+        (book_id, tag_id): row_id
+        for row_id, book_id, tag_id in BookTags.objects.filter(book_id__in=book_tags).values_list('id', 'book_id', 'tag_id')
+    }
+    added = wanted - current.keys()
+    removed = {row_id: pair[0] for pair, row_id in current.items() if pair not in wanted} if replace else {}
+    if added:
+        BookTags.objects.bulk_create(
+            [BookTags(book_id=book_id, tag_id=tag_id) for book_id, tag_id in sorted(added)],
+            ignore_conflicts=True,
+        )
+    if removed:
+        delete_rows(list(removed))
+    counters.tags_changed(added, [pair for pair, row_id in current.items() if row_id in removed])
+
+    changed = sorted({book_id for book_id, _ in added} | set(removed.values()))
+    if notify and changed:
+        Book.objects.filter(pk__in=changed).update(updated_at=timezone.now())
+        search.index_books(changed)
+        # Новые теги - это новые подписи фасета, в этом случае индекс строится заново
+        facets.catalog_changed(caching.bump_catalog_version(), None if created else changed)
+        pagecache.purge_books(changed)
+    return created
+
+
+def set_book_tags(book, names):
+    """Оставляет у книги ровно перечисленные теги."""
+    return sync_tags({book.pk: names})
@@ -0,0 +1,49 @@
+"""Фоновые задачи приложения books (выполняются обработчиками manage.py run_workers)."""
+from jobs.queue import task
+
+from . import ebooks, fulltext, search, thumbnails
+from .models import Book, ChapterIndex
+
+
+@task('books.process_cover', priority=5)
+def process_cover(book_id):
+    book = Book.objects.filter(pk=book_id).first()
+    if book is not None:
+        thumbnails.process_book(book)
+
+
+@task('books.index_content', priority=20)
+def index_content(book_id, force=False):
+    book = Book.objects.filter(pk=book_id).only('id', 'file_path').first()
+    if book is not None:
+        fulltext.index_book(book, force=force)
+
+
+@task('books.build_chapter_index', priority=15)
+def build_chapter_index(book_id):
+    # Оглавление для чтения строится заранее, чтобы первая страница книги открывалась сразу
+    book = Book.objects.filter(pk=book_id).only('id', 'file_path').first()
+    if book is None:
+        return
+    if book.file_path and ebooks.book_format(book.file_path.name):
+        ebooks.build_index(book)
+    else:
+        ChapterIndex.objects.filter(book_id=book_id).delete()
+
+
+@task('books.reindex_reference')
+def reindex_reference(model_name, pk):
+    # После переименования автора, издательства, серии или тега обновляется текст индекса всех его книг
+    if model_name == 'tag':
+        book_ids = Book.objects.filter(tags__id=pk).values_list('id', flat=True)
+    else:
+        book_ids = Book.objects.filter(**{f'{model_name}_id': pk}).values_list('id', flat=True)
+    search.index_books(list(book_ids))
+
+
+@task('books.cleanup_uploads')
+def cleanup_uploads():
+    # Истёкшие сессии загрузки частями; задача ставится при создании сессии на час её истечения
+    from . import uploads
+
+    uploads.cleanup_expired()
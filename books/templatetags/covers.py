@@ -0,0 +1,44 @@
+from django import template
+from django.utils.html import format_html
+
+from books import thumbnails
+
+register = template.Library()
+
+# Размер, в котором обложка выводится на странице: (ширина, высота или None, атрибут sizes)
+PRESETS = {
+    'thumb': (35, 45, '35px'),
+    'card': (100, None, '100px'),
+    'detail': (200, None, '200px'),
+}
+
+
+@register.simple_tag
+def cover(book, preset='card', alt=''):
+    """
+    Обложка книги: <picture> с наборами WebP и JPEG уменьшенных копий (srcset/sizes),
+    ленивой загрузкой и размытой заглушкой в качестве фона до загрузки изображения.
+    Если копии ещё не построены, выводится оригинал.
+    """
+    if not book.images_path:
+        return ''
+    width, height, sizes = PRESETS[preset]
+    size_attrs = format_html(' width="{}" height="{}"', width, height) if height else format_html(' width="{}"', width)
+    digest = book.images_hash
+    if not digest:
+        return format_html('<img src="{}" alt="{}" loading="lazy"{}>', book.images_path.url, alt, size_attrs)
+
+    def srcset(ext):
+        return ', '.join(f'{thumbnails.thumbnail_url(digest, w, ext)} {w}w' for w in thumbnails.WIDTHS)
+
+    fallback = next((w for w in thumbnails.WIDTHS if w >= width), thumbnails.WIDTHS[-1])
+    placeholder = thumbnails.placeholder_data_uri(digest)
+    style = format_html(' style="background: url({}) center / cover no-repeat;"', placeholder) if placeholder else ''
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="lazy" decoding="async"{}{}>'
+        '</picture>',
+        srcset('webp'), sizes,
+        thumbnails.thumbnail_url(digest, fallback, 'jpg'), srcset('jpg'), sizes, alt, size_attrs, style,
+    )
@@ -1,3 +1,1124 @@
-from django.test import TestCase
+"""
+Проверка числа SQL-запросов на всех именованных маршрутах books.urls и users.urls.
 
-# Create your tests here.
+Каждая страница открывается дважды: на маленькой библиотеке и после того, как у тех же
+книги, тематики, серии, тега и пользователя стало во много раз больше связанных записей.
+Число запросов не должно зависеть от объёма данных (иначе в шаблоне или представлении
+появился запрос на каждую строку) и не должно превышать бюджет из books/query_budgets.json.
+После осознанного изменения числа запросов бюджеты пересчитываются командой
+    UPDATE_QUERY_BUDGETS=1 python manage.py test books
+"""
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.paginator import InvalidPage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from . import caching, counters, ebooks, facets, filters, fulltext, search, storage, tagging, thumbnails, uploads
+from .admin import TagAdminForm
+from .benchmarks import BENCHMARK_CACHES
+from .importer import CatalogImporter
+from .models import (
+    Blob, Book, BookTags, Favorite, Place, ReadingPosition, Seria, Tag, Theme, Type, UploadChunk, UploadSession,
+)
+from .paginators import KeysetPaginator
+from .seeding import LibrarySeeder
+from .storage import blob_storage
+
+BUDGETS_PATH = Path(__file__).with_name('query_budgets.json')
+URLCONFS = {'books.urls': '', 'users.urls': 'users:'}
+# Маршруты, которые на GET отвечают перенаправлением
+REDIRECTS = {'users:logout': 302, 'users:password_reset_confirm': 302}
+# Кэш в памяти процесса и без журнала запросов: тесты не трогают кэш и журнал сайта
+isolated = override_settings(CACHES=BENCHMARK_CACHES, INSTRUMENTATION={'LOG': False, 'SERVER_TIMING': False})
+
+
+def named_routes():
+    """Имена маршрутов из books.urls и users.urls (с пространством имён users:)."""
+    names = []
+    for pattern in get_resolver().url_patterns:
+        module = getattr(getattr(pattern, 'urlconf_name', None), '__name__', None)
+        if module in URLCONFS:
+            names += [URLCONFS[module] + route.name for route in pattern.url_patterns if route.name]
+    return names
+
+
+class TemporaryMediaMixin:
+    """MEDIA_ROOT во временном каталоге, который удаляется после теста."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = self.settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+@override_settings(CACHES=BENCHMARK_CACHES, INSTRUMENTATION={'LOG': False, 'SERVER_TIMING': False})
+class QueryCountTests(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=6, users=2, seed=1, theme_depth=2, theme_fanout=2).run()
+        cls.user = get_user_model().objects.create_superuser('librarian', 'librarian@example.com', 'secret')
+        cls.book = Book.objects.order_by('id').first()
+        cls.theme = Theme.objects.get(pk=cls.book.theme.get_root().pk)
+        cls.seria = Seria.objects.exclude(id=1).order_by('id').first()
+        cls.tag = Tag.objects.order_by('id').first()
+        # Вторая книга остаётся в избранном после проверки маршрута delete_favorite
+        Favorite.objects.bulk_create([Favorite(user=cls.user, book=book) for book in Book.objects.order_by('id')[:2]])
+        BookTags.objects.get_or_create(book=cls.book, tag=cls.tag)
+        Book.objects.filter(pk=cls.book.pk).update(controler=True)
+        fulltext.save_extracted(fulltext.Extracted(cls.book.pk, '', [(cls.book.pk, 0, 'Глава 1', 'Первая глава')], 12, ''))
+        # К этой книге маршрут upload_attach прикрепляет загруженный файл
+        cls.other_book = Book.objects.order_by('id')[1]
+
+    def setUp(self):
+        super().setUp()
+        # Файл электронной книги для read_book и read_chapter; оглавление строится заранее,
+        # чтобы оба прохода открывали книгу с готовым оглавлением
+        name = blob_storage.save('books/e_books/book.txt', ContentFile('Первая страница\n'.encode() * 100))
+        Book.objects.filter(pk=self.book.pk).update(file_path=name)
+        self.book.refresh_from_db()
+        ebooks.get_index(self.book)
+
+    def route_kwargs(self):
+        # Аргументы для каждого маршрута: новый маршрут без записи здесь не пройдёт проверку полноты
+        book = {'pk': self.book.pk}
+        return {
+            'catalog': {},
+            'export_catalog': {'fmt': 'csv'},
+            'category_list': {},
+            'book-by-category': {'slug': self.theme.slug},
+            'get_books_by_theme': {'slug': self.theme.slug},
+            'get_books_by_tag': {'tag_id': self.tag.pk},
+            'detail_book_by_id': book,
+            'edit_book': book,
+            'delete_book': book,
+            'read_book': book,
+            'read_chapter': {'pk': self.book.pk, 'number': 1},
+            'save_reading_position': book,
+            'series': {},
+            'seria_books': {'pk': self.seria.pk},
+            'reader': {},
+            'add_book_by_file': {},
+            'add_book': {},
+            'add_author': {},
+            'add_editor': {},
+            'add_seria': {},
+            'search_contents': {},
+            # Сессия загрузки создаётся заново для каждого запроса (upload_session)
+            'upload_create': {},
+            'upload_detail': {'pk': None},
+            'upload_chunk': {'pk': None, 'index': 0},
+            'upload_complete': {'pk': None},
+            'upload_attach': {'pk': None},
+            'autocomplete': {'source': 'author'},
+            'api_books': {},
+            'api_books_batch': {},
+            'api_authors': {},
+            'api_series': {},
+            'api_tags': {},
+            'api_themes': {},
+            'api_favorites': {},
+            'get_favorite': {'book_id': self.book.pk},
+            'delete_favorite': {'book': self.book.pk},
+            'users:login': {},
+            'users:logout': {},
+            'users:signup': {},
+            'users:register_done': {},
+            'users:profile': {},
+            'users:password_change': {},
+            'users:password_change_done': {},
+            'users:profile_books': {},
+            'users:password_reset': {},
+            'users:password_reset_done': {},
+            'users:password_reset_confirm': {'uidb64': urlsafe_base64_encode(force_bytes(self.user.pk)), 'token': ''},
+            'users:password_reset_complete': {},
+        }
+
+    def url(self, name, kwargs):
+        if name == 'users:password_reset_confirm':
+            # Токен зависит от времени последнего входа, которое меняет force_login()
+            kwargs['token'] = default_token_generator.make_token(self.user)
+        elif name.startswith('upload_') and name != 'upload_create':
+            kwargs['pk'] = self.upload_session(name).pk
+        url = reverse(name, kwargs=kwargs)
+        if name == 'autocomplete':
+            url += '?q=' + self.book.author.sirname[:2]
+        elif name == 'search_contents':
+            url += '?q=глава'
+        elif name == 'api_books_batch':
+            url += '?fields=title,author,tags&ids=' + ','.join(map(str, Book.objects.values_list('id', flat=True)[:200]))
+        elif name.startswith('api_'):
+            url += '?fields=' + {'api_books': 'title,author,tags', 'api_favorites': 'title,tags'}.get(name, 'id')
+        return url
+
+    @staticmethod
+    def upload_content(session):
+        # Содержимое у каждой сессии своё: в хранилище с адресацией по содержимому это новый файл
+        return (session.pk.hex.encode() * 4)[:session.size]
+
+    def upload_session(self, name):
+        """Новая сессия загрузки в состоянии, которого ждёт маршрут name."""
+        session = UploadSession.objects.create(
+            user=self.user, filename='book.txt', size=100, chunk_size=64, expires_at=timezone.now() + uploads.TTL,
+        )
+        content = self.upload_content(session)
+        os.makedirs(os.path.dirname(uploads.part_path(session)), exist_ok=True)
+        with open(uploads.part_path(session), 'wb') as f:
+            f.write(content if name == 'upload_complete' else bytes(session.size))
+        if name == 'upload_complete':
+            UploadChunk.objects.bulk_create([UploadChunk(session=session, index=index) for index in range(session.chunks)])
+        elif name == 'upload_attach':
+            session.file_name = blob_storage.save('books/e_books/book.txt', ContentFile(content))
+            session.status = UploadSession.Status.COMPLETE
+            session.save()
+            # Файл прикрепляется к книге без файла, как и при первом проходе
+            Book.objects.filter(pk=self.other_book.pk).update(file_path='')
+        self.upload = session
+        return session
+
+    def send(self, name, url):
+        """Запрос к маршруту тем методом и с теми данными, которые он принимает. Возвращает (ответ, ожидаемый код)."""
+        if name == 'save_reading_position':
+            return self.client.post(url, {'chapter': 2, 'progress': 0.5}), 204
+        if name == 'upload_create':
+            return self.client.post(url, {'filename': 'book.txt', 'size': 100}), 201
+        if name == 'upload_chunk':
+            chunk = self.upload_content(self.upload)[:self.upload.chunk_size]
+            response = self.client.generic(
+                'PUT', url, chunk, content_type='application/octet-stream',
+                HTTP_X_CHUNK_SHA256=hashlib.sha256(chunk).hexdigest(),
+            )
+            return response, 204
+        if name == 'upload_complete':
+            return self.client.post(url), 201
+        if name == 'upload_attach':
+            return self.client.post(url, {'book': self.other_book.pk}), 201
+        return self.client.get(url), REDIRECTS.get(name, 200)
+
+    def grow(self):
+        """Добавляет данные и привязывает часть новых книг к тем же объектам, что открываются в тестах."""
+        seeder = LibrarySeeder(books=120, users=4, seed=2, theme_depth=2, theme_fanout=2)
+        seeder.run()
+        new_ids = seeder.book_ids[:60]
+        Book.objects.filter(id__in=new_ids).update(theme=self.book.theme, seria=self.seria, controler=True)
+        BookTags.objects.bulk_create([BookTags(book_id=book_id, tag=self.tag) for book_id in new_ids],
+                                     ignore_conflicts=True)
+        # Книга, удалённая из избранного маршрутом delete_favorite, возвращается туда
+        Favorite.objects.bulk_create([Favorite(user=self.user, book_id=book_id) for book_id in [self.book.pk, *new_ids]])
+        for book_id in new_ids:
+            fulltext.save_extracted(fulltext.Extracted(book_id, '', [(book_id, 0, 'Глава', 'Глава книги')], 11, ''))
+        search.rebuild_index()
+        caching.bump_catalog_version()
+
+    def count_queries(self):
+        counts = {}
+        for name, kwargs in self.route_kwargs().items():
+            self.client.force_login(self.user)
+            url = self.url(name, kwargs)
+            # Каждая страница открывается с пустым кэшем и без готового фасетного индекса
+            cache.clear()
+            facets.get_index().version = None
+            with CaptureQueriesContext(connection) as queries:
+                response, status = self.send(name, url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, status, name)
+            counts[name] = len(queries)
+        return counts
+
+    def test_every_route_is_covered(self):
+        self.assertEqual(sorted(named_routes()), sorted(self.route_kwargs()))
+
+    def test_query_count_does_not_depend_on_data_size(self):
+        small = self.count_queries()
+        self.grow()
+        large = self.count_queries()
+
+        if os.environ.get('UPDATE_QUERY_BUDGETS'):
+            with open(BUDGETS_PATH, 'w', encoding='utf-8') as f:
+                json.dump(dict(sorted(large.items())), f, ensure_ascii=False, indent=2)
+                f.write('\n')
+        with open(BUDGETS_PATH, encoding='utf-8') as f:
+            budgets = json.load(f)
+
+        for name in small:
+            with self.subTest(route=name):
+                self.assertEqual(small[name], large[name], f'{name}: запросов {small[name]} -> {large[name]}')
+                self.assertIn(name, budgets, f'{name}: нет бюджета в {BUDGETS_PATH.name}')
+                self.assertLessEqual(large[name], budgets[name], f'{name}: превышен бюджет запросов')
+
+
+@isolated
+class MediaAccessTests(TemporaryMediaMixin, TestCase):
+    """Файлы электронных книг в MEDIA_ROOT доступны только суперпользователю при любой записи пути."""
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.media_root, 'books', 'e_books'))
+        with open(os.path.join(self.media_root, 'books', 'e_books', 'secret.txt'), 'wb') as f:
+            f.write(b'secret')
+
+    def test_protected_file_is_hidden_from_anonymous(self):
+        for path in ('books/e_books/secret.txt', 'books//e_books/secret.txt', 'books/./e_books/secret.txt',
+                     'books/images/../e_books/secret.txt'):
+            with self.subTest(path=path):
+                response = self.client.get('/media/' + path)
+                self.assertEqual(response.status_code, 404)
+
+    def test_superuser_gets_protected_file(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = self.client.get('/media/books//e_books/secret.txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'secret')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+
+@isolated
+@override_settings(JOBS={'IMMEDIATE': False})
+class ChunkedUploadTests(TemporaryMediaMixin, TestCase):
+    data = bytes(range(256)) * 3 + b'tail'
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(uploads, 'CHUNK_SIZE', 100)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = get_user_model().objects.create_superuser('librarian', 'librarian@example.com', 'secret')
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('upload_create'), {'filename': 'book.txt', 'size': len(self.data)})
+        self.assertEqual(response.status_code, 201)
+        self.session = response.json()
+
+    def put(self, index, body=None, checksum=None):
+        body = self.data[index * 100:(index + 1) * 100] if body is None else body
+        return self.client.generic(
+            'PUT', reverse('upload_chunk', args=[self.session['id'], index]), body,
+            content_type='application/octet-stream',
+            HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(body).hexdigest(),
+        )
+
+    def complete(self):
+        return self.client.post(reverse('upload_complete', args=[self.session['id']]))
+
+    def test_chunks_in_any_order_assemble_file(self):
+        for index in reversed(range(self.session['chunks'])):
+            self.assertEqual(self.put(index).status_code, 204)
+        response = self.complete()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['sha256'], hashlib.sha256(self.data).hexdigest())
+        with blob_storage.open(response.json()['file']) as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_bad_resend_of_received_chunk_is_not_accepted(self):
+        for index in range(self.session['chunks']):
+            self.put(index)
+        self.assertEqual(self.put(0, body=b'x' * 100, checksum='0' * 64).status_code, 422)
+        self.assertEqual(self.put(1, body=b'short').status_code, 400)
+        response = self.complete()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['missing'], [0, 1])
+
+        self.put(0)
+        self.put(1)
+        response = self.complete()
+        self.assertEqual(response.status_code, 201)
+        with blob_storage.open(response.json()['file']) as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_other_user_cannot_use_session(self):
+        other = get_user_model().objects.create_superuser('other', 'other@example.com', 'secret')
+        self.client.force_login(other)
+        self.assertEqual(self.put(0).status_code, 404)
+
+
+@isolated
+class ContentSearchAccessTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=2, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+        book = Book.objects.order_by('id').first()
+        fulltext.save_extracted(fulltext.Extracted(book.pk, '', [(book.pk, 0, 'Глава', 'Тайный текст')], 12, ''))
+
+    def test_only_superuser_sees_book_text(self):
+        url = reverse('search_contents') + '?q=тайный'
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(get_user_model().objects.create_user('reader', 'reader@example.com', 'secret'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertNotContains(self.client.get(reverse('catalog')), reverse('search_contents'))
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.assertContains(self.client.get(url), '<mark>Тайный</mark>')
+
+
+@isolated
+class ListSortingTests(TestCase):
+    """Сортировка списков - только по разрешённым полям, неизвестное значение не ломает страницу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=6, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+        cls.theme = Theme.objects.get(pk=Book.objects.order_by('id').first().theme.get_root().pk)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unknown_sort_falls_back_to_title(self):
+        url = reverse('book-by-category', args=[self.theme.slug])
+        for sort in ('bogus', 'author__sirname', 'rank'):
+            with self.subTest(sort=sort):
+                response = self.client.get(url, {'sort': sort})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['sort'], 'title')
+                titles = [book.title for book in response.context['books']]
+                self.assertEqual(titles, sorted(titles))
+
+    def test_unknown_series_sort_falls_back_to_name(self):
+        response = self.client.get(reverse('series'), {'sort': 'bogus', 'cursor': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['sort'], 'seria')
+
+
+@isolated
+class KeysetPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=11, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+        # Половина книг с одинаковым названием: порядок внутри совпадений держится на BookID
+        Book.objects.filter(pk__in=Book.objects.order_by('id').values('pk')[:6]).update(title='Одно название')
+
+    def walk(self, queryset, per_page=3):
+        paginator = KeysetPaginator(queryset, per_page)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return paginator, pages
+
+    def test_forward_and_back_visit_every_book_once(self):
+        for ordering in (('title', 'id'), ('-title', '-id'), ('year', 'id')):
+            with self.subTest(ordering=ordering[0]):
+                expected = list(Book.objects.order_by(*ordering).values_list('pk', flat=True))
+                paginator, pages = self.walk(Book.objects.order_by(ordering[0]))
+                self.assertEqual([book.pk for page in pages for book in page], expected)
+                self.assertFalse(pages[0].has_previous())
+
+                back = [pages[-1]]
+                while back[-1].has_previous():
+                    back.append(paginator.page(back[-1].previous_cursor))
+                self.assertEqual([book.pk for page in reversed(back) for book in page], expected)
+                self.assertEqual([page.object_list for page in reversed(back)], [page.object_list for page in pages])
+
+    def test_tampered_or_foreign_cursor_is_rejected(self):
+        paginator, pages = self.walk(Book.objects.order_by('title'))
+        cursor = pages[0].next_cursor
+        with self.assertRaises(InvalidPage):
+            paginator.page(cursor[:-2] + ('AA' if not cursor.endswith('AA') else 'BB'))
+        with self.assertRaises(InvalidPage):
+            KeysetPaginator(Book.objects.order_by('year'), 3).page(cursor)
+        response = self.client.get(reverse('catalog'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_only_local_not_null_fields_are_accepted(self):
+        for ordering in ('author__sirname', 'author', 'theme'):
+            with self.subTest(ordering=ordering):
+                with self.assertRaises(ImproperlyConfigured):
+                    KeysetPaginator(Book.objects.order_by(ordering), 3)
+
+
+@isolated
+class FacetLabelTests(TestCase):
+    """Новые и переименованные значения справочников сразу видны в фасетах каталога."""
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=4, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+        cls.book = Book.objects.order_by('id').first()
+
+    def setUp(self):
+        cache.clear()
+        facets.get_index().version = None
+
+    def labels(self, name):
+        for facet in facets.facet_counts({}):
+            if facet['name'] == name:
+                return {value['label']: value['count'] for value in facet['values']}
+        return {}
+
+    def test_new_and_renamed_reference_values(self):
+        facets.get_index()
+        for model, name, field in ((Type, 'type', 'type'), (Place, 'place', 'place')):
+            with self.subTest(facet=name):
+                with self.captureOnCommitCallbacks(execute=True):
+                    obj = model.objects.create(**{field: 'Новое значение'})
+                    setattr(self.book, name, obj)
+                    self.book.save()
+                self.assertEqual(self.labels(name).get('Новое значение'), 1)
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    setattr(obj, field, 'Переименовано')
+                    obj.save()
+                self.assertEqual(self.labels(name).get('Переименовано'), 1)
+                self.assertNotIn('Новое значение', self.labels(name))
+
+    def test_changes_from_other_processes_are_replayed(self):
+        index = facets.get_index()
+        # Другой процесс изменил книгу: версия увеличена, id книги записан в журнал
+        Book.objects.filter(pk=self.book.pk).update(year=1234)
+        version = caching.bump_catalog_version()
+        cache.set(facets.changes_key(version), {self.book.pk})
+        with mock.patch.object(facets.FacetIndex, 'build') as build:
+            self.assertEqual(self.labels('year').get('1230-е'), 1)
+        build.assert_not_called()
+        self.assertEqual(index.version, version)
+
+        # Пробел в журнале - индекс строится заново
+        caching.bump_catalog_version()
+        with mock.patch.object(facets.FacetIndex, 'build', wraps=index.build) as build:
+            facets.get_index()
+        build.assert_called_once()
+
+    def test_theme_slug_is_resolved_like_catalog_filter(self):
+        first, second = [Theme.objects.create(title=f'Раздел {number}', slug=f'section-{number}') for number in (1, 2)]
+        for parent in (second, first):
+            Theme.objects.create(title=f'Подрубрика {parent.pk}', slug='same', parent=parent)
+        Book.objects.filter(pk=self.book.pk).update(theme=Theme.objects.get(parent=second, slug='same'))
+        caching.bump_catalog_version()
+        params = {'theme': 'same'}
+        selected = [value for facet in facets.facet_counts(params) if facet['name'] == 'theme'
+                    for value in facet['values'] if value['selected']]
+        self.assertEqual([value['count'] for value in selected],
+                         [filters.filter_catalog(Book.objects.all(), params).count()])
+
+
+@isolated
+class ReaderTests(TemporaryMediaMixin, TestCase):
+    """Чтение книги и сохранение места чтения: доступ только суперпользователю, ввод проверяется."""
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=2, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+        cls.book = Book.objects.order_by('id').first()
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret')
+
+    def setUp(self):
+        super().setUp()
+        name = blob_storage.save('books/e_books/book.txt', ContentFile('<script>alert(1)</script>\n'.encode()))
+        Book.objects.filter(pk=self.book.pk).update(file_path=name)
+
+    def test_reader_routes_are_closed_to_other_users(self):
+        urls = [reverse('read_book', args=[self.book.pk]), reverse('read_chapter', args=[self.book.pk, 1])]
+        for user in (None, get_user_model().objects.create_user('reader', 'reader@example.com', 'secret')):
+            if user is not None:
+                self.client.force_login(user)
+            for url in urls:
+                with self.subTest(user=user, url=url):
+                    self.assertIn(self.client.get(url).status_code, (302, 403))
+            response = self.client.post(reverse('save_reading_position', args=[self.book.pk]), {'chapter': 1})
+            self.assertIn(response.status_code, (302, 403))
+        self.assertFalse(ReadingPosition.objects.exists())
+
+    def test_chapter_text_is_escaped(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('read_chapter', args=[self.book.pk, 1]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<script>')
+        self.assertContains(response, '&lt;script&gt;')
+        self.assertEqual(self.client.get(reverse('read_chapter', args=[self.book.pk, 99])).status_code, 404)
+
+    def test_reading_position_is_validated(self):
+        self.client.force_login(self.admin)
+        url = reverse('save_reading_position', args=[self.book.pk])
+        for data in ({'chapter': 'x'}, {'progress': 'nan'}, {'progress': 'inf'}):
+            with self.subTest(data=data):
+                self.assertEqual(self.client.post(url, data).status_code, 400)
+        self.assertEqual(self.client.post(url, {'chapter': 3, 'progress': 7}).status_code, 204)
+        self.assertEqual(ReadingPosition.objects.get(user=self.admin, book=self.book).progress, 1.0)
+        self.assertEqual(self.client.post(url, {'chapter': 2, 'progress': 0.25}).status_code, 204)
+        position = ReadingPosition.objects.get(user=self.admin, book=self.book)
+        self.assertEqual((position.chapter, position.progress), (1, 0.25))
+
+
+@isolated
+class TaggingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=3, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+        cls.books = list(Book.objects.order_by('id'))
+
+    def test_tag_names_are_normalized_like_other_references(self):
+        self.assertEqual(Tag.normalize('  Ёлки   ПАЛКИ '), 'елки палки')
+        ids, created = tagging.get_tag_ids(['Ёж', 'еж', 'ЕЖ '])
+        self.assertEqual((list(ids), created), (['еж'], 1))
+
+    def test_replaced_tags_keep_counters_in_sync(self):
+        book = self.books[0]
+        counters.set_status(Book.objects.filter(pk=book.pk), True)
+        counters.set_status(Book.objects.filter(pk=self.books[1].pk), False)
+        tagging.sync_tags({book.pk: ['один', 'два'], self.books[1].pk: ['два']})
+        tagging.sync_tags({book.pk: ['три']})
+        self.assertEqual(set(book.tags.values_list('normalized', flat=True)), {'три'})
+        counts = {tag.normalized: (tag.books_count, tag.read_count) for tag in Tag.objects.filter(
+            normalized__in=['один', 'два', 'три'])}
+        self.assertEqual(counts, {'один': (0, 0), 'два': (1, 0), 'три': (1, 1)})
+        self.assertFalse(any(counters.recount().values()))
+
+    def test_removing_tags_costs_the_same_for_any_number(self):
+        book = self.books[0]
+        queries = []
+        for names in (['один'], ['один', 'два', 'три', 'четыре', 'пять']):
+            tagging.sync_tags({book.pk: names})
+            version = caching.catalog_version()
+            with CaptureQueriesContext(connection) as captured:
+                tagging.sync_tags({book.pk: []})
+            queries.append(len(captured))
+            # Одно изменение каталога на весь вызов, а не на каждую снятую связь
+            self.assertEqual(caching.catalog_version(), version + 1)
+        self.assertEqual(queries[0], queries[1])
+        self.assertFalse(book.tags.exists())
+        self.assertFalse(any(counters.recount().values()))
+
+    def test_admin_rename_onto_existing_tag_is_rejected(self):
+        tagging.get_tag_ids(['Ёж', 'уж'])
+        tag = Tag.objects.get(normalized='уж')
+        form = TagAdminForm(data={'name': ' ЕЖ '}, instance=tag)
+        self.assertFalse(form.is_valid())
+        self.assertIn('name', form.errors)
+        self.assertTrue(TagAdminForm(data={'name': 'Уж'}, instance=tag).is_valid())
+
+
+@isolated
+class CatalogVersionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_evicted_version_does_not_repeat(self):
+        # Часы идут на секунду за каждое обращение
+        with mock.patch('time.time', side_effect=itertools.count(1_000_000)):
+            used = {caching.catalog_version(), caching.bump_catalog_version()}
+            cache.delete(caching.VERSION_KEY)
+            version = caching.catalog_version()
+            self.assertNotIn(version, used)
+            used.add(version)
+            cache.delete(caching.VERSION_KEY)
+            self.assertNotIn(caching.bump_catalog_version(), used)
+
+
+@isolated
+class CatalogSortControlsTests(TestCase):
+    """Отмеченная радиокнопка сортировки совпадает с сортировкой, которую применил каталог."""
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=2, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_checked_radio_matches_applied_sort(self):
+        for params, checked in (({}, 'title'), ({'search_query': 'книга'}, 'rank'),
+                                ({'search_query': 'книга', 'sort': 'title'}, 'title'),
+                                ({'sort': 'rank'}, 'title'), ({'sort': 'year'}, 'year')):
+            with self.subTest(params=params):
+                response = self.client.get(reverse('catalog'), params)
+                self.assertEqual(response.context['sort'], checked)
+                content = response.content.decode()
+                for value in filters.SORT_FIELDS:
+                    tag = re.search(rf'<input[^>]*name="sort"[^>]*value="{value}"[^>]*>', content).group()
+                    self.assertEqual('checked' in tag, value == checked, value)
+
+    def test_query_without_words(self):
+        for query in ('***', '"', '   ', '-- ,'):
+            with self.subTest(query=query):
+                response = self.client.get(reverse('catalog'), {'search_query': query})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(list(response.context['books']), [])
+                response = self.client.get(reverse('export_catalog', args=['csv']), {'search_query': query})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 1)
+
+
+@isolated
+class UnknownThemeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=3, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unknown_theme_selects_nothing(self):
+        params = {'theme': 'no-such-theme'}
+        self.assertFalse(filters.filter_catalog(Book.objects.all(), params).exists())
+        self.assertFalse(filters.filter_catalog(Book.objects.all(), {**params, 'search_query': 'книга'}).exists())
+        response = self.client.get(reverse('catalog'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['books']), [])
+        response = self.client.get(reverse('export_catalog', args=['csv']), params)
+        self.assertEqual(response.status_code, 404)
+
+
+@isolated
+class PlaceholderTests(TemporaryMediaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_missing_placeholder_is_not_cached_for_good(self):
+        digest = 'a' * 64
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.assertEqual(thumbnails.placeholder_data_uri(digest), '')
+        self.assertEqual(cache_set.call_args.args[2], thumbnails.MISSING_PLACEHOLDER_TIMEOUT)
+
+        # Копии построены позже: после истечения короткого срока заглушка находится
+        default_storage.save(thumbnails.placeholder_name(digest), ContentFile(b'jpeg'))
+        cache.delete(f'cover-placeholder:{digest}')
+        self.assertEqual(thumbnails.placeholder_data_uri(digest), 'data:image/jpeg;base64,anBlZw==')
+
+
+@isolated
+class SearchTests(TestCase):
+    """Полнотекстовый поиск FTS5: регистр кириллицы, "ё" и "е", префиксы слов, порядок по bm25."""
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=4, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+        cls.books = list(Book.objects.order_by('id'))
+        titles = ['ЁЖИК В ТУМАНЕ', 'Туман туман туман', 'Туман над рекой, лесом, полем и дальними холмами', 'Ежевика']
+        for book, title in zip(cls.books, titles):
+            Book.objects.filter(pk=book.pk).update(title=title, review='')
+        search.index_books([book.pk for book in cls.books])
+
+    def found(self, query):
+        return list(search.search_books(Book.objects.all(), query).order_by('rank', 'id').values_list('pk', flat=True))
+
+    def test_cyrillic_case_and_yo_are_ignored(self):
+        hedgehog = self.books[0].pk
+        for query in ('ёжик', 'ежик', 'ЕЖИК', 'Ёжик'):
+            with self.subTest(query=query):
+                self.assertEqual(self.found(query), [hedgehog])
+
+    def test_words_match_as_prefixes_and_all_must_match(self):
+        self.assertEqual(set(self.found('еж')), {self.books[0].pk, self.books[3].pk})
+        self.assertEqual(self.found('еж туман'), [self.books[0].pk])
+        self.assertEqual(self.found('туман лес'), [self.books[2].pk])
+
+    def test_results_are_ordered_by_bm25(self):
+        # Слово трижды в коротком названии релевантнее, чем один раз в длинном
+        found = self.found('туман')
+        self.assertEqual(set(found), {book.pk for book in self.books[:3]})
+        self.assertEqual(found[0], self.books[1].pk)
+        self.assertLess(found.index(self.books[0].pk), found.index(self.books[2].pk))
+
+
+@isolated
+class CounterTests(TestCase):
+    """Хранимые счётчики книг меняются приращениями и после каждого изменения совпадают с полным пересчётом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=8, users=1, seed=1, theme_depth=3, theme_fanout=2).run()
+
+    def setUp(self):
+        self.book = Book.objects.order_by('id').first()
+
+    def assertMatchesRecount(self):
+        self.assertEqual({model.__name__: changed for model, changed in counters.recount().items() if changed}, {})
+
+    def theme_counts(self):
+        return {pk: (books, read) for pk, books, read in Theme.objects.values_list('pk', 'books_count', 'read_count')}
+
+    def test_theme_and_status_change_moves_counts_along_ancestors(self):
+        old_chain = set(self.book.theme.get_ancestors(include_self=True).values_list('pk', flat=True))
+        target = Theme.objects.exclude(pk__in=old_chain).filter(level=2).order_by('id').first()
+        new_chain = set(target.get_ancestors(include_self=True).values_list('pk', flat=True))
+        status = self.book.status
+        before = self.theme_counts()
+
+        self.book.theme = target
+        self.book.status = not status
+        self.book.save()
+
+        after = self.theme_counts()
+        for pk in old_chain | new_chain:
+            books = (pk in new_chain) - (pk in old_chain)
+            read = (pk in new_chain and not status) - (pk in old_chain and status)
+            with self.subTest(theme=pk):
+                self.assertEqual(after[pk], (before[pk][0] + books, before[pk][1] + read))
+        self.assertMatchesRecount()
+
+    def test_deleted_book_is_uncounted(self):
+        tag = Tag.objects.order_by('id').first()
+        BookTags.objects.get_or_create(book=self.book, tag=tag)
+        self.assertMatchesRecount()
+        books_count = Tag.objects.get(pk=tag.pk).books_count
+        self.book.delete()
+        self.assertEqual(Tag.objects.get(pk=tag.pk).books_count, books_count - 1)
+        self.assertMatchesRecount()
+
+    def test_tag_changes_by_every_path(self):
+        tags = list(Tag.objects.order_by('id')[:3])
+        counters.set_status(Book.objects.filter(pk=self.book.pk), True)
+        BookTags.objects.filter(book=self.book).delete()
+        self.assertMatchesRecount()
+        before = Tag.objects.get(pk=tags[0].pk)
+
+        self.book.tags.add(tags[0])
+        tag = Tag.objects.get(pk=tags[0].pk)
+        self.assertEqual((tag.books_count, tag.read_count), (before.books_count + 1, before.read_count + 1))
+        self.assertMatchesRecount()
+        BookTags.objects.create(book=self.book, tag=tags[1])
+        self.assertMatchesRecount()
+        tagging.sync_tags({self.book.pk: [tags[2].name]})
+        self.assertMatchesRecount()
+        self.book.tags.clear()
+        self.assertMatchesRecount()
+
+    def test_status_of_many_books(self):
+        ids = list(Book.objects.order_by('id').values_list('pk', flat=True)[:5])
+        counters.set_status(Book.objects.filter(pk__in=ids), False)
+        self.assertMatchesRecount()
+        self.assertEqual(counters.set_status(Book.objects.filter(pk__in=ids), True), 5)
+        self.assertEqual(counters.set_status(Book.objects.filter(pk__in=ids), True), 0)
+        self.assertMatchesRecount()
+        # Срез выборки, как в действиях админки
+        self.assertEqual(counters.set_status(Book.objects.order_by('id')[:2], False), 2)
+        self.assertMatchesRecount()
+
+
+@isolated
+@override_settings(JOBS={'IMMEDIATE': False})
+class StorageTests(TemporaryMediaMixin, TestCase):
+    """Хранилище с адресацией по содержимому: один файл на одинаковое содержимое, ссылки из книг, сборка мусора."""
+
+    def setUp(self):
+        super().setUp()
+        self.book = Book.objects.create(title='Первая')
+        self.other = Book.objects.create(title='Вторая')
+
+    def attach(self, book, data, name='book.txt'):
+        book.file_path.save(name, ContentFile(data), save=False)
+        book.save()
+        return book.file_path.name
+
+    def refs(self, name):
+        return Blob.objects.get(name=name).refs
+
+    def test_same_content_is_stored_once(self):
+        first = blob_storage.save('books/e_books/a.txt', ContentFile(b'same text'))
+        second = blob_storage.save('books/e_books/b.txt', ContentFile(b'same text'))
+        self.assertEqual(first, second)
+        self.assertEqual(storage.blob_digest(first), hashlib.sha256(b'same text').hexdigest())
+        self.assertEqual(Blob.objects.filter(name=first).count(), 1)
+        self.assertEqual(os.listdir(os.path.dirname(blob_storage.path(first))), [os.path.basename(first)])
+
+    def test_book_save_and_delete_change_refs(self):
+        name = self.attach(self.book, b'shared')
+        self.assertEqual(self.refs(name), 1)
+        self.assertEqual(self.attach(self.other, b'shared'), name)
+        self.assertEqual(self.refs(name), 2)
+
+        replacement = self.attach(self.book, b'replacement')
+        self.assertEqual((self.refs(name), self.refs(replacement)), (1, 1))
+        self.other.delete()
+        self.assertEqual(self.refs(name), 0)
+        # Удаление книги не удаляет файл: это дело сборки мусора
+        self.assertTrue(blob_storage.exists(name))
+        storage.recount()
+        self.assertEqual((self.refs(name), self.refs(replacement)), (0, 1))
+
+    def test_garbage_collection_keeps_referenced_and_recent_files(self):
+        referenced = self.attach(self.book, b'referenced')
+        old = blob_storage.save('books/e_books/old.txt', ContentFile(b'old'))
+        recent = blob_storage.save('books/e_books/recent.txt', ContentFile(b'recent'))
+        # Счётчик разошёлся с книгами: ссылка проверяется и по самой книге
+        drifted = self.attach(self.other, b'drifted')
+        Blob.objects.filter(name=drifted).update(refs=0)
+        long_ago = timezone.now() - storage.GRACE - timedelta(hours=1)
+        Blob.objects.exclude(name=recent).update(touched_at=long_ago)
+
+        self.assertEqual(storage.collect_garbage(dry_run=True), (1, len(b'old')))
+        self.assertTrue(blob_storage.exists(old))
+        self.assertEqual(storage.collect_garbage(), (1, len(b'old')))
+        self.assertFalse(blob_storage.exists(old))
+        self.assertFalse(Blob.objects.filter(name=old).exists())
+        for name in (referenced, recent, drifted):
+            with self.subTest(name=name):
+                self.assertTrue(blob_storage.exists(name))
+                self.assertTrue(Blob.objects.filter(name=name).exists())
+
+
+@isolated
+class ImporterTests(TestCase):
+    """Импорт каталога: служебная серия, продолжение прерванного импорта, пробный прогон."""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.state_path = os.path.join(directory, 'books.import-state')
+        self.records = [
+            {'title': f'Книга {number}', 'author': 'Пушкин Александр Сергеевич', 'seria': 'Собрание сочинений',
+             'theme': 'Проза/Поэзия', 'tags': 'классика'}
+            for number in range(1, 6)
+        ]
+
+    def importer(self, **kwargs):
+        return CatalogImporter(batch_size=2, state_path=self.state_path, **kwargs)
+
+    def test_series_placeholder_is_reserved(self):
+        Seria.objects.all().delete()
+        CatalogImporter().run(self.records[:1])
+        self.assertEqual(Seria.objects.get(id=1).seria, 'Без серии')
+        self.assertNotEqual(Book.objects.get().seria_id, 1)
+
+    def test_resume_after_interrupted_import(self):
+        importer = self.importer()
+        original = importer.import_batch
+        calls = []
+
+        def failing(records):
+            calls.append(len(records))
+            if len(calls) == 2:
+                raise RuntimeError('прервано')
+            return original(records)
+
+        with mock.patch.object(importer, 'import_batch', failing):
+            with self.assertRaises(RuntimeError):
+                importer.run(self.records)
+        # Первая пачка сохранена, вторая откатилась; позиция - после первой пачки
+        self.assertEqual(Book.objects.count(), 2)
+        with open(self.state_path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'done': 2})
+
+        result = self.importer().run(self.records, resume=True)
+        self.assertEqual((result['records'], result['books']), (3, 3))
+        self.assertEqual(
+            sorted(Book.objects.values_list('title', flat=True)),
+            [record['title'] for record in self.records],
+        )
+        self.assertEqual(Seria.objects.filter(seria='Собрание сочинений').count(), 1)
+        self.assertEqual(Theme.objects.filter(title='Поэзия', parent__title='Проза').count(), 1)
+        self.assertEqual(Tag.objects.get(name='классика').books_count, 5)
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_dry_run_writes_nothing(self):
+        books, series, tags, themes = (
+            Book.objects.count(), Seria.objects.count(), Tag.objects.count(), Theme.objects.count(),
+        )
+        result = self.importer(dry_run=True).run(self.records)
+        self.assertEqual((result['records'], result['books']), (5, 5))
+        created = result['created']
+        self.assertEqual(created[Seria._meta.verbose_name_plural], 1)
+        self.assertEqual(created[Tag._meta.verbose_name_plural], 1)
+        self.assertEqual(created[Theme._meta.verbose_name_plural], 2)
+        self.assertEqual(
+            (Book.objects.count(), Seria.objects.count(), Tag.objects.count(), Theme.objects.count()),
+            (books, series, tags, themes),
+        )
+        self.assertFalse(os.path.exists(self.state_path))
+
+
+@isolated
+class PageCacheTests(TestCase):
+    """Кэш страниц для анонимных посетителей сбрасывается при изменении книги, которая на странице выводится."""
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=5, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+
+    def setUp(self):
+        cache.clear()
+        self.book, self.other = Book.objects.order_by('id')[:2]
+
+    def get(self, url):
+        return self.client.get(url, HTTP_ACCEPT_ENCODING='identity')
+
+    def rename(self, book, title):
+        book.title = title
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+
+    def test_page_is_purged_when_its_book_changes(self):
+        catalog = reverse('catalog')
+        detail = reverse('detail_book_by_id', args=[self.book.pk])
+        other = reverse('detail_book_by_id', args=[self.other.pk])
+        for url in (catalog, detail, other):
+            with self.subTest(url=url):
+                self.assertEqual(self.get(url)['X-Page-Cache'], 'miss')
+                self.assertEqual(self.get(url)['X-Page-Cache'], 'hit')
+
+        self.rename(self.book, 'Новое название')
+        for url in (catalog, detail):
+            with self.subTest(url=url):
+                response = self.get(url)
+                self.assertEqual(response['X-Page-Cache'], 'miss')
+                self.assertContains(response, 'Новое название')
+        # Страница другой книги не сбрасывается
+        self.assertEqual(self.get(other)['X-Page-Cache'], 'hit')
+
+    def test_logged_in_pages_are_not_cached(self):
+        self.client.force_login(get_user_model().objects.first())
+        response = self.get(reverse('catalog'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+
+@isolated
+class ConditionalGetTests(TestCase):
+    """If-None-Match / If-Modified-Since: 304 без тела, пока книга и каталог не менялись, и 200 после правки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=5, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.order_by('id').first()
+        self.detail = reverse('detail_book_by_id', args=[self.book.pk])
+
+    def edit(self, title):
+        self.book.title = title
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.save()
+
+    def assertNotModified(self, url, **headers):
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_book_etag(self):
+        response = self.client.get(self.detail)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertNotModified(self.detail, HTTP_IF_NONE_MATCH=etag)
+
+        self.edit('Новое название')
+        response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Новое название')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_book_last_modified(self):
+        last_modified = self.client.get(self.detail)['Last-Modified']
+        self.assertNotModified(self.detail, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        # Last-Modified с точностью до секунды: правка - заведомо позже
+        with mock.patch('django.utils.timezone.now', return_value=self.book.updated_at + timedelta(seconds=5)):
+            self.edit('Новое название')
+        response = self.client.get(self.detail, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Новое название')
+
+    def test_catalog_etag(self):
+        catalog = reverse('catalog')
+        etag = self.client.get(catalog)['ETag']
+        self.assertNotModified(catalog, HTTP_IF_NONE_MATCH=etag)
+
+        self.edit('Новое название')
+        response = self.client.get(catalog, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Новое название')
+
+    def test_logged_in_user_gets_own_etag(self):
+        etag = self.client.get(self.detail)['ETag']
+        self.client.force_login(get_user_model().objects.first())
+        response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+
+@isolated
+class ApiTests(TestCase):
+    """JSON API: курсоры, порядок изменений, пакетный запрос, проверка fields, избранное."""
+
+    @classmethod
+    def setUpTestData(cls):
+        LibrarySeeder(books=7, users=1, seed=1, theme_depth=1, theme_fanout=1).run()
+
+    def setUp(self):
+        cache.clear()
+        self.ids = list(Book.objects.order_by('id').values_list('pk', flat=True))
+
+    def get(self, name, status=200, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def walk(self, **params):
+        """Все страницы по курсору next: id книг по порядку и число страниц."""
+        ids, pages, cursor = [], 0, None
+        while True:
+            data = self.get('api_books', limit=3, **params, **({'cursor': cursor} if cursor else {}))
+            ids += [item['id'] for item in data['results']]
+            pages += 1
+            cursor = data['next']
+            if cursor is None:
+                return ids, pages
+
+    def test_cursor_round_trip(self):
+        self.assertEqual(self.walk(), (self.ids, 3))
+        self.assertIn('error', self.get('api_books', status=400, cursor='испорчен'))
+
+    def test_updated_since_orders_by_updated_at(self):
+        now = timezone.now().replace(microsecond=0)
+        # Одинаковое время у нескольких книг на границе страниц: внутри - по id
+        stamps = [now - timedelta(days=1), now + timedelta(minutes=2), now, now, now, now + timedelta(minutes=1), now]
+        for book_id, stamp in zip(self.ids, stamps):
+            Book.objects.filter(pk=book_id).update(updated_at=stamp)
+        expected = [book_id for stamp, book_id in sorted(zip(stamps, self.ids)) if stamp >= now]
+        self.assertEqual(self.walk(updated_since=now.isoformat()), (expected, 2))
+        self.assertIn('error', self.get('api_books', status=400, updated_since='вчера'))
+
+    def test_batch_reports_missing_ids(self):
+        first, second = self.ids[:2]
+        deleted = Book.objects.order_by('id').last()
+        deleted_id = deleted.pk
+        deleted.delete()
+        data = self.get('api_books_batch', ids=f'{second},{deleted_id},{first},{second}', fields='title')
+        self.assertEqual([item['id'] for item in data['results']], [second, first])
+        self.assertEqual(data['missing'], [deleted_id])
+        self.assertIn('error', self.get('api_books_batch', status=400, ids='1,два'))
+
+    def test_fields(self):
+        data = self.get('api_books', fields='title,tags', limit=1)
+        self.assertEqual(set(data['results'][0]), {'id', 'title', 'tags'})
+        self.assertIsInstance(data['results'][0]['tags'], list)
+        error = self.get('api_books', status=400, fields='title,password')['error']
+        self.assertIn('password', error)
+        self.get('api_authors', status=400, fields='title')
+
+    def test_favorites_require_login(self):
+        self.assertIn('error', self.get('api_favorites', status=401))
+        user = get_user_model().objects.first()
+        Favorite.objects.filter(user=user).delete()
+        Favorite.objects.create(user=user, book_id=self.ids[2])
+        self.client.force_login(user)
+        self.assertEqual([item['id'] for item in self.get('api_favorites')['results']], [self.ids[2]])
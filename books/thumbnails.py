@@ -0,0 +1,138 @@
+"""
+Уменьшенные копии обложек книг.
+
+При загрузке обложки (сигналы в books/signals.py) или командой `manage.py build_thumbnails`
+из оригинала строятся копии фиксированной ширины в форматах WebP и JPEG и крошечная
+размытая заглушка. Копии лежат в MEDIA_ROOT/thumbs/<хэш>/ и адресуются хэшем содержимого
+оригинала (Book.images_hash): одинаковые обложки разных изданий обрабатываются один раз,
+а замена файла обложки даёт новые адреса, которые не конфликтуют с кэшем браузера.
+Вывод в шаблонах - тег {% cover %} из books/templatetags/covers.py.
+"""
+import base64
+import hashlib
+import logging
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageFilter, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (70, 100, 200, 400)
+FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG'))
+QUALITY = 80
+PLACEHOLDER_WIDTH = 16
+# Заглушки ещё нет (копии строятся в фоне) - отсутствие помнится недолго, потом файл ищется снова
+MISSING_PLACEHOLDER_TIMEOUT = 60
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    file.open('rb')
+    try:
+        for chunk in file.chunks():
+            digest.update(chunk)
+    finally:
+        file.close()
+    return digest.hexdigest()
+
+
+def thumbnail_dir(digest):
+    return f'thumbs/{digest[:2]}/{digest}'
+
+
+def thumbnail_name(digest, width, ext):
+    return f'{thumbnail_dir(digest)}/{width}.{ext}'
+
+
+def thumbnail_url(digest, width, ext):
+    return default_storage.url(thumbnail_name(digest, width, ext))
+
+
+def placeholder_name(digest):
+    return f'{thumbnail_dir(digest)}/placeholder.jpg'
+
+
+def _encode(image, fmt, **options):
+    buffer = BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+def _resize(image, width):
+    # Копии не увеличиваются: узкий оригинал сохраняется в своём размере под всеми ширинами
+    if image.width <= width:
+        return image
+    height = round(image.height * width / image.width)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def build(file, digest=None, force=False):
+    """
+    Строит все копии обложки, если их ещё нет. Возвращает хэш содержимого
+    или пустую строку, если файл не удалось прочитать как изображение.
+    """
+    digest = digest or content_hash(file)
+    if not force and default_storage.exists(placeholder_name(digest)):
+        return digest
+    try:
+        file.open('rb')
+        with Image.open(file) as original:
+            image = ImageOps.exif_transpose(original).convert('RGB')
+    except (UnidentifiedImageError, OSError):
+        logger.warning('Не удалось построить копии обложки %s', file.name, exc_info=True)
+        return ''
+    finally:
+        file.close()
+
+    for width in WIDTHS:
+        resized = _resize(image, width)
+        for ext, fmt in FORMATS:
+            name = thumbnail_name(digest, width, ext)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(_encode(resized, fmt, quality=QUALITY)))
+
+    # Заглушка сохраняется последней: её наличие означает, что все копии готовы
+    placeholder = _resize(image, PLACEHOLDER_WIDTH).filter(ImageFilter.GaussianBlur(1))
+    name = placeholder_name(digest)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(_encode(placeholder, 'JPEG', quality=40)))
+    return digest
+
+
+def placeholder_data_uri(digest):
+    key = f'cover-placeholder:{digest}'
+    uri = cache.get(key)
+    if uri is None:
+        try:
+            with default_storage.open(placeholder_name(digest), 'rb') as f:
+                uri = 'data:image/jpeg;base64,' + base64.b64encode(f.read()).decode()
+        except OSError:
+            cache.set(key, '', MISSING_PLACEHOLDER_TIMEOUT)
+            return ''
+        cache.set(key, uri, None)
+    return uri
+
+
+def process_book(book, force=False):
+    """Строит копии обложки книги и запоминает хэш в Book.images_hash."""
+    from .caching import bump_catalog_version
+    from .facets import catalog_changed
+    from .models import Book
+    from .pagecache import purge_books
+    from .storage import blob_digest
+
+    # У файла из хранилища books/storage.py хэш содержимого уже есть в имени
+    digest = build(book.images_path, digest=blob_digest(book.images_path.name), force=force) if book.images_path else ''
+    if digest != book.images_hash:
+        book.images_hash = digest
+        Book.objects.filter(pk=book.pk).update(images_hash=digest, updated_at=timezone.now())
+        # Обложка не входит в фасеты: строки индекса не меняются, только его версия
+        catalog_changed(bump_catalog_version(), [])
+        purge_books([book.pk])
+    return digest
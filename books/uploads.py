@@ -0,0 +1,300 @@
+"""
+Загрузка больших файлов книг частями с докачкой.
+
+    POST   books/uploads/                    {"filename", "size", "sha256"?} -> сессия: id, chunk_size, chunks
+    PUT    books/uploads/<id>/<номер части>/ тело - байты части, заголовок X-Chunk-Sha256
+    GET    books/uploads/<id>/               состояние: принятые части (для докачки после обрыва)
+    POST   books/uploads/<id>/complete/      проверка и сборка -> имя файла в хранилище
+    POST   books/uploads/<id>/attach/        {"book": id} - файл становится файлом книги
+    DELETE books/uploads/<id>/               отмена
+
+Части фиксированного размера (последняя короче) можно отправлять параллельно и в любом порядке.
+Файл собирается сразу на месте: при создании сессии заводится разреженный файл полного размера,
+каждая часть пишется в него по своему смещению (os.pwrite) потоково, без чтения тела запроса
+в память, и принимается, только если совпал её sha256. Принятые части - строки UploadChunk.
+При завершении файл проверяется целиком (sha256, если клиент его сообщил) и переносится
+в хранилище с адресацией по содержимому (books/storage.py) без копирования.
+Незавершённые сессии удаляются через TTL фоновой задачей books.cleanup_uploads
+или командой `manage.py cleanup_uploads`; неприкреплённые файлы потом удаляет gc_files.
+
+Вместо файла в форме книги можно передать id завершённой сессии (поле upload формы BookForm),
+это делает books/static/books/js/chunked_upload.js для файлов больше CHUNK_SIZE.
+"""
+import hashlib
+import json
+import os
+import re
+from datetime import timedelta
+from functools import wraps
+
+from django import forms
+from django.core.files import File
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import require_http_methods
+
+from .api import ApiError
+from .models import Book, UploadChunk, UploadSession
+from .storage import blob_storage
+
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_SIZE = 4 * 1024 * 1024 * 1024
+TTL = timedelta(hours=24)
+READ_SIZE = 64 * 1024
+UPLOAD_DIR = 'tmp/chunked'
+UPLOAD_TO = 'books/e_books'
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class AssembledFile(File):
+    """Собранный файл: хранилище переносит его, а не копирует, и не считает хэш заново."""
+
+    def __init__(self, path, name, sha256):
+        super().__init__(None, name)
+        self.path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.path
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+
+class ChunkedFileInput(forms.FileInput):
+    """
+    Поле файла книги: файлы больше CHUNK_SIZE books/js/chunked_upload.js загружает частями
+    до отправки формы и передаёт в скрытом поле upload только id сессии.
+    """
+
+    class Media:
+        js = ('books/js/chunked_upload.js',)
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs'].update({
+            'data-upload-url': reverse('upload_create'),
+            'data-chunked-from': CHUNK_SIZE,
+        })
+        return context
+
+
+def part_path(session):
+    return blob_storage.path(f'{UPLOAD_DIR}/{session.pk}.part')
+
+
+def can_upload(user):
+    return user.is_authenticated and (user.has_perm('books.add_book') or user.has_perm('books.change_book'))
+
+
+def upload_view(methods):
+    """Представление API загрузки: JSON-ответ, ошибки ApiError - кодом ошибки, только для тех, кто добавляет книги."""
+    def decorator(view):
+        @require_http_methods(methods)
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not can_upload(request.user):
+                return JsonResponse({'error': 'Нет прав на загрузку файлов'}, status=403)
+            try:
+                data = view(request, *args, **kwargs)
+            except ApiError as error:
+                return JsonResponse({'error': str(error)}, status=error.status)
+            except Http404:
+                # Обработчик 404 сайта - страница только для GET, на PUT и POST он ответил бы 405
+                return JsonResponse({'error': 'Сессия загрузки не найдена'}, status=404)
+            if isinstance(data, HttpResponse):
+                return data
+            return JsonResponse(data, status=201 if request.method == 'POST' else 200,
+                                json_dumps_params={'ensure_ascii': False})
+        return wrapper
+    return decorator
+
+
+def request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            raise ApiError('Некорректный JSON')
+        if not isinstance(data, dict):
+            raise ApiError('Некорректный JSON')
+        return data
+    return request.POST
+
+
+def get_session(request, pk, status=UploadSession.Status.OPEN):
+    session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+    if session.expires_at <= timezone.now():
+        raise ApiError('Сессия загрузки истекла', status=410)
+    if status is not None and session.status != status:
+        raise ApiError(f'Сессия загрузки в состоянии "{session.get_status_display()}"', status=409)
+    return session
+
+
+def describe(session, received=None):
+    if received is None:
+        received = sorted(session.received.values_list('index', flat=True))
+    return {
+        'id': str(session.pk),
+        'filename': session.filename,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'chunks': session.chunks,
+        'received': received,
+        'status': session.status,
+        'file': session.file_name or None,
+        'expires_at': session.expires_at,
+    }
+
+
+@upload_view(['POST'])
+def create(request):
+    from . import tasks
+
+    data = request_data(request)
+    filename = os.path.basename(str(data.get('filename') or '').replace('\\', '/'))[:255]
+    sha256 = str(data.get('sha256') or '').lower()
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        raise ApiError('size - размер файла в байтах')
+    if not filename:
+        raise ApiError('Не указано имя файла')
+    if not 0 < size <= MAX_SIZE:
+        raise ApiError(f'Размер файла - от 1 байта до {MAX_SIZE} байт')
+    if sha256 and not SHA256_RE.match(sha256):
+        raise ApiError('sha256 - 64 шестнадцатеричные цифры')
+
+    session = UploadSession.objects.create(
+        user=request.user, filename=filename, size=size, chunk_size=CHUNK_SIZE, sha256=sha256,
+        expires_at=timezone.now() + TTL,
+    )
+    os.makedirs(os.path.dirname(part_path(session)), exist_ok=True)
+    # Разреженный файл: место под части, которые ещё не пришли, на диске не занимается
+    with open(part_path(session), 'wb') as f:
+        f.truncate(size)
+    # Очистка - одна задача на каждый час истечения сессий
+    deadline = session.expires_at.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    tasks.cleanup_uploads.enqueue(
+        dedup_key=f'uploads:cleanup:{deadline:%Y%m%d%H}',
+        delay=(deadline - timezone.now()).total_seconds(),
+    )
+    return describe(session, received=[])
+
+
+@upload_view(['PUT'])
+def put_chunk(request, pk, index):
+    session = get_session(request, pk)
+    if not 0 <= index < session.chunks:
+        raise ApiError(f'Номер части - от 0 до {session.chunks - 1}')
+    expected = request.headers.get('X-Chunk-Sha256', '').lower()
+    if not SHA256_RE.match(expected):
+        raise ApiError('Заголовок X-Chunk-Sha256 - sha256 части')
+    length = session.chunk_length(index)
+    offset = index * session.chunk_size
+    # Часть пишется поверх прежних байтов: до проверки новой она не считается принятой,
+    # иначе неудачная повторная отправка испортила бы уже принятую часть
+    UploadChunk.objects.filter(session=session, index=index).delete()
+
+    digest = hashlib.sha256()
+    written = 0
+    descriptor = os.open(part_path(session), os.O_WRONLY)
+    try:
+        while written < length:
+            block = request.read(min(READ_SIZE, length - written))
+            if not block:
+                break
+            os.pwrite(descriptor, block, offset + written)
+            digest.update(block)
+            written += len(block)
+        extra = request.read(1)
+    finally:
+        os.close(descriptor)
+    if written != length or extra:
+        raise ApiError(f'Размер части {index} должен быть {length} байт')
+    if digest.hexdigest() != expected:
+        # Часть не принимается, пока её не отправят заново
+        raise ApiError(f'Контрольная сумма части {index} не совпадает', status=422)
+    UploadChunk.objects.bulk_create([UploadChunk(session=session, index=index)], ignore_conflicts=True)
+    return HttpResponse(status=204)
+
+
+@upload_view(['GET', 'DELETE'])
+def detail(request, pk):
+    if request.method == 'DELETE':
+        session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+        remove(session)
+        return HttpResponse(status=204)
+    return describe(get_session(request, pk, status=None))
+
+
+@upload_view(['POST'])
+def complete(request, pk):
+    session = get_session(request, pk)
+    # Смена состояния - блокировка от параллельной сборки того же файла и от новых частей;
+    # принятые части считаются уже после неё
+    if not UploadSession.objects.filter(pk=session.pk, status=UploadSession.Status.OPEN).update(
+        status=UploadSession.Status.ASSEMBLING,
+    ):
+        raise ApiError('Файл уже собирается', status=409)
+    received = set(session.received.values_list('index', flat=True))
+    missing = [index for index in range(session.chunks) if index not in received]
+    if missing:
+        UploadSession.objects.filter(pk=session.pk).update(status=UploadSession.Status.OPEN)
+        return JsonResponse({'error': 'Получены не все части', 'missing': missing}, status=409)
+
+    path = part_path(session)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(READ_SIZE):
+            digest.update(block)
+    if session.sha256 and digest.hexdigest() != session.sha256:
+        UploadSession.objects.filter(pk=session.pk).update(status=UploadSession.Status.FAILED)
+        os.remove(path)
+        raise ApiError('Контрольная сумма файла не совпадает', status=422)
+
+    session.file_name = blob_storage.save(
+        f'{UPLOAD_TO}/{session.filename}', AssembledFile(path, session.filename, digest.hexdigest()),
+    )
+    if os.path.exists(path):
+        # Такой файл уже был в хранилище - собранная копия не нужна
+        os.remove(path)
+    session.status = UploadSession.Status.COMPLETE
+    session.save(update_fields=['file_name', 'status'])
+    return {'file': session.file_name, 'sha256': digest.hexdigest(), 'size': session.size}
+
+
+def attach_to_book(session, book):
+    book.file_path.name = session.file_name
+    book.save()
+
+
+@upload_view(['POST'])
+def attach(request, pk):
+    session = get_session(request, pk, status=UploadSession.Status.COMPLETE)
+    if not request.user.has_perm('books.change_book'):
+        raise ApiError('Нет прав на изменение книг', status=403)
+    try:
+        book = Book.objects.get(pk=int(request_data(request).get('book')))
+    except (TypeError, ValueError, Book.DoesNotExist):
+        raise ApiError('Книга не найдена', status=404)
+    attach_to_book(session, book)
+    return {'book': book.pk, 'file': book.file_path.name}
+
+
+def remove(session):
+    path = part_path(session)
+    if os.path.exists(path):
+        os.remove(path)
+    session.delete()
+
+
+def cleanup_expired(now=None):
+    """Удаляет истёкшие сессии и их недокачанные файлы. Возвращает число сессий."""
+    expired = list(UploadSession.objects.filter(expires_at__lte=now or timezone.now()))
+    for session in expired:
+        remove(session)
+    return len(expired)
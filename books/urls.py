@@ -1,9 +1,10 @@
 from django.urls import path
-from . import views
+from . import api, autocomplete, uploads, views
 from books.views import CategoryListView, BookByCategoryView
 
 urlpatterns = [
     path('catalog/', views.CatalogView.as_view(), name = 'catalog'),
+    path('catalog/export/<str:fmt>/', views.export_catalog, name = 'export_catalog'),
     path('category_list/', CategoryListView.as_view(), name = 'category_list'),
     path('category_list/<str:slug>/', BookByCategoryView.as_view(), name='book-by-category'),
     path('categories/<slug:slug>/', views.BookByThemeListView.as_view(), name='get_books_by_theme'),
@@ -11,13 +12,31 @@ urlpatterns = [
     path('<int:pk>/detail/', views.BookDetailView.as_view(), name='detail_book_by_id'),
     path('<int:pk>/detail/edit/', views.EditBookUpdateView.as_view(), name='edit_book'),
     path('<int:pk>/detail/delete/', views.DeleteBookView.as_view(), name='delete_book'),
+    path('<int:pk>/read/', views.BookReaderView.as_view(), name='read_book'),
+    path('<int:pk>/read/<int:number>/', views.read_chapter, name='read_chapter'),
+    path('<int:pk>/read/position/', views.save_reading_position, name='save_reading_position'),
     path('series/', views.SeriaView.as_view(), name = 'series'),
+    path('series/<int:pk>/books/', views.get_seria_books, name = 'seria_books'),
     path('reader/', views.GetControl.as_view(), name = 'reader'),
     path('upload_file/', views.add_book_by_file, name='add_book_by_file'),
     path('add/', views.AddBookCreateView.as_view(), name='add_book'),
     path('add_author/', views.AddAuthorCreateView.as_view(), name='add_author'),
     path('add_editor/', views.AddEditorCreateView.as_view(), name='add_editor'),
     path('add_seria/', views.AddSeriaCreateView.as_view(), name='add_seria'),
+    path('search/', views.ContentSearchView.as_view(), name='search_contents'),
+    path('autocomplete/<str:source>/', autocomplete.autocomplete, name='autocomplete'),
+    path('api/books/', api.books, name='api_books'),
+    path('api/books/batch/', api.books_batch, name='api_books_batch'),
+    path('api/authors/', api.authors, name='api_authors'),
+    path('api/series/', api.series, name='api_series'),
+    path('api/tags/', api.tags, name='api_tags'),
+    path('api/themes/', api.themes, name='api_themes'),
+    path('api/favorites/', api.favorites, name='api_favorites'),
+    path('uploads/', uploads.create, name='upload_create'),
+    path('uploads/<uuid:pk>/', uploads.detail, name='upload_detail'),
+    path('uploads/<uuid:pk>/<int:index>/', uploads.put_chunk, name='upload_chunk'),
+    path('uploads/<uuid:pk>/complete/', uploads.complete, name='upload_complete'),
+    path('uploads/<uuid:pk>/attach/', uploads.attach, name='upload_attach'),
     path('add_favorite/<int:book_id>/', views.AddFavoriteBookCreateView.as_view(), name='get_favorite'),
     path('delete_favorite/<int:book>', views.DeleteFavoriteBookView.as_view(), name='delete_favorite'),
 ]
@@ -1,14 +1,17 @@
 from django.db.transaction import commit
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import get_user_model
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.decorators import user_passes_test
 from django.core.cache import cache
 from django.core.files.storage import FileSystemStorage
-from django.db.models import F, Q
+from django.db import IntegrityError
 from django.shortcuts import render, get_object_or_404, redirect
 from django.template.context_processors import request
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, require_POST
 from django.contrib.auth.models import User
 from django.views.generic import TemplateView, DetailView
 from django.views.generic.edit import (
@@ -22,8 +25,12 @@ from django.contrib.auth.models import User
 from django.forms import BaseModelForm
 
 from .forms import BookForm, FavoriteForm, AuthorForm, EditorForm, SeriaForm, UploadFileForm
-from .models import Book, Tag, BookTags, Favorite, Author, Editor, Theme, Cover, Type, Format, Seria
-import os
+from .models import Book, Tag, BookTags, Favorite, Author, Editor, Theme, Cover, Type, Format, Seria, ReadingPosition
+from . import caching, ebooks, exporter, facets, filters, fulltext
+from .conditional import book_condition, list_condition
+from .pagecache import AnonymousPageCacheMixin
+from .paginators import KeysetPaginationMixin, paginate, pagination_query
+import math
 
 info={
    "menu": [
@@ -57,7 +64,8 @@ info={
 
 class MenuMixin:
 
-    timeout = 30
+    # Счётчики кэшируются под ключом с версией каталога (books/caching.py), поэтому время жизни большое
+    timeout = caching.LONG_TIMEOUT
     def get_menu(self):
         menu = cache.get('menu')
         if not menu:
@@ -66,10 +74,11 @@ class MenuMixin:
         return menu
 
     def get_books_count(self):
-        books_count = cache.get('books_count')
-        if not books_count:
+        key = caching.versioned_key('books_count')
+        books_count = cache.get(key)
+        if books_count is None:
             books_count = Book.objects.count()
-            cache.set('books_count', books_count, self.timeout)
+            cache.set(key, books_count, self.timeout)
         return books_count
 
     def get_context_data(self, **kwargs):
@@ -84,49 +93,36 @@ class IndexView(MenuMixin, TemplateView):
 class PageNotFoundView(MenuMixin, TemplateView):
     template_name = "404.html"
 
-class CatalogView(MenuMixin, ListView):
+    def render_to_response(self, context, **response_kwargs):
+        # handler404 должен отвечать кодом 404, а не 200
+        response_kwargs.setdefault('status', 404)
+        return super().render_to_response(context, **response_kwargs)
+
+@method_decorator(list_condition, name='dispatch')
+class CatalogView(AnonymousPageCacheMixin, KeysetPaginationMixin, MenuMixin, ListView):
     model = Book
     template_name = 'books/catalog.html'
     context_object_name = 'books'
     paginate_by = 12
+    page_dependencies = ('catalog', 'listings', 'counters')
 
     def get_queryset(self):
-        sort = self.request.GET.get('sort', 'title')
-        order = self.request.GET.get('order', 'asc')
-        search_query = self.request.GET.get('search_query', '')
-
-        if order == 'asc':
-            order_by = sort
-        else:
-            order_by = f'-{sort}'
-
-        if search_query:
-            queryset = Book.objects.filter(
-                Q(title__iregex=search_query) |
-                Q(author__sirname__iregex=search_query) |
-                Q(tags__name__iregex=search_query)
-            ).prefetch_related('tags').order_by(order_by).distinct()
-        else:
-            queryset = Book.objects.prefetch_related('tags').order_by(order_by)
-        return queryset
+        return filters.filter_catalog(Book.objects.cards(self.request.user), self.request.GET)
 
     def get_context_data(self, **kwargs):
         # Получение существующего контекста из базового класса
         context = super().get_context_data(**kwargs)
         # Добавление дополнительных данных в контекст
-        context['sort'] = self.request.GET.get('sort', 'title')
+        context['sort'] = filters.get_sort(self.request.GET)
         context['order'] = self.request.GET.get('order', 'asc')
         context['search_query'] = self.request.GET.get('search_query', '')
+        context['facets'] = facets.facet_counts(self.request.GET)
         context['menu'] = info['menu'] # Пример добавления статических данных в контекст
-        try:
-            if self.request.user:
-                context['favorite_books'] = Book.objects.filter(id__in = Favorite.objects.filter(user=self.request.user).values('book'))
-        except:
-            0
         return context
 
 
-class BookByThemeListView(MenuMixin, ListView):
+@method_decorator(list_condition, name='dispatch')
+class BookByThemeListView(KeysetPaginationMixin, MenuMixin, ListView):
     model = Book
     template_name = 'books/catalog.html'
     context_object_name = 'books'
@@ -134,44 +130,87 @@ class BookByThemeListView(MenuMixin, ListView):
 
     def get_queryset(self):
         slug = self.kwargs.get('slug')
-        theme = get_object_or_404(Theme, slug=slug)
+        self.theme = get_object_or_404(Theme, slug=slug)
 
-        return Book.objects.filter(theme=theme)
+        return Book.objects.cards(self.request.user).filter(theme=self.theme).order_by('title')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['theme'] = get_object_or_404(Theme, slug=self.kwargs.get('slug'))
+        context['theme'] = self.theme
         return context
 
 
+@list_condition
 def get_books_by_tag(request, tag_id):
 
-    books = Book.objects.filter(tags__id=tag_id)
+    books = Book.objects.cards(request.user).filter(tags__id=tag_id).order_by('title')
+    paginator, page, page_range = paginate(request, books, CatalogView.paginate_by)
 
     context = {
-        'books': books,
+        'books': page.object_list,
+        'page_obj': page,
+        'paginator': paginator,
+        'is_paginated': page.has_other_pages(),
+        'page_range': page_range,
+        'pagination_query': pagination_query(request),
         'menu': info['menu'],
     }
     return render(request, 'books/catalog.html', context)
 
-class BookDetailView(MenuMixin, DetailView):
+def export_catalog(request, fmt):
+    # Выгрузка отдаётся потоком, строки формируются по мере чтения из базы.
+    # Пути к файлам электронных книг, как и ссылки на них, видны только суперпользователю
+    if fmt not in exporter.FORMATS:
+        raise Http404('Неизвестный формат выгрузки')
+    if request.GET.get('theme') and filters.get_theme(request.GET) is None:
+        raise Http404('Тематика не найдена')
+    generate, content_type = exporter.FORMATS[fmt]
+    response = StreamingHttpResponse(
+        generate(request.GET, include_files=request.user.is_superuser),
+        content_type=content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="catalog.{fmt}"'
+    return response
+
+@method_decorator(book_condition, name='dispatch')
+class BookDetailView(AnonymousPageCacheMixin, MenuMixin, DetailView):
     model = Book
     template_name = 'books/book_detail.html'
     context_object_name = 'book'
 
+    def get_page_dependencies(self):
+        return [*super().get_page_dependencies(), f"book:{self.kwargs['pk']}", 'tags']
+
+    def get_object_dependencies(self):
+        # Переименование автора, серии и т.п. сбрасывает страницы только их книг
+        book = self.object
+        return [
+            f'{field.name}:{getattr(book, field.attname)}'
+            for field in book._meta.concrete_fields if field.is_relation
+        ]
+
 
     def get_object(self, queryset=None):
         obj = super().get_object(queryset=queryset)
         return obj
 
 
-class SeriaView(MenuMixin, ListView):
+@method_decorator(list_condition, name='dispatch')
+class SeriaView(AnonymousPageCacheMixin, KeysetPaginationMixin, MenuMixin, ListView):
     model = Seria
     template_name = 'books/series.html'
     context_object_name = 'series'
+    paginate_by = 20
+    page_dependencies = ('series', 'counters')
 
-    def get_queryset(self):
+    sort_fields = ('seria', 'books_count', 'read_count')
+
+    def get_sort(self):
         sort = self.request.GET.get('sort', 'seria')
+        return sort if sort in self.sort_fields else 'seria'
+
+    def get_queryset(self):
+        sort = self.get_sort()
         order = self.request.GET.get('order', 'asc')
         search_query = self.request.GET.get('search_query', '')
 
@@ -180,94 +219,101 @@ class SeriaView(MenuMixin, ListView):
         else:
             order_by = f'-{sort}'
 
+        # Серия с id=1 - служебная ("без серии"), на странице не выводится.
+        # Количество томов хранится в самой серии (books/counters.py)
+        queryset = Seria.objects.exclude(id=1)
         if search_query:
-            queryset = Seria.objects.filter(seria__iregex=search_query).order_by(order_by)
-        else:
-            queryset = Seria.objects.order_by(order_by)
-        return queryset
+            queryset = queryset.filter(seria__iregex=search_query)
+        return queryset.order_by(order_by)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['sort'] = self.request.GET.get('sort', 'seria')
+        context['sort'] = self.get_sort()
         context['order'] = self.request.GET.get('order', 'asc')
         context['search_query'] = self.request.GET.get('search_query', '')
         context['menu'] = info['menu'] # Пример добавления статических данных в контекст
-        context['books'] = Book.objects.all()
         return context
 
 
+def get_seria_books(request, pk):
+    # Фрагмент со списком томов серии, подгружается при раскрытии серии на странице серий
+    seria = get_object_or_404(Seria, pk=pk)
+    books = (
+        Book.objects.filter(seria=seria)
+        .only('id', 'title', 'tom', 'images_path', 'images_hash')
+        .order_by('tom', 'title')
+    )
+    return render(request, 'books/includes/seria_books.html', {'seria': seria, 'books': books})
+
+
+@method_decorator(list_condition, name='dispatch')
 class GetControl(ListView):
     model = Book
     template_name = 'books/to_read.html'
     context_object_name = 'books'
 
     def get_queryset(self):
-        queryset = Book.objects.filter(controler=1)
+        queryset = Book.objects.cards(self.request.user).filter(controler=1).order_by('title')
         return queryset
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['books'] = Book.objects.filter(controler=1)
-        context['favorite_books'] = Book.objects.filter(controler=1).filter(id__in=Favorite.objects.filter(user=self.request.user).values('book'))
         context['menu'] = info['menu']
         return context
 
 
-class CategoryListView(MenuMixin, ListView):
+class ContentSearchView(UserPassesTestMixin, MenuMixin, TemplateView):
+    # Поиск по тексту электронных книг: найденные книги с фрагментами текста.
+    # Фрагменты - это текст самих книг, поэтому доступ тот же, что к чтению (can_read)
+    template_name = 'books/search_contents.html'
+
+    def test_func(self):
+        return can_read(self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = ' '.join(self.request.GET.get('q', '').split())
+        context['query'] = query
+        context['results'] = fulltext.search_contents(query, self.request.user) if query else []
+        return context
+
+
+@method_decorator(list_condition, name='dispatch')
+class CategoryListView(AnonymousPageCacheMixin, MenuMixin, ListView):
     model = Theme
     template_name = "books/category_list.html"
+    page_dependencies = ('themes', 'counters')
 
 
-class BookByCategoryView(MenuMixin, ListView):
-    model = Theme
+@method_decorator(list_condition, name='dispatch')
+class BookByCategoryView(AnonymousPageCacheMixin, KeysetPaginationMixin, MenuMixin, ListView):
+    model = Book
     context_object_name = 'books'
     template_name = 'books/book_list.html'
+    paginate_by = 30
 
-    def get_queryset(self):
-        self.title = Theme.objects.get(slug=self.kwargs['slug'])
-        queryset = Book.objects.filter(theme=self.title)
-        self.parent = Theme.objects.get(slug=self.kwargs['slug'])
-
-        theme_list=[] ##Выбираем все тематики связанные с выбранной
-        parent_list = []
-
-        for theme in Theme.objects.all():
-             if theme.parent==self.parent:
-                theme_list.append(theme.title)
-                parent_list.append(Theme.objects.get(title = theme.title))
-                for book in Book.objects.filter(theme=theme):
-                    queryset |= Book.objects.filter(id=book.id)
-
-        for theme in Theme.objects.all():
-            if theme.parent in parent_list:
-                theme_list.append(theme.title)
-                parent_list.append(Theme.objects.get(title=theme.title))
-                for book in Book.objects.filter(theme=theme):
-                    queryset |= Book.objects.filter(id=book.id)
+    def get_page_dependencies(self):
+        return [*super().get_page_dependencies(), 'themes', 'listings', 'counters', f"theme-books:{self.kwargs['slug']}"]
 
-        return queryset
+    def get_queryset(self):
+        self.title = get_object_or_404(Theme, slug=self.kwargs['slug'])
+        # Все книги поддерева тематики одним запросом по границам вложенного множества MPTT.
+        # Сортировка - только по разрешённым полям (filters.SORT_FIELDS), без поиска - по названию или году
+        queryset = filters.filter_by_theme(Book.objects.cards(self.request.user), self.title)
+        return queryset.order_by(filters.get_order_by(self.request.GET))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = self.title
-        menu: info['menu']
-        context['themes'] = Theme.objects.all()
+        context['sort'] = filters.get_sort(self.request.GET)
+        context['order'] = self.request.GET.get('order', 'asc')
+        # Подтемы с количеством книг во всём их поддереве (хранится в тематике, books/counters.py)
+        context['subthemes'] = self.title.get_children()
         return context
 
-def handle_uploaded_file(f):
-        file_path = f'books/static/books/images/{f.name}'
-
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-        with open(file_path, "wb+") as destination:
-            for chunk in f.chunks():
-                destination.write(chunk)
-
-        return file_path
-
 def add_book_by_file(request):
     if request.method == 'POST':
-        form = BookForm(request.POST, request.FILES)
+        form = BookForm(request.POST, request.FILES, user=request.user)
         if form.is_valid():
             form.save()
             return redirect('catalog')
@@ -284,6 +330,9 @@ class AddBookCreateView(MenuMixin, CreateView):
     success_url = reverse_lazy('catalog')
     redirect_field_name = 'next'
 
+    def get_form_kwargs(self):
+        return {**super().get_form_kwargs(), 'user': self.request.user}
+
 
 class AddAuthorCreateView(MenuMixin, CreateView):
     model = Author
@@ -313,6 +362,9 @@ class EditBookUpdateView(LoginRequiredMixin, MenuMixin, UpdateView):
     success_url = reverse_lazy('catalog')
     redirect_field_name = 'next'
 
+    def get_form_kwargs(self):
+        return {**super().get_form_kwargs(), 'user': self.request.user}
+
 class DeleteBookView(LoginRequiredMixin, MenuMixin, DeleteView):
     model = Book
     success_url = reverse_lazy('catalog')
@@ -358,3 +410,97 @@ class DeleteFavoriteBookView(MenuMixin, ListView):
        context['message'] = message
        return context
 
+
+def can_read(user):
+    # Файлы электронных книг доступны только администратору (как и ссылка на скачивание)
+    return user.is_superuser
+
+
+class BookReaderView(UserPassesTestMixin, MenuMixin, DetailView):
+    """
+    Чтение электронной книги по главам: страница с оглавлением и текстом одной главы.
+    Следующие главы подгружаются фрагментами (read_chapter), место чтения сохраняет save_reading_position.
+    """
+    model = Book
+    template_name = 'books/book_reader.html'
+    context_object_name = 'book'
+
+    def test_func(self):
+        return can_read(self.request.user)
+
+    def get_queryset(self):
+        return Book.objects.select_related('author').only(
+            'id', 'title', 'file_path', 'author__sirname', 'author__name', 'author__fathername',
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        try:
+            index = ebooks.get_index(self.object)
+        except (ebooks.ReaderError, OSError) as error:
+            raise Http404(str(error))
+        position = ReadingPosition.objects.filter(user=self.request.user, book=self.object).first()
+        number, progress = (position.chapter, position.progress) if position else (0, 0)
+        chapter = self.request.GET.get('chapter', '')
+        if chapter.isdigit():
+            # В адресе главы нумеруются с единицы
+            number, progress = int(chapter) - 1, 0
+        number = min(max(number, 0), len(index.chapters) - 1)
+        context['chapters'] = ebooks.chapter_titles(index)
+        context['number'] = number
+        context['chapter_title'] = context['chapters'][number]
+        context['progress'] = progress
+        context['fragment'] = ebooks.chapter_fragment(index, number)
+        return context
+
+
+def _chapter_index(request, pk):
+    if not hasattr(request, '_chapter_index'):
+        book = get_object_or_404(Book.objects.only('id', 'file_path'), pk=pk)
+        try:
+            request._chapter_index = ebooks.get_index(book)
+        except (ebooks.ReaderError, OSError) as error:
+            raise Http404(str(error))
+    return request._chapter_index
+
+
+def _chapter_etag(request, pk, number):
+    # Содержимое главы определяется хэшем файла и номером главы
+    return f'{_chapter_index(request, pk).content_hash}-{number}'
+
+
+@user_passes_test(can_read)
+@condition(etag_func=_chapter_etag)
+def read_chapter(request, pk, number):
+    """HTML-фрагмент главы number (с единицы)."""
+    try:
+        fragment = ebooks.chapter_fragment(_chapter_index(request, pk), number - 1)
+    except IndexError:
+        raise Http404('Такой главы нет')
+    except (ebooks.ReaderError, OSError) as error:
+        raise Http404(str(error))
+    response = HttpResponse(fragment)
+    response['Cache-Control'] = 'private, max-age=0'
+    return response
+
+
+@require_POST
+@user_passes_test(can_read)
+def save_reading_position(request, pk):
+    """Запоминает главу и долю её прокрутки одним запросом (вставка или обновление строки)."""
+    try:
+        chapter = max(int(request.POST.get('chapter', 1)) - 1, 0)
+        progress = float(request.POST.get('progress', 0))
+        if not math.isfinite(progress):
+            raise ValueError(progress)
+    except ValueError:
+        return HttpResponse(status=400)
+    try:
+        ReadingPosition.objects.bulk_create(
+            [ReadingPosition(user=request.user, book_id=pk, chapter=chapter, progress=min(max(progress, 0.0), 1.0))],
+            update_conflicts=True, unique_fields=['user', 'book'], update_fields=['chapter', 'progress', 'updated_at'],
+        )
+    except IntegrityError:
+        # Книги нет; ответ без страницы 404 - запрос отправляет navigator.sendBeacon()
+        return HttpResponse(status=404)
+    return HttpResponse(status=204)
@@ -0,0 +1,49 @@
+from django.contrib import admin, messages
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'priority', 'attempts', 'run_at', 'created_at', 'finished_at', 'locked_by')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'dedup_key', 'last_error')
+    readonly_fields = [field.name for field in Job._meta.fields]
+    date_hierarchy = 'created_at'
+    actions = ('retry_jobs',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description='Повторить выбранные задачи')
+    def retry_jobs(self, request, queryset):
+        count = skipped = 0
+        for pk in queryset.exclude(status=Job.Status.RUNNING).values_list('pk', flat=True):
+            # Такая же задача (с тем же dedup_key) уже может ждать в очереди - тогда повтор не нужен
+            try:
+                with transaction.atomic():
+                    count += Job.objects.filter(pk=pk).update(
+                        status=Job.Status.QUEUED, attempts=0, run_at=timezone.now(), locked_by='', last_error='',
+                    )
+            except IntegrityError:
+                skipped += 1
+        self.message_user(request, f'Возвращено в очередь: {count}', messages.SUCCESS)
+        if skipped:
+            self.message_user(request, f'Уже в очереди с тем же ключом, пропущено: {skipped}', messages.WARNING)
+
+    def changelist_view(self, request, extra_context=None):
+        # Сводка над списком: сколько задач каждого вида в каждом состоянии и как давно ждёт самая старая
+        summary = {}
+        for row in Job.objects.values('name', 'status').annotate(count=Count('id'), oldest=Min('run_at')).order_by('name'):
+            item = summary.setdefault(row['name'], {'name': row['name'], 'oldest': None})
+            item[row['status']] = row['count']
+            if row['status'] == Job.Status.QUEUED:
+                item['oldest'] = row['oldest']
+        extra_context = {**(extra_context or {}), 'job_summary': list(summary.values())}
+        return super().changelist_view(request, extra_context=extra_context)
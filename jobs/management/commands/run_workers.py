@@ -0,0 +1,58 @@
+import multiprocessing
+import signal
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs.worker import Worker, purge_finished
+
+
+def work(number, options, stop_event):
+    # В дочернем процессе (и при запуске через spawn) Django настраивается заново
+    django.setup()
+    # Ctrl+C и SIGTERM обрабатывает родитель; SIGTERM самому процессу - тоже мягкая остановка
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    Worker(name=f"{options['name']}-{number}" if options['name'] else None,
+           poll_interval=options['poll'], stop_event=stop_event).run(once=options['once'])
+
+
+class Command(BaseCommand):
+    help = 'Запускает обработчики очереди фоновых задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help='Количество процессов-обработчиков')
+        parser.add_argument('--poll', type=float, default=None, help='Пауза при пустой очереди, с')
+        parser.add_argument('--once', action='store_true', help='Выполнить задачи из очереди и завершиться')
+        parser.add_argument('--name', default='', help='Имя обработчика в поле Job.locked_by')
+
+    def handle(self, *args, **options):
+        purged = purge_finished()
+        if purged:
+            self.stdout.write(f'Удалено выполненных задач: {purged}')
+        if options['processes'] <= 1:
+            Worker(name=options['name'] or None, poll_interval=options['poll']).run(once=options['once'])
+            return
+
+        # Соединения с базой не должны достаться дочерним процессам от родителя
+        connections.close_all()
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+        stop_event = context.Event()
+        processes = [
+            context.Process(target=work, args=(number, options, stop_event), daemon=True)
+            for number in range(1, options['processes'] + 1)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f'Запущено обработчиков: {len(processes)}')
+
+        def stop(signum, frame):
+            # Текущие задачи дорабатываются, новые не берутся
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for process in processes:
+            process.join()
+        self.stdout.write('Обработчики остановлены')
@@ -0,0 +1,79 @@
+"""
+Очередь фоновых задач в базе данных (без внешнего брокера, работает и на SQLite).
+
+Задача объявляется декоратором в модуле tasks.py приложения:
+
+    @task('books.process_cover', priority=5)
+    def process_cover(book_id): ...
+
+и ставится в очередь из обработчика запроса: process_cover.enqueue(book.pk, dedup_key=f'cover:{book.pk}').
+Запись Job добавляется в текущей транзакции, поэтому обработчики (manage.py run_workers)
+увидят задачу только после её фиксации. Аргументы должны сериализоваться в JSON.
+
+dedup_key - пока задача с таким ключом ждёт в очереди, повторная не добавляется.
+Выполняющаяся задача не мешает добавить новую: данные могли измениться после её запуска.
+При JOBS['IMMEDIATE'] задачи выполняются сразу после фиксации транзакции в том же процессе
+(разработка без запущенных обработчиков).
+"""
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Job
+
+DEFAULTS = {
+    'IMMEDIATE': False,
+    'POLL_INTERVAL': 1.0,
+    'STALE_AFTER': 600,
+    'KEEP_DONE_DAYS': 7,
+}
+
+registry = {}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'JOBS', {})}
+
+
+@dataclass
+class Task:
+    name: str
+    func: object
+    priority: int = 0
+    max_attempts: int = 5
+    backoff: float = 10.0
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def retry_delay(self, attempts):
+        # Экспоненциальная пауза: backoff, 2*backoff, 4*backoff ..., не больше суток
+        return timedelta(seconds=min(self.backoff * 2 ** max(attempts - 1, 0), 60 * 60 * 24))
+
+    def enqueue(self, *args, dedup_key=None, priority=None, delay=0, **kwargs):
+        if get_config()['IMMEDIATE']:
+            transaction.on_commit(lambda: self.func(*args, **kwargs))
+            return
+        Job.objects.bulk_create([Job(
+            name=self.name,
+            args=list(args),
+            kwargs=kwargs,
+            dedup_key=dedup_key,
+            priority=self.priority if priority is None else priority,
+            max_attempts=self.max_attempts,
+            run_at=timezone.now() + timedelta(seconds=delay),
+        )], ignore_conflicts=True)
+
+
+def task(name, priority=0, max_attempts=5, backoff=10.0):
+    def decorator(func):
+        registry[name] = Task(name, func, priority, max_attempts, backoff)
+        return registry[name]
+    return decorator
+
+
+def enqueue(name, *args, **kwargs):
+    return registry[name].enqueue(*args, **kwargs)
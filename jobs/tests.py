@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .models import Job
+from .queue import task
+from .worker import Worker
+
+calls = []
+
+
+@task('jobs.tests.record')
+def record(value):
+    calls.append(value)
+
+
+class WorkerTests(TestCase):
+
+    def test_finished_job_does_not_overwrite_newer_attempt(self):
+        Job.objects.create(name='jobs.tests.record', args=[1])
+        first = Worker(name='first').claim()
+        # Обработчик завис, задачу вернули в очередь и взял другой
+        Job.objects.filter(pk=first.pk).update(status=Job.Status.QUEUED, locked_by='', locked_at=None)
+        second = Worker(name='second').claim()
+
+        with self.assertLogs('jobs', 'WARNING'):
+            Worker(name='first').execute(first)
+        job = Job.objects.get(pk=first.pk)
+        self.assertEqual(job.status, Job.Status.RUNNING)
+        self.assertEqual(job.locked_by, second.locked_by)
+
+        with self.assertLogs('jobs', 'INFO'):
+            Worker(name='second').execute(second)
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.Status.DONE)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    INSTRUMENTATION={'LOG': False, 'SERVER_TIMING': False},
+)
+class JobAdminTests(TestCase):
+
+    def test_retry_skips_job_already_queued_with_same_key(self):
+        failed = Job.objects.create(name='jobs.tests.record', args=[1], dedup_key='same', status=Job.Status.FAILED)
+        queued = Job.objects.create(name='jobs.tests.record', args=[1], dedup_key='same')
+        other = Job.objects.create(name='jobs.tests.record', args=[2], dedup_key='other', status=Job.Status.FAILED)
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret'))
+
+        response = self.client.post(reverse('admin:jobs_job_changelist'), {
+            'action': 'retry_jobs', '_selected_action': [failed.pk, other.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Job.objects.get(pk=failed.pk).status, Job.Status.FAILED)
+        self.assertEqual(Job.objects.get(pk=queued.pk).status, Job.Status.QUEUED)
+        self.assertEqual(Job.objects.get(pk=other.pk).status, Job.Status.QUEUED)
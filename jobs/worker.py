@@ -0,0 +1,131 @@
+"""
+Обработчик очереди: берёт задачи по одной и выполняет их (manage.py run_workers).
+
+Задача захватывается одним UPDATE ... WHERE id = (SELECT ... LIMIT 1) AND status='queued':
+такой запрос атомарен и на SQLite, и на других базах, поэтому одну задачу не возьмут
+два процесса. Упавшая задача возвращается в очередь с экспоненциальной паузой,
+после max_attempts попыток остаётся в состоянии failed. Задачи, обработчик которых
+завис или был убит (running дольше STALE_AFTER секунд), возвращаются в очередь.
+"""
+import logging
+import os
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, OperationalError, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from .queue import get_config, registry
+
+logger = logging.getLogger('jobs')
+
+
+class Worker:
+
+    def __init__(self, name=None, poll_interval=None, stale_after=None, stop_event=None):
+        config = get_config()
+        self.name = name or f'{os.uname().nodename}:{os.getpid()}'
+        self.poll_interval = config['POLL_INTERVAL'] if poll_interval is None else poll_interval
+        self.stale_after = config['STALE_AFTER'] if stale_after is None else stale_after
+        self.stop_event = stop_event
+
+    @property
+    def stopped(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def claim(self):
+        now = timezone.now()
+        token = f'{self.name}:{uuid.uuid4().hex[:12]}'
+        candidate = (
+            Job.objects.filter(status=Job.Status.QUEUED, run_at__lte=now)
+            .order_by('-priority', 'run_at', 'id').values('id')[:1]
+        )
+        claimed = Job.objects.filter(id__in=candidate, status=Job.Status.QUEUED).update(
+            status=Job.Status.RUNNING, locked_by=token, locked_at=now, attempts=F('attempts') + 1,
+        )
+        return Job.objects.get(locked_by=token) if claimed else None
+
+    @staticmethod
+    def _locked(job):
+        # Итог пишется, только если задача всё ещё за этой попыткой: зависшую задачу
+        # requeue_stale() мог отдать другому обработчику, и её состояние уже не наше
+        return Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+
+    def _requeue(self, job, **fields):
+        # Пока задача выполнялась, такая же (с тем же dedup_key) могла снова встать в очередь -
+        # тогда эта попытка не нужна, её заменяет новая задача
+        try:
+            self._locked(job).update(status=Job.Status.QUEUED, locked_by='', locked_at=None, **fields)
+        except IntegrityError:
+            self._locked(job).update(
+                status=Job.Status.DONE, locked_by='', finished_at=timezone.now(),
+                last_error='Заменена задачей с тем же ключом',
+            )
+
+    def execute(self, job):
+        task = registry.get(job.name)
+        started = time.monotonic()
+        try:
+            if task is None:
+                raise LookupError(f'Неизвестная задача {job.name}')
+            task.func(*job.args, **job.kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            if task is not None and job.attempts < job.max_attempts:
+                delay = task.retry_delay(job.attempts)
+                logger.warning('%s: попытка %s не удалась, повтор через %s', job, job.attempts, delay)
+                self._requeue(job, run_at=timezone.now() + delay, last_error=error)
+            else:
+                logger.error('%s: не выполнена\n%s', job, error)
+                self._locked(job).update(
+                    status=Job.Status.FAILED, locked_by='', finished_at=timezone.now(), last_error=error,
+                )
+            return False
+        if not self._locked(job).update(status=Job.Status.DONE, locked_by='', finished_at=timezone.now()):
+            logger.warning('%s: выполнена за %.2f с, но уже передана другому обработчику', job, time.monotonic() - started)
+            return True
+        logger.info('%s: выполнена за %.2f с', job, time.monotonic() - started)
+        return True
+
+    def requeue_stale(self):
+        limit = timezone.now() - timedelta(seconds=self.stale_after)
+        for job in Job.objects.filter(status=Job.Status.RUNNING, locked_at__lt=limit):
+            logger.warning('%s: обработчик %s не ответил, задача возвращена в очередь', job, job.locked_by)
+            self._requeue(job, run_at=timezone.now())
+
+    def run_one(self):
+        job = self.claim()
+        if job is None:
+            return False
+        self.execute(job)
+        return True
+
+    def run(self, once=False):
+        """Выполняет задачи до остановки; once=True - пока очередь не опустеет."""
+        last_check = 0
+        while not self.stopped:
+            close_old_connections()
+            try:
+                if time.monotonic() - last_check > self.stale_after / 2:
+                    self.requeue_stale()
+                    last_check = time.monotonic()
+                if self.run_one():
+                    continue
+            except OperationalError as error:
+                # SQLite занята другим процессом дольше таймаута - повторяем позже
+                logger.warning('%s: %s', self.name, error)
+            if once:
+                return
+            if self.stop_event is not None:
+                self.stop_event.wait(self.poll_interval)
+            else:
+                time.sleep(self.poll_interval)
+
+
+def purge_finished(days=None):
+    days = get_config()['KEEP_DONE_DAYS'] if days is None else days
+    return Job.objects.filter(status=Job.Status.DONE, finished_at__lt=timezone.now() - timedelta(days=days)).delete()[0]
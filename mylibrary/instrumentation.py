@@ -0,0 +1,223 @@
+"""
+Замеры каждого запроса в рабочем режиме (debug_toolbar включается только при DEBUG).
+
+RequestMetricsMiddleware считает для запроса:
+- число SQL-запросов, их суммарное и максимальное время (execute_wrapper на всех соединениях);
+- время отрисовки шаблонов (обёртка над render() шаблонов бэкенда DjangoTemplates);
+- попадания и промахи кэша (обёртка над get/get_many классов бэкендов из CACHES).
+Итоги выводятся заголовком Server-Timing и строкой JSON в логгер mylibrary.requests.
+
+Часть запросов (INSTRUMENTATION['SAMPLE_RATE']) обрабатывается подробно: сохраняются тексты
+SQL и стек вызова внутри проекта для каждого из них, и если запрос выполнялся дольше
+SLOW_MS, подробности пишутся в логгер mylibrary.slow_requests (в settings - ротируемый файл).
+Без выборки на каждый SQL-запрос приходятся только два вызова perf_counter.
+"""
+import json
+import logging
+import os
+import random
+import time
+import traceback
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache.backends.base import BaseCache
+from django.db import connections
+from django.template.backends.django import Template
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('mylibrary.requests')
+slow_logger = logging.getLogger('mylibrary.slow_requests')
+
+DEFAULTS = {
+    'SERVER_TIMING': True,
+    'LOG': True,
+    'SAMPLE_RATE': 0.0,
+    'SLOW_MS': 500,
+    'STACK_DEPTH': 8,
+}
+
+_current = ContextVar('request_metrics', default=None)
+_MISSING = object()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'INSTRUMENTATION', {})}
+
+
+class RequestMetrics:
+
+    def __init__(self, sampled=False, stack_depth=8):
+        self.sampled = sampled
+        self.stack_depth = stack_depth
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.slowest = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.details = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper: вызывается на каждый SQL-запрос соединения
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.sql_time += duration
+            if duration > self.slowest:
+                self.slowest = duration
+            if self.sampled:
+                self.details.append({
+                    'sql': sql,
+                    'ms': round(duration * 1000, 3),
+                    'stack': project_stack(self.stack_depth),
+                })
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} SQL"',
+            f'db-max;dur={self.slowest * 1000:.1f}',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="hit {self.cache_hits}, miss {self.cache_misses}"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+    def as_dict(self, request, response, total):
+        return {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'view': getattr(request.resolver_match, 'view_name', None),
+            'ms': round(total * 1000, 1),
+            'sql_count': self.queries,
+            'sql_ms': round(self.sql_time * 1000, 1),
+            'sql_max_ms': round(self.slowest * 1000, 1),
+            'template_ms': round(self.template_time * 1000, 1),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+def project_stack(depth):
+    # Кадры стека из кода проекта (без библиотек и самого модуля замеров), начиная с ближайшего
+    base = str(settings.BASE_DIR)
+    frames = [
+        f'{os.path.relpath(frame.filename, base)}:{frame.lineno} {frame.name}'
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(base) and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ]
+    return frames[::-1][:depth]
+
+
+def _instrument_templates():
+    if getattr(Template.render, 'instrumented', False):
+        return
+    original = Template.render
+
+    @wraps(original)
+    def render(self, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None:
+            return original(self, *args, **kwargs)
+        # Вложенная отрисовка (render_to_string внутри шаблонного тега) не считается дважды
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+    render.instrumented = True
+    Template.render = render
+
+
+def _instrument_cache_class(backend):
+    if getattr(backend.get, 'instrumented', False):
+        return
+    original_get = backend.get
+    original_get_many = backend.get_many
+
+    @wraps(original_get)
+    def get(self, key, default=None, version=None):
+        metrics = _current.get()
+        if metrics is None:
+            return original_get(self, key, default, version)
+        value = original_get(self, key, _MISSING, version)
+        if value is _MISSING:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+
+    @wraps(original_get_many)
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = original_get_many(self, keys, version)
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+
+    get.instrumented = True
+    backend.get = get
+    # Базовый get_many сам вызывает get() для каждого ключа - его не оборачиваем, чтобы не считать дважды
+    if original_get_many is not BaseCache.get_many:
+        backend.get_many = get_many
+
+
+def instrument():
+    _instrument_templates()
+    for alias in settings.CACHES:
+        _instrument_cache_class(import_string(settings.CACHES[alias]['BACKEND']))
+
+
+class RequestMetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_config()
+        instrument()
+        for handler in logger.handlers + slow_logger.handlers:
+            filename = getattr(handler, 'baseFilename', None)
+            if filename:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    def __call__(self, request):
+        config = self.config
+        sampled = config['SAMPLE_RATE'] > 0 and random.random() < config['SAMPLE_RATE']
+        metrics = RequestMetrics(sampled, config['STACK_DEPTH'])
+        token = _current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        total = metrics.total
+        if config['SERVER_TIMING']:
+            response['Server-Timing'] = metrics.server_timing(total)
+        if config['LOG'] and logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(metrics.as_dict(request, response, total), ensure_ascii=False))
+        if sampled and total * 1000 >= config['SLOW_MS']:
+            record = metrics.as_dict(request, response, total)
+            record['query_string'] = request.META.get('QUERY_STRING', '')
+            record['queries'] = metrics.details
+            slow_logger.warning(json.dumps(record, ensure_ascii=False))
+        return response
@@ -0,0 +1,175 @@
+"""
+Раздача загруженных файлов (MEDIA_ROOT) в рабочем режиме.
+
+django.conf.urls.static.static() работает только при DEBUG, поэтому обложки и электронные книги
+отдаются этим представлением. Оно поддерживает:
+- запросы диапазонов (Range/If-Range) - докачка и перемотка PDF в браузере;
+- строгие ETag и Last-Modified с ответом 304 на If-None-Match/If-Modified-Since;
+- отдачу через os.sendfile без копирования в Python: файл передаётся в wsgi.file_wrapper
+  (gunicorn отправляет его через sendfile ровно в пределах Content-Length);
+- режим MEDIA_SENDFILE = 'x-accel-redirect' (nginx) или 'x-sendfile' (apache/lighttpd),
+  в котором Django только проверяет права, а файл отдаёт прокси.
+Электронные книги (books/e_books) доступны только суперпользователю - так же, как ссылки на них.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from books.storage import blob_digest
+
+PROTECTED_PREFIXES = ('books/e_books/',)
+IMMUTABLE_PREFIXES = ('thumbs/',)
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """
+    Файл, читаемый только в пределах [start, start + length).
+    fileno() оставлен, чтобы сервер мог отдать диапазон через sendfile
+    с текущей позиции файла и длиной из Content-Length.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """Возвращает (start, end) для одного диапазона, None - если отдавать весь файл, ValueError - если диапазон недопустим."""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Несколько диапазонов сразу не поддерживаются: по RFC 9110 можно отдать файл целиком
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError
+    return start, end
+
+
+def make_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def if_range_matches(request, etag, mtime):
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith('"'):
+        return value == etag
+    since = parse_http_date_safe(value)
+    return since is not None and since == int(mtime)
+
+
+def cache_control(path):
+    if path.startswith(PROTECTED_PREFIXES):
+        return 'private, no-cache'
+    if path.startswith(IMMUTABLE_PREFIXES) or blob_digest(path):
+        # Уменьшенные копии и файлы хранилища books/storage.py адресуются хэшем содержимого и не меняются
+        return 'public, max-age=31536000, immutable'
+    return 'public, max-age=86400'
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    # Права и кэширование проверяются по нормализованному пути: books//e_books/ и books/./e_books/ -
+    # тот же каталог, что и books/e_books/
+    path = os.path.relpath(full_path, os.path.abspath(settings.MEDIA_ROOT)).replace(os.sep, '/')
+    if path.startswith(PROTECTED_PREFIXES) and not request.user.is_superuser:
+        raise Http404('Файл не найден')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Файл не найден')
+    if not os.path.isfile(full_path):
+        raise Http404('Файл не найден')
+
+    etag = make_etag(stat)
+    mtime = stat.st_mtime
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': cache_control(path),
+    }
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(mtime))
+    if not_modified is not None:
+        for name, value in headers.items():
+            not_modified.headers.setdefault(name, value)
+        return not_modified
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    if mode:
+        # Файл отдаёт прокси-сервер (он же обрабатывает Range); Django только проверил права
+        response = HttpResponse(content_type=content_type, headers=headers)
+        if mode == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_PREFIX + path)
+        else:
+            response['X-Sendfile'] = full_path
+        return response
+
+    size = stat.st_size
+    start, end = 0, size - 1
+    status = 200
+    range_header = request.headers.get('Range')
+    if range_header and if_range_matches(request, etag, mtime):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+        if byte_range is not None:
+            start, end = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    length = end - start + 1 if size else 0
+    headers['Content-Length'] = str(length)
+
+    if request.method == 'HEAD':
+        return HttpResponse(status=status, content_type=content_type, headers=headers)
+
+    response = FileResponse(RangeFile(open(full_path, 'rb'), start, length), status=status, content_type=content_type)
+    for name, value in headers.items():
+        response[name] = value
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
@@ -62,10 +62,12 @@ INSTALLED_APPS = [
     'mptt',
     'books',
     'users',
+    'jobs',
     'bootstrap',
 ]
 
 MIDDLEWARE = [
+    'mylibrary.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,6 +93,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'books.context_processors.catalog',
             ],
         },
     },
@@ -105,12 +108,19 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Обработчики фоновых задач пишут в базу параллельно с веб-процессами
+        'OPTIONS': {'timeout': 20},
     }
 }
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Отдача загруженных файлов через прокси-сервер: None (отдаёт Django через sendfile),
+# 'x-accel-redirect' (nginx, location MEDIA_ACCEL_PREFIX с internal) или 'x-sendfile'
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -152,13 +162,73 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Общий для всех процессов сервера кэш в файле SQLite с вытеснением давно не читавшихся записей
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'mylibrary.sqlite_cache.SQLiteCache',
+        'LOCATION': BASE_DIR / 'cache' / 'cache.sqlite3',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'MAX_SIZE': 128 * 1024 * 1024,
+        },
     }
 }
 
+# Замеры запросов (mylibrary/instrumentation.py): заголовок Server-Timing, строка JSON на каждый запрос
+# в logs/requests.log и подробности (SQL со стеком вызова) для доли SAMPLE_RATE запросов дольше SLOW_MS
+INSTRUMENTATION = {
+    'SERVER_TIMING': True,
+    'LOG': True,
+    'SAMPLE_RATE': float(os.getenv('INSTRUMENTATION_SAMPLE_RATE') or 0),
+    'SLOW_MS': int(os.getenv('INSTRUMENTATION_SLOW_MS') or 500),
+}
+
+# Очередь фоновых задач (jobs/queue.py); IMMEDIATE - выполнять задачи сразу, без run_workers
+JOBS = {
+    'IMMEDIATE': os.getenv('JOBS_IMMEDIATE', '') == '1',
+    'POLL_INTERVAL': 1.0,
+    'STALE_AFTER': 600,
+    'KEEP_DONE_DAYS': 7,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'timestamped': {'format': '%(asctime)s %(message)s'},
+    },
+    'handlers': {
+        'requests': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': BASE_DIR / 'logs' / 'requests.log',
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'timestamped',
+        },
+        'slow_requests': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': BASE_DIR / 'logs' / 'slow_requests.log',
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'timestamped',
+        },
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'timestamped',
+        },
+    },
+    'loggers': {
+        'mylibrary.requests': {'handlers': ['requests'], 'level': 'INFO', 'propagate': False},
+        'mylibrary.slow_requests': {'handlers': ['slow_requests'], 'level': 'WARNING', 'propagate': False},
+        'jobs': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 LOGIN_URL = 'users:login'
 
 AUTHENTICATION_BACKENDS = [
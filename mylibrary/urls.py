@@ -1,7 +1,7 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from mylibrary import settings
-from django.conf.urls.static import static
+from mylibrary.media import serve_media
 from books import views
 from books.views import CategoryListView, BookByCategoryView
 from django.views.decorators.cache import cache_page
@@ -19,7 +19,8 @@ urlpatterns = [
     path('<str:slug>/', BookByCategoryView.as_view(), name='book-by-category'),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Загруженные файлы: обложки и электронные книги (с поддержкой Range, ETag и sendfile)
+urlpatterns.insert(0, re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='media'))
 
 
 if settings.DEBUG:
@@ -2,7 +2,9 @@ import datetime
 
 from django import forms
 from django.contrib.auth import get_user_model
-from django.contrib.auth.forms import AuthenticationForm, UserCreationForm, PasswordChangeForm
+from django.contrib.auth.forms import AuthenticationForm, UserCreationForm, PasswordChangeForm, PasswordResetForm
+
+from .tasks import send_password_reset
 
 
 class RegisterUserForm(UserCreationForm):
@@ -86,4 +88,14 @@ class UserPasswordChangeForm(PasswordChangeForm):
     new_password2 = forms.CharField(
         label='Повторите новый пароль',
         widget=forms.PasswordInput(attrs={'class': 'form-control' , 'placeholder': 'Повторите новый пароль'})
-    )
\ No newline at end of file
+    )
+
+class UserPasswordResetForm(PasswordResetForm):
+    """Письмо для сброса пароля отрисовывает и отправляет фоновая задача; в её аргументах нет токена."""
+
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email,
+                  html_email_template_name=None):
+        send_password_reset.enqueue(
+            context['user'].pk, to_email, context['domain'], context['site_name'], context['protocol'],
+            subject_template_name, email_template_name, from_email, html_email_template_name,
+        )
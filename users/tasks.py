@@ -0,0 +1,38 @@
+"""Фоновые задачи приложения users."""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.forms import PasswordResetForm
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from jobs.queue import task
+
+
+@task('users.send_mail', priority=10, max_attempts=8, backoff=30)
+def send_mail(subject, body, from_email, to, html_body=None):
+    # Письмо уже отрисовано в запросе; здесь только отправка через SMTP с повторами при сбоях
+    message = EmailMultiAlternatives(subject, body, from_email, to)
+    if html_body:
+        message.attach_alternative(html_body, 'text/html')
+    message.send()
+
+
+@task('users.send_password_reset', priority=10, max_attempts=8, backoff=30)
+def send_password_reset(user_id, to_email, domain, site_name, protocol, subject_template_name,
+                        email_template_name, from_email=None, html_email_template_name=None):
+    # Ссылка с токеном отрисовывается только здесь: аргументы задачи хранятся в базе и видны в админке очереди
+    user = get_user_model()._default_manager.filter(pk=user_id).first()
+    if user is None:
+        return
+    context = {
+        'email': to_email,
+        'domain': domain,
+        'site_name': site_name,
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'user': user,
+        'token': default_token_generator.make_token(user),
+        'protocol': protocol,
+    }
+    PasswordResetForm().send_mail(subject_template_name, email_template_name, context, from_email, to_email,
+                                  html_email_template_name)
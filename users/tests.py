@@ -1,3 +1,36 @@
-from django.test import TestCase
+import json
+import re
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from jobs.models import Job
+from .tasks import send_password_reset
+
+
+@override_settings(
+    JOBS={'IMMEDIATE': False},
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    INSTRUMENTATION={'LOG': False, 'SERVER_TIMING': False},
+)
+class PasswordResetTests(TestCase):
+
+    def test_reset_link_is_not_stored_in_job(self):
+        user = get_user_model().objects.create_user('reader', 'reader@example.com', 'secret')
+        response = self.client.post(reverse('users:password_reset'), {'email': 'reader@example.com'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+
+        job = Job.objects.get(name='users.send_password_reset')
+        stored = json.dumps([job.args, job.kwargs])
+        self.assertNotIn('/reset/', stored)
+        self.assertIn(user.pk, job.args)
+
+        send_password_reset.func(*job.args, **job.kwargs)
+        self.assertEqual(len(mail.outbox), 1)
+        link = re.search(r'https?://[^/]+(/\S*/reset/\S+/)', mail.outbox[0].body)[1]
+        # Действующий токен: страница подтверждения перенаправляет на форму нового пароля
+        self.assertRedirects(self.client.get(link), link.rsplit('/', 2)[0] + '/set-password/',
+                             fetch_redirect_response=False)
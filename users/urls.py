@@ -2,6 +2,7 @@ from django.contrib.auth import views as auth_views
 from django.urls import reverse_lazy, path
 
 from . import views
+from .forms import UserPasswordResetForm
 
 app_name = 'users'  # простравство имён для приложений
 
@@ -20,6 +21,7 @@ urlpatterns = [
     path('profile_books/', views.UserBooksView.as_view(), name='profile_books'),
     # маршрут для сброса пароля
     path('password_reset/', auth_views.PasswordResetView.as_view(
+        form_class=UserPasswordResetForm,
         template_name='users/password_reset_form.html',
         email_template_name='users/password_reset_email.html',
         success_url=reverse_lazy('users:password_reset_done'),
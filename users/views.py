@@ -3,6 +3,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.views import LoginView, LogoutView, PasswordChangeView
 from django.shortcuts import render, redirect, reverse
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
 from django.db.models import F, Q
 from django.views.generic import TemplateView, CreateView, ListView
 from django.views import View
@@ -15,6 +16,7 @@ from .forms import (
     UserPasswordChangeForm,
     ProfileUserForm,
 )
+from books.conditional import list_condition
 from books.models import Book,Favorite
 from books.views import MenuMixin
 
@@ -73,6 +75,7 @@ class UserPasswordChangeDone(PasswordChangeView):
     extra_context = {'title': 'Смена пароля'}
 
 
+@method_decorator(list_condition, name='dispatch')
 class UserBooksView(ListView):
     model = Book
     template_name = 'users/profile_books.html'
@@ -80,10 +83,5 @@ class UserBooksView(ListView):
     extra_context = {'title': 'Мои книги', 'active_tab': 'profile_books'}
 
     def get_queryset(self):
-        queryset = Book.objects.filter(id__in = Favorite.objects.filter(user=self.request.user).values('book'))
+        queryset = Book.objects.cards(self.request.user).filter(favorite__user=self.request.user).order_by('title')
         return queryset
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['favorite_books'] = Book.objects.filter(id__in = Favorite.objects.filter(user=self.request.user).values('book'))
-        return context